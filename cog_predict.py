@@ -11,11 +11,9 @@ os.system('python setup.py develop')
 import cv2
 import shutil
 import tempfile
-import torch
-from basicsr.archs.rrdbnet_arch import RRDBNet
-from basicsr.archs.srvgg_arch import SRVGGNetCompact
 
 from realesrgan.utils import RealESRGANer
+from realesrgan.zoo import MODELS, ModelRegistry, build_model
 
 try:
     from cog import BasePredictor, Input, Path
@@ -23,6 +21,15 @@ try:
 except Exception:
     print('please install cog and realesrgan package')
 
+# versions of the predictor: model names in the zoo
+VERSIONS = {
+    'General - RealESRGANplus': 'RealESRGAN_x4plus',
+    'General - v3': 'realesr-general-x4v3',
+    'Anime - anime6B': 'RealESRGAN_x4plus_anime_6B',
+    'AnimeVideo - v3': 'realesr-animevideov3'
+}
+DEFAULT_VERSION = 'General - v3'
+
 
 class Predictor(BasePredictor):
 
@@ -48,29 +55,25 @@ class Predictor(BasePredictor):
                 'wget https://github.com/xinntao/Real-ESRGAN/releases/download/v0.2.5.0/realesr-animevideov3.pth -P ./weights'
             )
 
-    def choose_model(self, scale, version, tile=0):
-        half = True if torch.cuda.is_available() else False
-        if version == 'General - RealESRGANplus':
-            model = RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=4)
-            model_path = 'weights/RealESRGAN_x4plus.pth'
-            self.upsampler = RealESRGANer(
-                scale=4, model_path=model_path, model=model, tile=tile, tile_pad=10, pre_pad=0, half=half)
-        elif version == 'General - v3':
-            model = SRVGGNetCompact(num_in_ch=3, num_out_ch=3, num_feat=64, num_conv=32, upscale=4, act_type='prelu')
-            model_path = 'weights/realesr-general-x4v3.pth'
-            self.upsampler = RealESRGANer(
-                scale=4, model_path=model_path, model=model, tile=tile, tile_pad=10, pre_pad=0, half=half)
-        elif version == 'Anime - anime6B':
-            model = RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=6, num_grow_ch=32, scale=4)
-            model_path = 'weights/RealESRGAN_x4plus_anime_6B.pth'
-            self.upsampler = RealESRGANer(
-                scale=4, model_path=model_path, model=model, tile=tile, tile_pad=10, pre_pad=0, half=half)
-        elif version == 'AnimeVideo - v3':
-            model = SRVGGNetCompact(num_in_ch=3, num_out_ch=3, num_feat=64, num_conv=16, upscale=4, act_type='prelu')
-            model_path = 'weights/realesr-animevideov3.pth'
-            self.upsampler = RealESRGANer(
-                scale=4, model_path=model_path, model=model, tile=tile, tile_pad=10, pre_pad=0, half=half)
+        # load and warm up the default version ahead of time, the others are loaded on their first request
+        self.registry = ModelRegistry()
+        self.build_upsampler(DEFAULT_VERSION).warmup()
+
+    def build_upsampler(self, version, tile=0):
+        # the weights are loaded only once, later requests share the loaded models of the registry
+        model_name = VERSIONS[version]
+        return RealESRGANer(
+            scale=MODELS[model_name]['netscale'],
+            model_path=f'weights/{model_name}.pth',
+            model=build_model(model_name),
+            tile=tile,
+            tile_pad=10,
+            pre_pad=0,
+            precision='auto',
+            registry=self.registry)
 
+    def choose_model(self, scale, version, tile=0):
+        self.upsampler = self.build_upsampler(version, tile)
         self.face_enhancer = GFPGANer(
             model_path='weights/GFPGANv1.4.pth',
             upscale=scale,
@@ -84,7 +87,7 @@ class Predictor(BasePredictor):
         version: str = Input(
             description='RealESRGAN version. Please see [Readme] below for more descriptions',
             choices=['General - RealESRGANplus', 'General - v3', 'Anime - anime6B', 'AnimeVideo - v3'],
-            default='General - v3'),
+            default=DEFAULT_VERSION),
         scale: float = Input(description='Rescaling factor', default=2),
         face_enhance: bool = Input(
             description='Enhance faces with GFPGAN. Note that it does not work for anime images/vidoes', default=False),
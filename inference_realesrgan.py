@@ -1,19 +1,297 @@
 import argparse
-import cv2
-import glob
+import itertools
+import multiprocessing
 import os
-from basicsr.archs.rrdbnet_arch import RRDBNet
-from basicsr.utils.download_util import load_file_from_url
+import queue
+import sys
+import threading
+import time
+import torch
 
-from realesrgan import RealESRGANer
-from realesrgan.archs.srvgg_arch import SRVGGNetCompact
+from realesrgan import (IOConsumer, PrefetchReader, RealESRGANer, TileCache, checkpoint_id, has_mmap_copy,
+                        resolve_precision, save_mmap_checkpoint, set_intra_op_threads)
+from realesrgan.discovery import filter_shard, iter_inputs
+from realesrgan.manifest import Manifest, params_key
+from realesrgan.quantize import INT8_SUFFIX
+from realesrgan.zoo import MODELS, build_model
+
+# models that can be replaced by a cheaper model with a smaller network scale: {model name: (cheaper model, netscale)}
+CHEAPER_MODELS = {'RealESRGAN_x4plus': ('RealESRGAN_x2plus', 2)}
+
+
+def plan_model(model_name, outscale):
+    """Route to a cheaper model when the outscale does not need the full network scale.
+
+    E.g., RealESRGAN_x2plus (same training setting as RealESRGAN_x4plus) upsamples x2 outputs with 1/4 of the
+    network output pixels, and without the down-sampling pass.
+    """
+    if model_name in CHEAPER_MODELS:
+        cheaper_model, netscale = CHEAPER_MODELS[model_name]
+        if outscale <= netscale:
+            print(f'\tOutscale {outscale} <= {netscale}: use {cheaper_model} instead of {model_name}')
+            return cheaper_model
+    return model_name
+
+
+def get_save_path(args, path, img):
+    """Output path of an input image: the suffix and the extension follow the options, RGBA images are saved as png."""
+    imgname, extension = os.path.splitext(os.path.basename(path))
+    if args.ext == 'auto':
+        extension = extension[1:]
+    else:
+        extension = args.ext
+    if len(img.shape) == 3 and img.shape[2] == 4:  # RGBA images should be saved in png format
+        extension = 'png'
+    folder = args.output
+    if args.recursive and os.path.isdir(args.input):  # mirror the sub-folders of the input folder
+        subfolder = os.path.relpath(os.path.dirname(os.path.abspath(path)), os.path.abspath(args.input))
+        if subfolder != '.' and not subfolder.startswith('..'):
+            folder = os.path.join(args.output, subfolder)
+            os.makedirs(folder, exist_ok=True)
+    if args.suffix == '':
+        return os.path.join(folder, f'{imgname}.{extension}')
+    return os.path.join(folder, f'{imgname}_{args.suffix}.{extension}')
+
+
+def get_manifest_name(shard_index, shard_count):
+    """File name of the manifest in the output folder. Each shard has its own one, so hosts never append to one file."""
+    return 'manifest.jsonl' if shard_count <= 1 else f'manifest.shard{shard_index}of{shard_count}.jsonl'
+
+
+def get_params(args, model_path):
+    """The model and the options that the outputs depend on, for the manifest.
+
+    The weights are identified by checkpoint_id (so replaced weights are processed again), and the precision is
+    resolved for the device, as RealESRGANer does.
+    """
+    weights = [checkpoint_id(path) for path in (model_path if isinstance(model_path, list) else [model_path])]
+    if args.int8:
+        precision = 'fp32'
+    else:
+        device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        precision = resolve_precision('fp32' if args.fp32 else args.precision, device)
+    options = [
+        'model_name', 'denoise_strength', 'outscale', 'face_enhance', 'alpha_upsampler', 'tile', 'tile_pad', 'pre_pad',
+        'flat_threshold', 'int8', 'ext', 'suffix'
+    ]
+    params = {option: getattr(args, option) for option in options}
+    params.update(weights=weights, precision=precision)
+    return params
+
+
+def build_upsampler(args, model_path, dni_weight):
+    """Build the restorer (and the face enhancer with --face_enhance) of the options."""
+    tile_cache = None
+    if args.tile_cache > 0:
+        tile_cache = TileCache(
+            max_memory=args.tile_cache * 1024**2,
+            cache_dir=args.tile_cache_dir,
+            max_disk=args.tile_cache_disk * 1024**2)
+
+    # restorer
+    upsampler = RealESRGANer(
+        scale=MODELS[args.model_name]['netscale'],
+        model_path=model_path,
+        dni_weight=dni_weight,
+        model=build_model(args.model_name),
+        tile=args.tile,
+        tile_pad=args.tile_pad if args.tile_pad == 'auto' else int(args.tile_pad),
+        tile_batch=args.tile_batch,
+        flat_threshold=args.flat_threshold,
+        tile_cache=tile_cache,
+        backend=args.backend,
+        pre_pad=args.pre_pad,
+        precision='fp32' if args.fp32 else args.precision,
+        gpu_id=args.gpu_id)
+    print(f'Precision: {upsampler.precision} on {upsampler.device}')
+
+    face_enhancer = None
+    if args.face_enhance:  # Use GFPGAN for face enhancement
+        from gfpgan import GFPGANer
+        face_enhancer = GFPGANer(
+            model_path='https://github.com/TencentARC/GFPGAN/releases/download/v1.3.0/GFPGANv1.3.pth',
+            upscale=args.outscale,
+            arch='clean',
+            channel_multiplier=2,
+            bg_upsampler=upsampler)
+    return upsampler, face_enhancer
+
+
+def upsample_images(args, upsampler, face_enhancer, paths, report):
+    """Upsample images with a three-stage pipeline, and call report(path, error, save_path) for each image.
+
+    The stages are connected by bounded queues (back-pressure): a decode pool, the inference in this thread, and
+    encode workers, so that the model does not wait for the decoding and the (slow) PNG encoding. error is None when
+    the output is written.
+    """
+
+    def on_written(msg, written):
+        report(msg['path'], None if written else 'cannot write the output', msg['save_path'])
+
+    reader = PrefetchReader(paths, args.queue_size, num_workers=args.decode_workers, with_path=True)
+    save_queue = queue.Queue(args.queue_size)
+    writers = [IOConsumer(args, save_queue, qid, callback=on_written) for qid in range(max(args.encode_workers, 1))]
+    for writer in writers:
+        writer.start()
+    reader.start()
+    start_time = time.perf_counter()
+    infer_time = 0.
+
+    def upsample(group):
+        nonlocal infer_time
+        infer_start = time.perf_counter()
+        try:
+            if args.face_enhance:
+                _, _, output = face_enhancer.enhance(
+                    group[0][1], has_aligned=False, only_center_face=False, paste_back=True)
+                outputs = [output]
+            else:
+                results = upsampler.enhance_batch([img for _, img in group],
+                                                  outscale=args.outscale,
+                                                  alpha_upsampler=args.alpha_upsampler)
+                outputs = [output for output, _ in results]
+        except RuntimeError as error:
+            print('Error', error)
+            print('If you encounter CUDA out of memory, try to set --tile with a smaller number.')
+            for path, _ in group:
+                report(path, str(error))
+            return
+        finally:
+            infer_time += time.perf_counter() - infer_start
+        for (path, img), output in zip(group, outputs):
+            save_queue.put({'output': output, 'save_path': get_save_path(args, path, img), 'path': path})
+
+    # images are upsampled in groups of batch_size, same-size images in a group share the forward passes
+    batch_size = 1 if args.face_enhance else max(args.batch_size, 1)
+    try:
+        group = []
+        for idx, (path, img) in enumerate(reader):
+            print('Testing', idx, os.path.splitext(os.path.basename(path))[0])
+            if img is None:
+                print(f'Error: cannot read {path}')
+                report(path, 'cannot read the input')
+                continue
+            group.append((path, img))
+            if len(group) == batch_size:
+                upsample(group)
+                group = []
+        if group:
+            upsample(group)
+    finally:
+        # clean shutdown: the writers finish the queued images first
+        for _ in writers:
+            save_queue.put('quit')
+        for writer in writers:
+            writer.join()
+
+    elapsed = time.perf_counter() - start_time
+    encode_time = sum(writer.busy for writer in writers)
+    print(f'{sum(writer.count for writer in writers)} images in {elapsed:.1f} s. Utilization: '
+          f'decode {reader.busy / (elapsed * reader.num_workers):.0%} ({reader.num_workers} workers), '
+          f'infer {infer_time / elapsed:.0%}, encode {encode_time / (elapsed * len(writers)):.0%} '
+          f'({len(writers)} workers)')
+
+    if upsampler.tile_stats['flat']:
+        print(f'Skipped {upsampler.tile_stats["flat"]}/{upsampler.tile_stats["tiles"]} flat tiles')
+    if upsampler.tile_cache is not None:
+        print(upsampler.tile_cache.report())
+
+
+def iter_tasks(tasks):
+    """Yield the paths of a task queue until None."""
+    while True:
+        path = tasks.get()
+        if path is None:
+            return
+        yield path
+
+
+def worker(args, model_path, dni_weight, tasks, worker_idx, num_workers, progress):
+    """A worker process of --workers: one model, and its share of the CPU cores."""
+    num_threads = set_intra_op_threads(num_workers)
+    print(f'Worker {worker_idx}: {num_threads} intra-op threads')
+    upsampler, face_enhancer = build_upsampler(args, model_path, dni_weight)
+    paths = iter_tasks(tasks)
+
+    def report(path, error, save_path=None):
+        progress.put((worker_idx, path, error, save_path))
+
+    upsample_images(args, upsampler, face_enhancer, paths, report)
+    progress.put((worker_idx, None, None, None))
+
+
+def run_workers(args, model_path, dni_weight, paths, report):
+    """Distribute the images across args.workers processes, and aggregate their progress and failures.
+
+    The paths are fed to a bounded task queue as they are discovered, and each worker takes the next one when it is
+    ready, so a slow image does not hold up a static share. The reports of the workers are passed to
+    report(path, error, save_path) in this process.
+    """
+    num_workers = args.workers
+    ctx = multiprocessing.get_context('spawn')
+    tasks = ctx.Queue(args.queue_size * num_workers)
+    progress = ctx.Queue()
+    processes = [
+        ctx.Process(target=worker, args=(args, model_path, dni_weight, tasks, i, num_workers, progress))
+        for i in range(num_workers)
+    ]
+    for process in processes:
+        process.start()
+
+    feed_errors = []
+
+    def feed():
+        try:
+            for path in paths:
+                tasks.put(path)
+        except Exception as error:  # e.g., of a folder scan, raised again after the workers finish their tasks
+            feed_errors.append(error)
+        finally:
+            for _ in processes:
+                tasks.put(None)
+
+    threading.Thread(target=feed, daemon=True).start()
+
+    num_done = 0
+    running = set(range(num_workers))
+    exited = set()
+    while running:
+        try:
+            worker_idx, path, error, save_path = progress.get(timeout=1)
+        except queue.Empty:
+            for i in list(running):
+                if processes[i].is_alive():
+                    continue
+                # a worker that exited normally may have reports left in the queue, it crashed only if they do not
+                # arrive before the next timeout
+                if processes[i].exitcode != 0 or i in exited:
+                    running.discard(i)
+                    report(f'worker {i}', f'exit code {processes[i].exitcode}')
+                else:
+                    exited.add(i)
+            continue
+        if path is None:
+            running.discard(worker_idx)
+            continue
+        num_done += 1
+        report(path, error, save_path)
+        print(f'[{num_done}] {"Failed" if error else "Done"}: {path}')
+    for process in processes:
+        process.join()
+    if feed_errors:
+        raise feed_errors[0]
 
 
 def main():
     """Inference demo for Real-ESRGAN.
     """
     parser = argparse.ArgumentParser()
-    parser.add_argument('-i', '--input', type=str, default='inputs', help='Input image or folder')
+    parser.add_argument(
+        '-i', '--input', type=str, default='inputs', help='Input image or folder, or - for a list of paths from stdin')
+    parser.add_argument(
+        '--input_list', type=str, default=None, help='A file with one input path per line, or - for stdin')
+    parser.add_argument(
+        '-r', '--recursive', action='store_true', help='Also process the sub-folders, mirrored in the output folder')
     parser.add_argument(
         '-n',
         '--model_name',
@@ -32,64 +310,129 @@ def main():
     parser.add_argument('-s', '--outscale', type=float, default=4, help='The final upsampling scale of the image')
     parser.add_argument(
         '--model_path', type=str, default=None, help='[Option] Model path. Usually, you do not need to specify it')
+    parser.add_argument(
+        '--cheaper_model',
+        action='store_true',
+        help='Use a cheaper model with a smaller network scale if the outscale allows, e.g., x2plus for -s 2')
     parser.add_argument('--suffix', type=str, default='out', help='Suffix of the restored image')
     parser.add_argument('-t', '--tile', type=int, default=0, help='Tile size, 0 for no tile during testing')
-    parser.add_argument('--tile_pad', type=int, default=10, help='Tile padding')
+    parser.add_argument(
+        '--tile_pad',
+        type=str,
+        default='auto',
+        help='Tile padding. auto for deriving it from the model (receptive field and a cached seam probe)')
+    parser.add_argument(
+        '--backend',
+        type=str,
+        default='torch',
+        help=('Execution backend. Options: torch | trace | compile | onnx | <path>.onnx. trace and compile specialize '
+              'the network to each input (tile) shape in channels_last layout, checked against the eager output. onnx '
+              'exports the network (cached) and runs it with ONNX Runtime on the CPU'))
+    parser.add_argument(
+        '--int8',
+        action='store_true',
+        help='Run the int8 quantized model (weights/<model_name>.int8.pt, see scripts/quantize_int8.py) on the CPU')
+    parser.add_argument(
+        '--tile_batch',
+        type=int,
+        default=1,
+        help='Number of tiles upsampled in one forward pass. 0 for deriving it from the free memory')
+    parser.add_argument(
+        '--flat_threshold',
+        type=float,
+        default=None,
+        help=('In tile mode, upsample near-constant tiles without the network if their (max - min) is not larger '
+              'than it, e.g., 0.008 (2 levels of 8-bit). Default: disabled'))
+    parser.add_argument(
+        '--tile_cache',
+        type=int,
+        default=0,
+        help='In tile mode, size (in MB) of the in-memory cache of upsampled tiles. 0 for no cache')
+    parser.add_argument(
+        '--tile_cache_dir',
+        type=str,
+        default=None,
+        help='Folder of the on-disk tile cache, which is kept between runs. Use with --tile_cache')
+    parser.add_argument(
+        '--tile_cache_disk', type=int, default=4096, help='Size (in MB) of the on-disk tile cache. Default: 4096')
     parser.add_argument('--pre_pad', type=int, default=0, help='Pre padding size at each border')
+    parser.add_argument(
+        '--batch_size',
+        type=int,
+        default=1,
+        help='Number of images read and upsampled together. Same-size images are stacked into one batch')
+    parser.add_argument('--decode_workers', type=int, default=2, help='Number of threads that decode the inputs')
+    parser.add_argument(
+        '--encode_workers', type=int, default=2, help='Number of threads that encode the outputs, e.g., 4x PNG images')
+    parser.add_argument(
+        '--queue_size', type=int, default=8, help='Max number of decoded (and upsampled) images waiting in a queue')
+    parser.add_argument(
+        '--manifest',
+        type=str,
+        default=None,
+        help=('Manifest of the processed images, which are skipped by later runs while their inputs, outputs and '
+              'options are unchanged. Default: <output>/manifest.jsonl, or manifest.shard<i>of<n>.jsonl with shards'))
+    parser.add_argument('--force', action='store_true', help='Process all the images, even the up-to-date ones')
+    parser.add_argument(
+        '--shard-index', type=int, default=0, help='Process the inputs of this shard, in [0, --shard-count)')
+    parser.add_argument(
+        '--shard-count',
+        type=int,
+        default=1,
+        help=('Number of shards, e.g., hosts. The inputs are assigned by a stable hash of their paths, see '
+              'scripts/verify_shards.py to check the outputs of all the shards'))
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        help=('Number of processes that upsample the images, each with one model and a share of the CPU cores. '
+              'For many-core CPU hosts'))
     parser.add_argument('--face_enhance', action='store_true', help='Use GFPGAN to enhance face')
     parser.add_argument(
-        '--fp32', action='store_true', help='Use fp32 precision during inference. Default: fp16 (half precision).')
+        '--precision',
+        type=str,
+        default='auto',
+        help=('Precision during inference. Options: auto | fp32 | fp16 | bf16. auto is fp16 on GPUs, bf16 on CPUs with '
+              'native bf16 support, and fp32 elsewhere'))
+    parser.add_argument(
+        '--fp32', action='store_true', help='Use fp32 precision during inference, the same as --precision fp32')
     parser.add_argument(
         '--alpha_upsampler',
         type=str,
         default='realesrgan',
-        help='The upsampler for the alpha channels. Options: realesrgan | bicubic')
+        help='The upsampler for the alpha channels. Options: realesrgan | guided | bicubic')
     parser.add_argument(
         '--ext',
         type=str,
         default='auto',
         help='Image extension. Options: auto | jpg | png, auto means using the same extension as inputs')
+    parser.add_argument(
+        '--gigapixel',
+        action='store_true',
+        help=('Gigapixel mode: read the input lazily and write the output tile by tile to a memory-mapped file, '
+              'so that the peak memory is bounded by the tile size. Outputs are tif (default), npy or raw'))
     parser.add_argument(
         '-g', '--gpu-id', type=int, default=None, help='gpu device to use (default=None) can be 0,1,2 for multi-gpu')
 
     args = parser.parse_args()
+    if not 0 <= args.shard_index < args.shard_count:
+        parser.error(f'--shard-index should be in [0, {args.shard_count}), but got {args.shard_index}')
 
     # determine models according to model names
     args.model_name = args.model_name.split('.')[0]
-    if args.model_name == 'RealESRGAN_x4plus':  # x4 RRDBNet model
-        model = RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=4)
-        netscale = 4
-        file_url = ['https://github.com/xinntao/Real-ESRGAN/releases/download/v0.1.0/RealESRGAN_x4plus.pth']
-    elif args.model_name == 'RealESRNet_x4plus':  # x4 RRDBNet model
-        model = RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=4)
-        netscale = 4
-        file_url = ['https://github.com/xinntao/Real-ESRGAN/releases/download/v0.1.1/RealESRNet_x4plus.pth']
-    elif args.model_name == 'RealESRGAN_x4plus_anime_6B':  # x4 RRDBNet model with 6 blocks
-        model = RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=6, num_grow_ch=32, scale=4)
-        netscale = 4
-        file_url = ['https://github.com/xinntao/Real-ESRGAN/releases/download/v0.2.2.4/RealESRGAN_x4plus_anime_6B.pth']
-    elif args.model_name == 'RealESRGAN_x2plus':  # x2 RRDBNet model
-        model = RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=2)
-        netscale = 2
-        file_url = ['https://github.com/xinntao/Real-ESRGAN/releases/download/v0.2.1/RealESRGAN_x2plus.pth']
-    elif args.model_name == 'realesr-animevideov3':  # x4 VGG-style model (XS size)
-        model = SRVGGNetCompact(num_in_ch=3, num_out_ch=3, num_feat=64, num_conv=16, upscale=4, act_type='prelu')
-        netscale = 4
-        file_url = ['https://github.com/xinntao/Real-ESRGAN/releases/download/v0.2.5.0/realesr-animevideov3.pth']
-    elif args.model_name == 'realesr-general-x4v3':  # x4 VGG-style model (S size)
-        model = SRVGGNetCompact(num_in_ch=3, num_out_ch=3, num_feat=64, num_conv=32, upscale=4, act_type='prelu')
-        netscale = 4
-        file_url = [
-            'https://github.com/xinntao/Real-ESRGAN/releases/download/v0.2.5.0/realesr-general-wdn-x4v3.pth',
-            'https://github.com/xinntao/Real-ESRGAN/releases/download/v0.2.5.0/realesr-general-x4v3.pth'
-        ]
+    if args.cheaper_model and args.model_path is None:
+        args.model_name = plan_model(args.model_name, args.outscale)
+    file_url = MODELS[args.model_name]['urls']
 
     # determine model paths
     if args.model_path is not None:
         model_path = args.model_path
     else:
-        model_path = os.path.join('weights', args.model_name + '.pth')
-        if not os.path.isfile(model_path):
+        model_path = os.path.join('weights', args.model_name + (INT8_SUFFIX if args.int8 else '.pth'))
+        if args.int8 and not os.path.isfile(model_path):
+            raise FileNotFoundError(f'{model_path} does not exist, quantize the model with scripts/quantize_int8.py')
+        elif not os.path.isfile(model_path):
+            from basicsr.utils.download_util import load_file_from_url
             ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
             for url in file_url:
                 # model_path will be updated
@@ -98,68 +441,82 @@ def main():
 
     # use dni to control the denoise strength
     dni_weight = None
-    if args.model_name == 'realesr-general-x4v3' and args.denoise_strength != 1:
+    if not args.int8 and args.model_name == 'realesr-general-x4v3' and args.denoise_strength != 1:
         wdn_model_path = model_path.replace('realesr-general-x4v3', 'realesr-general-wdn-x4v3')
         model_path = [model_path, wdn_model_path]
         dni_weight = [args.denoise_strength, 1 - args.denoise_strength]
 
-    # restorer
-    upsampler = RealESRGANer(
-        scale=netscale,
-        model_path=model_path,
-        dni_weight=dni_weight,
-        model=model,
-        tile=args.tile,
-        tile_pad=args.tile_pad,
-        pre_pad=args.pre_pad,
-        half=not args.fp32,
-        gpu_id=args.gpu_id)
-
-    if args.face_enhance:  # Use GFPGAN for face enhancement
-        from gfpgan import GFPGANer
-        face_enhancer = GFPGANer(
-            model_path='https://github.com/TencentARC/GFPGAN/releases/download/v1.3.0/GFPGANv1.3.pth',
-            upscale=args.outscale,
-            arch='clean',
-            channel_multiplier=2,
-            bg_upsampler=upsampler)
     os.makedirs(args.output, exist_ok=True)
 
-    if os.path.isfile(args.input):
-        paths = [args.input]
-    else:
-        paths = sorted(glob.glob(os.path.join(args.input, '*')))
-
-    for idx, path in enumerate(paths):
-        imgname, extension = os.path.splitext(os.path.basename(path))
-        print('Testing', idx, imgname)
+    # discovered lazily, so that the processing starts right away on large folders
+    paths = iter_inputs(args.input, args.input_list, recursive=args.recursive, exclude=args.output)
+    if args.shard_count > 1:
+        # the inputs of this host, hashed by their path relative to the input folder (the same on every host)
+        root = args.input if os.path.isdir(args.input) else None
+        paths = filter_shard(paths, args.shard_index, args.shard_count, root)
 
-        img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
-        if len(img.shape) == 3 and img.shape[2] == 4:
-            img_mode = 'RGBA'
-        else:
-            img_mode = None
-
-        try:
-            if args.face_enhance:
-                _, _, output = face_enhancer.enhance(img, has_aligned=False, only_center_face=False, paste_back=True)
-            else:
-                output, _ = upsampler.enhance(img, outscale=args.outscale)
-        except RuntimeError as error:
-            print('Error', error)
-            print('If you encounter CUDA out of memory, try to set --tile with a smaller number.')
-        else:
-            if args.ext == 'auto':
-                extension = extension[1:]
-            else:
-                extension = args.ext
-            if img_mode == 'RGBA':  # RGBA images should be saved in png format
-                extension = 'png'
+    if args.gigapixel:
+        from realesrgan.gigapixel import enhance_large
+        upsampler, _ = build_upsampler(args, model_path, dni_weight)
+        extension = args.ext if args.ext in ('tif', 'tiff', 'npy', 'raw') else 'tif'
+        for idx, path in enumerate(paths):
+            imgname = os.path.splitext(os.path.basename(path))[0]
+            print('Testing', idx, imgname)
             if args.suffix == '':
                 save_path = os.path.join(args.output, f'{imgname}.{extension}')
             else:
                 save_path = os.path.join(args.output, f'{imgname}_{args.suffix}.{extension}')
-            cv2.imwrite(save_path, output)
+            enhance_large(upsampler, path, save_path, alpha_upsampler=args.alpha_upsampler, outscale=args.outscale)
+        return
+
+    # skip the inputs whose outputs are up to date in the manifest, e.g., after a crash or for a partial rerun
+    manifest_path = args.manifest or os.path.join(args.output, get_manifest_name(args.shard_index, args.shard_count))
+    manifest = Manifest(manifest_path)
+    params = get_params(args, model_path)
+    key = params_key(params)
+    num_skipped = 0
+
+    def skip_done(paths):
+        nonlocal num_skipped
+        for path in paths:
+            if manifest.is_done(path, key):
+                num_skipped += 1
+            else:
+                yield path
+
+    if not args.force:
+        paths = skip_done(paths)
+    first = next(paths, None)
+    paths = itertools.chain([first], paths) if first is not None else iter(())
+
+    failures = []
+
+    def report(path, error, save_path=None):
+        if error is not None:
+            failures.append((path, error))
+        else:
+            manifest.record(path, save_path, key)
+
+    if first is None:
+        print('No images to process')
+    elif args.workers > 1:
+        # the workers map one memory-mapped copy of the weights (in the precision they run in), instead of loading a
+        # copy each
+        if isinstance(model_path, str) and not model_path.endswith((INT8_SUFFIX, '.mmap.pth')):
+            if not has_mmap_copy(model_path, params['precision']):
+                print(f'Write the memory-mapped weights: {save_mmap_checkpoint(model_path, params["precision"])}')
+        run_workers(args, model_path, dni_weight, paths, report)
+    else:
+        upsampler, face_enhancer = build_upsampler(args, model_path, dni_weight)
+        upsample_images(args, upsampler, face_enhancer, paths, report)
+    if num_skipped:
+        print(f'Skipped {num_skipped} up-to-date images (see {manifest.path})')
+
+    if failures:
+        print(f'{len(failures)} failures:')
+        for path, error in failures:
+            print(f'\t{path}: {error}')
+        sys.exit(1)
 
 
 if __name__ == '__main__':
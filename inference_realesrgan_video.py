@@ -7,13 +7,13 @@ import os
 import shutil
 import subprocess
 import torch
-from basicsr.archs.rrdbnet_arch import RRDBNet
-from basicsr.utils.download_util import load_file_from_url
 from os import path as osp
 from tqdm import tqdm
 
 from realesrgan import RealESRGANer
-from realesrgan.archs.srvgg_arch import SRVGGNetCompact
+from realesrgan.discovery import shard_range
+from realesrgan.quantize import INT8_SUFFIX
+from realesrgan.zoo import MODELS, build_model
 
 try:
     import ffmpeg
@@ -81,6 +81,9 @@ class Reader:
                 self.paths = [args.input]
             else:
                 paths = sorted(glob.glob(os.path.join(args.input, '*')))
+                if args.shard_count > 1:  # the contiguous frames of this host, see --shard-count
+                    start, end = shard_range(len(paths), args.shard_index, args.shard_count)
+                    paths = paths[start:end]
                 tot_frames = len(paths)
                 num_frame_per_worker = tot_frames // total_workers + (1 if tot_frames % total_workers else 0)
                 self.paths = paths[num_frame_per_worker * worker_idx:num_frame_per_worker * (worker_idx + 1)]
@@ -173,37 +176,16 @@ class Writer:
 def inference_video(args, video_save_path, device=None, total_workers=1, worker_idx=0):
     # ---------------------- determine models according to model names ---------------------- #
     args.model_name = args.model_name.split('.pth')[0]
-    if args.model_name == 'RealESRGAN_x4plus':  # x4 RRDBNet model
-        model = RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=4)
-        netscale = 4
-        file_url = ['https://github.com/xinntao/Real-ESRGAN/releases/download/v0.1.0/RealESRGAN_x4plus.pth']
-    elif args.model_name == 'RealESRNet_x4plus':  # x4 RRDBNet model
-        model = RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=4)
-        netscale = 4
-        file_url = ['https://github.com/xinntao/Real-ESRGAN/releases/download/v0.1.1/RealESRNet_x4plus.pth']
-    elif args.model_name == 'RealESRGAN_x4plus_anime_6B':  # x4 RRDBNet model with 6 blocks
-        model = RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=6, num_grow_ch=32, scale=4)
-        netscale = 4
-        file_url = ['https://github.com/xinntao/Real-ESRGAN/releases/download/v0.2.2.4/RealESRGAN_x4plus_anime_6B.pth']
-    elif args.model_name == 'RealESRGAN_x2plus':  # x2 RRDBNet model
-        model = RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=2)
-        netscale = 2
-        file_url = ['https://github.com/xinntao/Real-ESRGAN/releases/download/v0.2.1/RealESRGAN_x2plus.pth']
-    elif args.model_name == 'realesr-animevideov3':  # x4 VGG-style model (XS size)
-        model = SRVGGNetCompact(num_in_ch=3, num_out_ch=3, num_feat=64, num_conv=16, upscale=4, act_type='prelu')
-        netscale = 4
-        file_url = ['https://github.com/xinntao/Real-ESRGAN/releases/download/v0.2.5.0/realesr-animevideov3.pth']
-    elif args.model_name == 'realesr-general-x4v3':  # x4 VGG-style model (S size)
-        model = SRVGGNetCompact(num_in_ch=3, num_out_ch=3, num_feat=64, num_conv=32, upscale=4, act_type='prelu')
-        netscale = 4
-        file_url = [
-            'https://github.com/xinntao/Real-ESRGAN/releases/download/v0.2.5.0/realesr-general-wdn-x4v3.pth',
-            'https://github.com/xinntao/Real-ESRGAN/releases/download/v0.2.5.0/realesr-general-x4v3.pth'
-        ]
+    model = build_model(args.model_name)
+    netscale = MODELS[args.model_name]['netscale']
+    file_url = MODELS[args.model_name]['urls']
 
     # ---------------------- determine model paths ---------------------- #
-    model_path = os.path.join('weights', args.model_name + '.pth')
-    if not os.path.isfile(model_path):
+    model_path = os.path.join('weights', args.model_name + (INT8_SUFFIX if args.int8 else '.pth'))
+    if args.int8 and not os.path.isfile(model_path):
+        raise FileNotFoundError(f'{model_path} does not exist, quantize the model with scripts/quantize_int8.py')
+    elif not os.path.isfile(model_path):
+        from basicsr.utils.download_util import load_file_from_url
         ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
         for url in file_url:
             # model_path will be updated
@@ -212,7 +194,7 @@ def inference_video(args, video_save_path, device=None, total_workers=1, worker_
 
     # use dni to control the denoise strength
     dni_weight = None
-    if args.model_name == 'realesr-general-x4v3' and args.denoise_strength != 1:
+    if not args.int8 and args.model_name == 'realesr-general-x4v3' and args.denoise_strength != 1:
         wdn_model_path = model_path.replace('realesr-general-x4v3', 'realesr-general-wdn-x4v3')
         model_path = [model_path, wdn_model_path]
         dni_weight = [args.denoise_strength, 1 - args.denoise_strength]
@@ -224,11 +206,13 @@ def inference_video(args, video_save_path, device=None, total_workers=1, worker_
         dni_weight=dni_weight,
         model=model,
         tile=args.tile,
-        tile_pad=args.tile_pad,
+        tile_pad=args.tile_pad if args.tile_pad == 'auto' else int(args.tile_pad),
+        tile_batch=args.tile_batch,
         pre_pad=args.pre_pad,
-        half=not args.fp32,
+        precision='fp32' if args.fp32 else args.precision,
         device=device,
     )
+    print(f'Precision: {upsampler.precision} on {upsampler.device}')
 
     if 'anime' in args.model_name and args.face_enhance:
         print('face_enhance is not supported in anime models, we turned this option off for you. '
@@ -262,7 +246,7 @@ def inference_video(args, video_save_path, device=None, total_workers=1, worker_
             if args.face_enhance:
                 _, _, output = face_enhancer.enhance(img, has_aligned=False, only_center_face=False, paste_back=True)
             else:
-                output, _ = upsampler.enhance(img, outscale=args.outscale)
+                output, _ = upsampler.enhance(img, outscale=args.outscale, alpha_upsampler=args.alpha_upsampler)
         except RuntimeError as error:
             print('Error', error)
             print('If you encounter CUDA out of memory, try to set --tile with a smaller number.')
@@ -276,9 +260,51 @@ def inference_video(args, video_save_path, device=None, total_workers=1, worker_
     writer.close()
 
 
+def concat_videos(args, video_paths, video_save_path):
+    """Concatenate videos (in args.output) without re-encoding them."""
+    vidlist_path = osp.join(args.output, f'{args.video_name}_vidlist.txt')
+    with open(vidlist_path, 'w') as f:
+        for video_path in video_paths:
+            f.write(f'file \'{osp.relpath(video_path, args.output)}\'\n')
+
+    cmd = [args.ffmpeg_bin, '-f', 'concat', '-safe', '0', '-i', vidlist_path, '-c', 'copy', f'{video_save_path}']
+    print(' '.join(cmd))
+    subprocess.call(cmd)
+    os.remove(vidlist_path)
+
+
+def get_shard_path(args, shard_index):
+    return osp.join(args.output, f'{args.video_name}_{args.suffix}_shard{shard_index}of{args.shard_count}.mp4')
+
+
+def merge_shards(args):
+    """Concatenate the shard videos of --shard-count into <name>_<suffix>.mp4, after checking that every shard
+    video exists, and that their frames add up to the input frames."""
+    shard_paths = [get_shard_path(args, i) for i in range(args.shard_count)]
+    missing = [path for path in shard_paths if not osp.isfile(path)]
+    if missing:
+        raise FileNotFoundError(f'Missing shard videos: {", ".join(missing)}')
+    num_frames = sum(get_video_meta_info(path)['nb_frames'] for path in shard_paths)
+    print(f'{args.shard_count} shard videos: {num_frames} frames')
+    # frames that cannot be upsampled (e.g., out of memory) are dropped from the shard videos
+    if osp.isdir(args.input):
+        num_inputs = len(glob.glob(os.path.join(args.input, '*')))
+        if num_frames != num_inputs:
+            raise RuntimeError(f'The shard videos have {num_frames} frames, but the input has {num_inputs} frames')
+    elif num_frames != get_video_meta_info(args.input)['nb_frames']:
+        # the frame count of the container may differ from the extracted frames (e.g., variable frame rate)
+        print(f'Warning: the input video has {get_video_meta_info(args.input)["nb_frames"]} frames')
+    concat_videos(args, shard_paths, osp.join(args.output, f'{args.video_name}_{args.suffix}.mp4'))
+
+
 def run(args):
     args.video_name = osp.splitext(os.path.basename(args.input))[0]
     video_save_path = osp.join(args.output, f'{args.video_name}_{args.suffix}.mp4')
+    if args.merge_shards:
+        merge_shards(args)
+        return
+    if args.shard_count > 1:
+        video_save_path = get_shard_path(args, args.shard_index)
 
     if args.extract_frame_first:
         tmp_frames_folder = osp.join(args.output, f'{args.video_name}_inp_tmp_frames')
@@ -306,21 +332,13 @@ def run(args):
     pool.join()
 
     # combine sub videos
-    # prepare vidlist.txt
-    with open(f'{args.output}/{args.video_name}_vidlist.txt', 'w') as f:
-        for i in range(num_process):
-            f.write(f'file \'{args.video_name}_out_tmp_videos/{i:03d}.mp4\'\n')
-
-    cmd = [
-        args.ffmpeg_bin, '-f', 'concat', '-safe', '0', '-i', f'{args.output}/{args.video_name}_vidlist.txt', '-c',
-        'copy', f'{video_save_path}'
+    sub_video_paths = [
+        osp.join(args.output, f'{args.video_name}_out_tmp_videos', f'{i:03d}.mp4') for i in range(num_process)
     ]
-    print(' '.join(cmd))
-    subprocess.call(cmd)
+    concat_videos(args, sub_video_paths, video_save_path)
     shutil.rmtree(osp.join(args.output, f'{args.video_name}_out_tmp_videos'))
     if osp.exists(osp.join(args.output, f'{args.video_name}_inp_tmp_videos')):
         shutil.rmtree(osp.join(args.output, f'{args.video_name}_inp_tmp_videos'))
-    os.remove(f'{args.output}/{args.video_name}_vidlist.txt')
 
 
 def main():
@@ -349,21 +367,53 @@ def main():
     parser.add_argument('-s', '--outscale', type=float, default=4, help='The final upsampling scale of the image')
     parser.add_argument('--suffix', type=str, default='out', help='Suffix of the restored video')
     parser.add_argument('-t', '--tile', type=int, default=0, help='Tile size, 0 for no tile during testing')
-    parser.add_argument('--tile_pad', type=int, default=10, help='Tile padding')
+    parser.add_argument(
+        '--tile_pad',
+        type=str,
+        default='auto',
+        help='Tile padding. auto for deriving it from the model (receptive field and a cached seam probe)')
+    parser.add_argument(
+        '--int8',
+        action='store_true',
+        help='Run the int8 quantized model (weights/<model_name>.int8.pt, see scripts/quantize_int8.py) on the CPU')
+    parser.add_argument(
+        '--tile_batch',
+        type=int,
+        default=1,
+        help='Number of tiles upsampled in one forward pass. 0 for deriving it from the free memory')
     parser.add_argument('--pre_pad', type=int, default=0, help='Pre padding size at each border')
     parser.add_argument('--face_enhance', action='store_true', help='Use GFPGAN to enhance face')
     parser.add_argument(
-        '--fp32', action='store_true', help='Use fp32 precision during inference. Default: fp16 (half precision).')
+        '--precision',
+        type=str,
+        default='auto',
+        help=('Precision during inference. Options: auto | fp32 | fp16 | bf16. auto is fp16 on GPUs, bf16 on CPUs with '
+              'native bf16 support, and fp32 elsewhere'))
+    parser.add_argument(
+        '--fp32', action='store_true', help='Use fp32 precision during inference, the same as --precision fp32')
     parser.add_argument('--fps', type=float, default=None, help='FPS of the output video')
     parser.add_argument('--ffmpeg_bin', type=str, default='ffmpeg', help='The path to ffmpeg')
     parser.add_argument('--extract_frame_first', action='store_true')
     parser.add_argument('--num_process_per_gpu', type=int, default=1)
+    parser.add_argument(
+        '--shard-index', type=int, default=0, help='Process the frames of this shard, in [0, --shard-count)')
+    parser.add_argument(
+        '--shard-count',
+        type=int,
+        default=1,
+        help=('Number of shards (e.g., hosts) of a folder of frames. Each shard upsamples a contiguous range of the '
+              '(sorted) frames to <name>_<suffix>_shard<i>of<n>.mp4, see --merge-shards'))
+    parser.add_argument(
+        '--merge-shards',
+        action='store_true',
+        help=('Check and concatenate the shard videos of --shard-count (in the output folder) into '
+              '<name>_<suffix>.mp4, instead of upsampling'))
 
     parser.add_argument(
         '--alpha_upsampler',
         type=str,
         default='realesrgan',
-        help='The upsampler for the alpha channels. Options: realesrgan | bicubic')
+        help='The upsampler for the alpha channels. Options: realesrgan | guided | bicubic')
     parser.add_argument(
         '--ext',
         type=str,
@@ -387,6 +437,15 @@ def main():
     if args.extract_frame_first and not is_video:
         args.extract_frame_first = False
 
+    if not 0 <= args.shard_index < args.shard_count:
+        parser.error(f'--shard-index should be in [0, {args.shard_count}), but got {args.shard_index}')
+    if args.merge_shards:
+        if args.shard_count <= 1:
+            parser.error('--merge-shards needs the --shard-count of the shards')
+        args.extract_frame_first = False  # the frames are only counted
+    elif args.shard_count > 1 and is_video and not args.extract_frame_first:
+        parser.error('--shard-count splits a folder of frames, use it with --extract_frame_first for videos')
+
     run(args)
 
     if args.extract_frame_first:
@@ -366,7 +366,6 @@ class ESRGAN_GUI:
                     "-n", self.model_choice.get(),
                     "-i", self.input_path.get(),
                     "-o", OUTPUT_DIR,
-                    "--fp32",
                     "-s", self.scale_factor.get() # Pass the desired output scale (4, 8, or 16)
                 ]
 
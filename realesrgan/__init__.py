@@ -1,6 +1,48 @@
 # flake8: noqa
-from .archs import *
-from .data import *
-from .models import *
-from .utils import *
-from .version import *
+# The public names are imported lazily on first access (PEP 562), so that `from realesrgan import RealESRGANer`
+# only imports what inference needs. The training registries (archs, data, models) are filled in when those
+# subpackages are imported, see realesrgan/train.py.
+import importlib
+
+# {module: public names}, tests/test_utils.py checks that it matches the __all__ of the modules
+_EXPORTS = {
+    'backends': ['TorchScriptBackend', 'export_onnx', 'OnnxBackend', 'build_backend'],
+    'cache': ['get_cache_dir', 'atomic_write'],
+    'discovery':
+    ['IMG_EXTENSIONS', 'scan_images', 'read_path_list', 'iter_inputs', 'shard_of', 'filter_shard', 'shard_range'],
+    'dni': ['quantize_dni_weight', 'dni_cache_path', 'blend_weights'],
+    'gigapixel': ['open_source', 'open_sink', 'enhance_mapped', 'enhance_large'],
+    'manifest': ['file_hash', 'params_key', 'Manifest'],
+    'quantize': ['INT8_SUFFIX', 'quantize_static', 'save_quantized', 'load_quantized'],
+    'receptive_field': ['receptive_field', 'probe_tile_pad', 'get_tile_pad'],
+    'scheduler': ['TileScheduler'],
+    'tile_cache': ['TileCache'],
+    'utils': [
+        'Tile', 'lanczos_taps', 'resize_with_taps', 'lanczos_resize', 'is_oom_error', 'PRECISIONS', 'cpu_supports_bf16',
+        'resolve_precision', 'mmap_path', 'has_mmap_copy', 'save_mmap_checkpoint', 'load_checkpoint', 'checkpoint_id',
+        'guided_filter', 'set_intra_op_threads', 'RealESRGANer', 'PrefetchReader', 'IOConsumer'
+    ],
+    'version': ['__version__', '__gitsha__', 'version_info'],
+    'zoo': ['MODELS', 'build_model', 'ModelRegistry'],
+}
+_NAMES = {name: module for module, names in _EXPORTS.items() for name in names}
+_SUBMODULES = [
+    'archs', 'data', 'models', 'backends', 'cache', 'discovery', 'dni', 'gigapixel', 'manifest', 'quantize',
+    'receptive_field', 'scheduler', 'tile_cache', 'utils', 'version', 'zoo'
+]
+
+__all__ = [name for name in _NAMES if not name.startswith('__')]
+
+
+def __getattr__(name):
+    if name in _NAMES:
+        value = getattr(importlib.import_module(f'{__name__}.{_NAMES[name]}'), name)
+        globals()[name] = value
+        return value
+    if name in _SUBMODULES:
+        return importlib.import_module(f'{__name__}.{name}')
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_NAMES) | set(_SUBMODULES))
@@ -1,10 +1,29 @@
 import importlib
-from basicsr.utils import scandir
 from os import path as osp
 
-# automatically scan and import arch modules for registry
-# scan all the files that end with '_arch.py' under the archs folder
-arch_folder = osp.dirname(osp.abspath(__file__))
-arch_filenames = [osp.splitext(osp.basename(v))[0] for v in scandir(arch_folder) if v.endswith('_arch.py')]
-# import all the arch modules
-_arch_modules = [importlib.import_module(f'realesrgan.archs.{file_name}') for file_name in arch_filenames]
+__all__ = ['import_arch_modules']
+
+# archs without the registry decorator, registered by import_arch_modules
+_LAZY_ARCHS = {'srvgg_arch': ['SRVGGNetCompact']}
+
+
+def import_arch_modules():
+    """Import all the arch modules, which registers the archs to the ARCH_REGISTRY of basicsr.
+
+    The registry is only needed by training (the archs are built from the options), so it is filled in on first use
+    instead of on import: inference imports the arch modules it needs without basicsr.
+    """
+    from basicsr.utils import scandir
+    from basicsr.utils.registry import ARCH_REGISTRY
+
+    # automatically scan and import arch modules for registry
+    # scan all the files that end with '_arch.py' under the archs folder
+    arch_folder = osp.dirname(osp.abspath(__file__))
+    arch_filenames = [osp.splitext(osp.basename(v))[0] for v in scandir(arch_folder) if v.endswith('_arch.py')]
+    # import all the arch modules
+    arch_modules = [importlib.import_module(f'realesrgan.archs.{file_name}') for file_name in arch_filenames]
+    for module in arch_modules:
+        for name in _LAZY_ARCHS.get(module.__name__.rsplit('.', 1)[-1], []):
+            if name not in ARCH_REGISTRY:
+                ARCH_REGISTRY.register(getattr(module, name))
+    return arch_modules
@@ -1,9 +1,8 @@
-from basicsr.utils.registry import ARCH_REGISTRY
 from torch import nn as nn
 from torch.nn import functional as F
 
 
-@ARCH_REGISTRY.register()
+# registered to ARCH_REGISTRY by import_arch_modules (for training), so that inference does not import basicsr
 class SRVGGNetCompact(nn.Module):
     """A compact VGG-style network structure for super-resolution.
 
@@ -0,0 +1,169 @@
+import copy
+import hashlib
+import os
+import tempfile
+import threading
+import torch
+import warnings
+from collections import OrderedDict
+
+from realesrgan.cache import atomic_write, get_cache_dir
+
+__all__ = ['TorchScriptBackend', 'export_onnx', 'OnnxBackend', 'build_backend']
+
+
+class TorchScriptBackend():
+    """Run a network as a graph specialized for each input shape, in channels_last layout.
+
+    The first input of a shape is traced (mode='trace', frozen TorchScript) or compiled (mode='compile',
+    torch.compile without dynamic shapes). The graph is checked against the eager output of that input: if the max
+    difference is larger than atol, a warning is issued and the shape runs eagerly. Graphs are cached per input shape
+    (LRU), which suits the tile mode: all the inner tiles share one shape, only the border tiles differ.
+
+    Args:
+        model (nn.Module): The network in eval mode.
+        mode (str): 'trace' or 'compile'. Default: 'trace'.
+        channels_last (bool): Convert the inputs and a copy of the network to channels_last. The given network
+            (e.g., shared by a ModelRegistry) is not modified. Default: True.
+        atol (float): Tolerance of the parity check, in [0, 1] range. Default: None, which is 1e-3 for fp32, 1e-2 for
+            fp16 and 3e-2 for bf16.
+        max_shapes (int): Max number of cached graphs. Default: 16.
+    """
+
+    def __init__(self, model, mode='trace', channels_last=True, atol=None, max_shapes=16):
+        assert mode in ('trace', 'compile'), f'Unsupported mode: {mode}. Options: trace | compile'
+        self.mode = mode
+        self.channels_last = channels_last
+        self.atol = atol
+        self.max_shapes = max_shapes
+        self.eager_model = model
+        self.model = copy.deepcopy(model).to(memory_format=torch.channels_last) if channels_last else model
+
+        self._graphs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __call__(self, img):
+        if self.channels_last:
+            img = img.contiguous(memory_format=torch.channels_last)
+        key = (tuple(img.shape), img.dtype, img.device)
+        with self._lock:
+            graph = self._graphs.get(key)
+            if graph is None:
+                graph = self._build(img)
+                self._graphs[key] = graph
+                if len(self._graphs) > self.max_shapes:
+                    self._graphs.popitem(last=False)
+            else:
+                self._graphs.move_to_end(key)
+        with torch.no_grad():
+            return graph(img).contiguous()
+
+    @torch.no_grad()
+    def _build(self, img):
+        """Specialize the network for the shape of img, and check it against the eager output."""
+        if self.mode == 'trace':
+            graph = torch.jit.freeze(torch.jit.trace(self.model, img, check_trace=False))
+        else:
+            graph = torch.compile(self.model, dynamic=False)
+        output = graph(img).float()
+        reference = self.eager_model(img.contiguous()).float()
+        error = (output - reference).abs().max().item()
+        atol = self.atol if self.atol is not None else {torch.float32: 1e-3, torch.float16: 1e-2}.get(img.dtype, 3e-2)
+        if error > atol:
+            warnings.warn(f'The {self.mode}d graph of input {tuple(img.shape)} differs from the eager output by '
+                          f'{error:.2e} (> {atol:.0e}), run it eagerly.')
+            return self.eager_model
+        return graph
+
+
+@torch.no_grad()
+def export_onnx(model, output_path, opset_version=11, example_size=64):
+    """Export a network to ONNX, with dynamic batch and spatial axes.
+
+    The input is named 'data' and the output 'output' (the blob names used by the ncnn conversion). The file is
+    written to a temporary file first, so that other processes never load partial files.
+
+    Args:
+        model (nn.Module): The network. It is exported in fp32 on the CPU, and not modified.
+        output_path (str): Path of the ONNX file.
+        opset_version (int): ONNX opset version. Default: 11.
+        example_size (int): Size of the example input for the export. It should be divisible by 4, as x2 and x1
+            models use pixel unshuffle. Default: 64.
+    """
+    model = copy.deepcopy(model).float().cpu().eval()
+    example = torch.rand(1, 3, example_size, example_size)
+    dynamic_axes = {name: {0: 'batch', 2: 'height', 3: 'width'} for name in ('data', 'output')}
+    with atomic_write(output_path) as tmp_path:
+        torch.onnx.export(
+            model,
+            example,
+            tmp_path,
+            opset_version=opset_version,
+            export_params=True,
+            input_names=['data'],
+            output_names=['output'],
+            dynamic_axes=dynamic_axes)
+
+
+class OnnxBackend():
+    """Run an ONNX network (see export_onnx) with ONNX Runtime.
+
+    The network runs in fp32 on the CPU execution provider by default: the inputs are converted, and the outputs are
+    converted back to the dtype and device of the inputs.
+
+    Args:
+        model_path (str): Path of the ONNX file.
+        providers (list[str]): ONNX Runtime execution providers. Default: None, which is ['CPUExecutionProvider'].
+        num_threads (int): Number of intra-op threads, 0 for the ONNX Runtime default. Default: 0.
+    """
+
+    def __init__(self, model_path, providers=None, num_threads=0):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        if num_threads > 0:
+            options.intra_op_num_threads = num_threads
+        self.model_path = model_path
+        self.session = onnxruntime.InferenceSession(
+            model_path, options, providers=providers or ['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, img):
+        inp = img.detach().to('cpu', torch.float32).contiguous().numpy()
+        output = self.session.run(None, {self.input_name: inp})[0]
+        return torch.from_numpy(output).to(device=img.device, dtype=img.dtype)
+
+
+def onnx_cache_path(key):
+    """Path of the exported network in the cache folder, named by a hash of the model key."""
+    return get_cache_dir('onnx', f'{hashlib.md5(key.encode()).hexdigest()[:16]}.onnx')
+
+
+def build_backend(model, backend, key=None):
+    """Build an execution backend of a network.
+
+    Args:
+        model (nn.Module): The network in eval mode.
+        backend (str | callable | None): None or 'torch' for the eager network, 'trace' or 'compile' for
+            TorchScriptBackend, 'onnx' for OnnxBackend of the exported network, or the path of an ONNX file
+            (*.onnx). A callable is used as it is.
+        key (str): Identity of the network (arch and weights). The 'onnx' backend exports the network to the cache
+            folder once per key. Default: None, which exports it to a temporary folder.
+
+    Returns:
+        callable | None: Maps a (n, c, h, w) input to the upsampled output. None for the eager network.
+    """
+    if backend is None or backend == 'torch':
+        return None
+    elif callable(backend):
+        return backend
+    elif backend in ('trace', 'compile'):
+        return TorchScriptBackend(model, mode=backend)
+    elif backend == 'onnx':
+        model_path = onnx_cache_path(key) if key else os.path.join(tempfile.mkdtemp(), 'model.onnx')
+        if not os.path.isfile(model_path):
+            export_onnx(model, model_path)
+        return OnnxBackend(model_path)
+    elif isinstance(backend, str) and backend.endswith('.onnx'):
+        return OnnxBackend(backend)
+    raise ValueError(f'Unsupported backend: {backend}. Options: torch | trace | compile | onnx | *.onnx')
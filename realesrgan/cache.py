@@ -0,0 +1,33 @@
+import contextlib
+import os
+import threading
+
+__all__ = ['get_cache_dir', 'atomic_write']
+
+
+def get_cache_dir(*subdirs):
+    """Cache folder of Real-ESRGAN: $REALESRGAN_CACHE_DIR, or ~/.cache/realesrgan by default."""
+    cache_dir = os.environ.get('REALESRGAN_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'realesrgan'))
+    return os.path.join(cache_dir, *subdirs)
+
+
+@contextlib.contextmanager
+def atomic_write(path):
+    """Write a file atomically.
+
+    It yields a temporary path next to path (its folder is created), which replaces path when the block succeeds. So
+    other threads and processes (e.g., --workers) never read partial files, and the temporary file is removed on
+    errors.
+
+    Usage:
+        with atomic_write(path) as tmp_path:
+            torch.save(data, tmp_path)
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
@@ -0,0 +1,104 @@
+import hashlib
+import os
+import sys
+
+__all__ = ['IMG_EXTENSIONS', 'scan_images', 'read_path_list', 'iter_inputs', 'shard_of', 'filter_shard', 'shard_range']
+
+# extensions of the images that cv2.imread reads, in lower case
+IMG_EXTENSIONS = ('.bmp', '.jpeg', '.jpg', '.jp2', '.pbm', '.pgm', '.png', '.ppm', '.tif', '.tiff', '.webp')
+
+
+def scan_images(root, recursive=False, extensions=IMG_EXTENSIONS, exclude=None):
+    """Yield the image paths in a folder as they are found, without listing (or sorting) the whole folder first.
+
+    The entries are yielded in the order of os.scandir (not sorted), and sub-folders are scanned depth-first, so
+    processing starts right away and the memory does not grow with the number of files. Symbolic links to folders
+    are not followed (as in os.walk), so links to a parent folder do not loop.
+
+    Args:
+        root (str): The folder.
+        recursive (bool): Scan the sub-folders. Default: False.
+        extensions (tuple[str]): Extensions of the yielded files, in lower case. Default: IMG_EXTENSIONS.
+        exclude (str): A sub-folder that is not scanned, e.g., the output folder. Default: None.
+    """
+    exclude = None if exclude is None else os.path.abspath(exclude)
+    folders = [root]
+    while folders:
+        folder = folders.pop()
+        try:
+            entries = os.scandir(folder)
+        except OSError as error:  # e.g., removed or not readable, the other folders are still scanned
+            print(f'Error: cannot scan {folder}: {error}')
+            continue
+        with entries:
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                except OSError as error:
+                    print(f'Error: cannot scan {entry.path}: {error}')
+                    continue
+                if is_dir:
+                    if recursive and os.path.abspath(entry.path) != exclude:
+                        folders.append(entry.path)
+                elif os.path.splitext(entry.name)[1].lower() in extensions:
+                    yield entry.path
+
+
+def read_path_list(f):
+    """Yield the paths of a list (one per line) as they are read, e.g., from stdin. Blank lines and # comments are
+    skipped."""
+    for line in f:
+        path = line.strip()
+        if path and not path.startswith('#'):
+            yield path
+
+
+def iter_inputs(input_path, input_list=None, recursive=False, exclude=None):
+    """Yield the input images of the batch CLI.
+
+    Args:
+        input_path (str): An image, a folder (see scan_images), or '-' for a path list from stdin.
+        input_list (str): A path list file, or '-' for stdin. It overrides input_path. Default: None.
+        recursive (bool): Scan the sub-folders of input_path. Default: False.
+        exclude (str): A sub-folder of input_path that is not scanned, e.g., the output folder. Default: None.
+    """
+    list_file = input_list if input_list is not None else ('-' if input_path == '-' else None)
+    if list_file == '-':
+        yield from read_path_list(sys.stdin)
+    elif list_file is not None:
+        with open(list_file, 'r') as f:
+            yield from read_path_list(f)
+    elif os.path.isfile(input_path):
+        yield input_path
+    else:
+        yield from scan_images(input_path, recursive=recursive, exclude=exclude)
+
+
+def shard_of(path, shard_count, root=None):
+    """The shard of an input: a stable hash of its path (relative to root, with / separators) modulo shard_count.
+
+    It does not depend on the listing order or on the other files, so every host computes the same assignment, and
+    new files do not move the existing ones to other shards.
+    """
+    if root is not None:
+        path = os.path.relpath(path, root)
+    key = path.replace(os.sep, '/').encode()
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'big') % shard_count
+
+
+def filter_shard(paths, shard_index, shard_count, root=None):
+    """Yield the paths of one shard, see shard_of."""
+    assert 0 <= shard_index < shard_count, f'shard_index should be in [0, {shard_count}), but got {shard_index}.'
+    for path in paths:
+        if shard_of(path, shard_count, root) == shard_index:
+            yield path
+
+
+def shard_range(num_items, shard_index, shard_count):
+    """The (start, end) range of one shard of an ordered sequence, e.g., the frames of a video.
+
+    Unlike shard_of, the shards are contiguous (with balanced sizes), so that each shard is a playable part of the
+    video, and the parts are concatenated in the order of the shards.
+    """
+    assert 0 <= shard_index < shard_count, f'shard_index should be in [0, {shard_count}), but got {shard_index}.'
+    return num_items * shard_index // shard_count, num_items * (shard_index + 1) // shard_count
@@ -0,0 +1,91 @@
+import hashlib
+import os
+import torch
+
+from realesrgan.cache import atomic_write, get_cache_dir
+
+__all__ = ['quantize_dni_weight', 'dni_cache_path', 'blend_weights']
+
+# strengths are rounded to this step, so that nearby strengths share one blended file
+DNI_STEP = 0.01
+# max number of blended files kept in the cache folder, the least recently used ones are removed
+DNI_CACHE_SIZE = 32
+
+
+def quantize_dni_weight(dni_weight, step=DNI_STEP):
+    """Round the weight of the first checkpoint to step. The second one is the rest of the (unchanged) sum, so that
+    the blend weights still sum to 1."""
+    weight = round(round(dni_weight[0] / step) * step, 6)
+    return [weight, round(sum(dni_weight) - weight, 6)]
+
+
+def dni_cache_path(net_a, net_b, dni_weight, key='params', cache_dir=None):
+    """Path of the blended weights in the cache folder.
+
+    The file name has the two checkpoints, the quantized strengths, and a hash of the checkpoint paths, sizes and
+    modification times (so that updated checkpoints are blended again).
+    """
+    if cache_dir is None:
+        cache_dir = get_cache_dir('dni')
+    h = hashlib.md5()
+    for path in (net_a, net_b):
+        path = os.path.abspath(path)
+        h.update(f'{path}@{os.path.getsize(path)}@{os.path.getmtime(path)}|'.encode())
+    names = '+'.join(os.path.splitext(os.path.basename(path))[0] for path in (net_a, net_b))
+    weights = '_'.join(f'{w:.2f}' for w in dni_weight)
+    return os.path.join(cache_dir, f'{names}_{weights}_{key}_{h.hexdigest()[:8]}.pth')
+
+
+def _prune(cache_dir, max_files):
+    entries = sorted((entry for entry in os.scandir(cache_dir) if entry.name.endswith('.pth')),
+                     key=lambda entry: entry.stat().st_mtime)
+    for entry in entries[:max(len(entries) - max_files, 0)]:
+        try:
+            os.remove(entry.path)
+        except OSError:  # removed by another process
+            pass
+
+
+def blend_weights(net_a, net_b, dni_weight, key='params', loc='cpu', cache_dir=None, max_files=DNI_CACHE_SIZE):
+    """Deep network interpolation of two checkpoints, with the blended weights cached on the disk.
+
+    ``Paper: Deep Network Interpolation for Continuous Imagery Effect Transition``
+
+    With the cache, the strengths are quantized (see DNI_STEP). The first blend of a strength loads both checkpoints
+    and writes the blended checkpoint to the cache folder; later blends load the single blended file.
+
+    Args:
+        net_a (str): Path of the first checkpoint.
+        net_b (str): Path of the second checkpoint.
+        dni_weight (list[float]): Weights of the two checkpoints.
+        key (str): Key of the weights in the checkpoints. Default: 'params'.
+        loc (str): Device of the loaded weights. Default: 'cpu'.
+        cache_dir (str): Cache folder. Default: None, which uses get_cache_dir('dni'). False disables the cache.
+        max_files (int): Max number of blended files in the cache folder. Default: DNI_CACHE_SIZE.
+
+    Returns:
+        dict: The blended checkpoint, with the weights under `key`.
+    """
+    cache_path = None
+    if cache_dir is not False:
+        dni_weight = quantize_dni_weight(dni_weight)
+        cache_path = dni_cache_path(net_a, net_b, dni_weight, key, cache_dir)
+    if cache_path is not None and os.path.isfile(cache_path):
+        try:
+            loadnet = torch.load(cache_path, map_location=torch.device(loc))
+            os.utime(cache_path)  # mark as recently used
+            return loadnet
+        except (OSError, RuntimeError, EOFError):  # removed or broken, blend again
+            pass
+
+    net_a = torch.load(net_a, map_location=torch.device(loc))
+    net_b = torch.load(net_b, map_location=torch.device(loc))
+    loadnet = {key: {}}
+    for k, v_a in net_a[key].items():
+        loadnet[key][k] = dni_weight[0] * v_a + dni_weight[1] * net_b[key][k]
+
+    if cache_path is not None:
+        with atomic_write(cache_path) as tmp_path:
+            torch.save(loadnet, tmp_path)
+        _prune(os.path.dirname(cache_path), max_files)
+    return loadnet
@@ -0,0 +1,247 @@
+import cv2
+import numpy as np
+import os
+import torch
+
+__all__ = ['open_source', 'open_sink', 'enhance_mapped', 'enhance_large']
+
+# sinks/sources with these extensions store the channels in RGB order, others in BGR order (the cv2 convention)
+RGB_EXTENSIONS = ('.tif', '.tiff')
+
+
+def _import_tifffile():
+    try:
+        import tifffile
+    except ImportError:
+        raise ImportError('Please install tifffile to read/write large TIFF/BigTIFF images: pip install tifffile')
+    return tifffile
+
+
+def open_source(path, shape=None, dtype='uint8'):
+    """Open an input image as an array whose regions are read lazily.
+
+    Supported formats:
+        .npy: memory-mapped with np.load.
+        .raw: memory-mapped with np.memmap, shape (and dtype) are required.
+        .tif/.tiff: memory-mapped if the image data is contiguous (uncompressed), otherwise strips/tiles are decoded
+            on access through zarr. Requires tifffile (and zarr for compressed files).
+        Others: read with cv2.imread, that is, NOT lazily.
+
+    Args:
+        path (str): Image path.
+        shape (tuple[int]): Shape (h, w[, c]) of .raw images. Default: None.
+        dtype (str): Dtype of .raw images. Default: 'uint8'.
+
+    Returns:
+        array-like: With shape (h, w[, c]) in BGR(A) order. Only slicing is used on it.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.npy':
+        return np.load(path, mmap_mode='r')
+    elif ext == '.raw':
+        assert shape is not None, 'The shape of .raw images is required.'
+        return np.memmap(path, dtype=dtype, mode='r', shape=tuple(shape))
+    elif ext in RGB_EXTENSIONS:
+        tifffile = _import_tifffile()
+        try:
+            img = tifffile.memmap(path, mode='r')
+        except ValueError:  # not memory-mappable, e.g., compressed
+            import zarr
+            img = zarr.open(tifffile.imread(path, aszarr=True), mode='r')
+        return _BGRView(img) if len(img.shape) == 3 and img.shape[2] in (3, 4) else img
+    img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    assert img is not None, f'Cannot read image: {path}'
+    return img
+
+
+def open_sink(path, shape, dtype='uint8'):
+    """Create a memory-mapped output image. Finished tiles are written to the disk, not kept in memory.
+
+    Supported formats: .npy, .raw and .tif/.tiff (BigTIFF for files larger than 4 GB, requires tifffile).
+
+    Args:
+        path (str): Output path.
+        shape (tuple[int]): Shape (h, w[, c]) of the output.
+        dtype (str): Dtype of the output. Default: 'uint8'.
+
+    Returns:
+        array-like: With shape (h, w[, c]) in BGR(A) order. Only slice assignment is used on it.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.npy':
+        return np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=tuple(shape))
+    elif ext == '.raw':
+        print(f'\tRaw output: shape {tuple(shape)}, dtype {dtype}')
+        return np.memmap(path, dtype=dtype, mode='w+', shape=tuple(shape))
+    elif ext in RGB_EXTENSIONS:
+        tifffile = _import_tifffile()
+        bigtiff = int(np.prod(shape)) * np.dtype(dtype).itemsize >= 2**32 - 2**25
+        photometric = 'rgb' if len(shape) == 3 else 'minisblack'
+        img = tifffile.memmap(path, shape=tuple(shape), dtype=dtype, photometric=photometric, bigtiff=bigtiff)
+        return _BGRView(img) if len(shape) == 3 else img
+    raise ValueError(f'Unsupported output format for memory mapping: {ext}. Options: .npy | .raw | .tif | .tiff')
+
+
+class _BGRView():
+    """Present an RGB(A) array in BGR(A) order for slicing."""
+
+    def __init__(self, img):
+        self.img = img
+        self.shape = img.shape
+        self.dtype = img.dtype
+        self.order = [2, 1, 0, 3][:img.shape[2]]
+
+    def __getitem__(self, index):
+        return np.asarray(self.img[index])[..., self.order]
+
+    def __setitem__(self, index, value):
+        self.img[index] = value[..., self.order]
+
+    def flush(self):
+        if hasattr(self.img, 'flush'):
+            self.img.flush()
+
+
+def _reflect_index(start, end, sizes):
+    """Indices [start, end) of an image that is reflect-padded several times (see F.pad), mapped back to the
+    original image.
+
+    Args:
+        sizes (list[int]): Sizes of the image before each padding, from the original image to the last padding.
+    """
+    idx = np.arange(start, end)
+    for size in reversed(sizes):
+        idx = np.where(idx >= size, 2 * (size - 1) - idx, idx)
+    return idx
+
+
+def _read_region(src, y_idx, x_idx):
+    """Read a region into memory with a sliced read. Only the reflected borders need fancy indexing."""
+    y0, y1, x0, x1 = y_idx.min(), y_idx.max() + 1, x_idx.min(), x_idx.max() + 1
+    region = np.array(src[y0:y1, x0:x1])
+    if len(y_idx) != y1 - y0 or np.any(np.diff(y_idx) != 1):
+        region = region[y_idx - y0]
+    if len(x_idx) != x1 - x0 or np.any(np.diff(x_idx) != 1):
+        region = region[:, x_idx - x0]
+    return region
+
+
+@torch.no_grad()
+def enhance_mapped(upsampler, src, dst, alpha_upsampler='realesrgan', tile=None):
+    """Upsample an image tile by tile, from a lazily read source to a memory-mapped sink.
+
+    It reuses the tile geometry of RealESRGANer (get_tiles). The pre pad and mod pad are emulated by reflecting the
+    indices of the border tiles, so the full image (input or output) is never held in memory. The peak memory is
+    bounded by the tile size.
+
+    Args:
+        upsampler (RealESRGANer): The upsampler.
+        src (array-like): Input with shape (h, w[, c]), uint8 or uint16, see open_source.
+        dst (array-like): Output with shape (h * scale, w * scale[, c]), see open_sink. Other output sizes (an
+            outscale) are resized tile by tile on the device (see RealESRGANer.resize_tile).
+        alpha_upsampler (str): The upsampler for the alpha channel, see RealESRGANer.enhance.
+            Default: 'realesrgan'.
+        tile (int): Tile size. Default: None, which uses upsampler.tile_size (512 if it is 0).
+    """
+    scale = upsampler.scale
+    height, width = src.shape[0:2]
+    assert src.dtype in (np.uint8, np.uint16), f'Only uint8 and uint16 images are supported, but got {src.dtype}.'
+    max_range = 65535 if src.dtype == np.uint16 else 255
+    if len(src.shape) == 2:
+        img_mode = 'L'
+    elif src.shape[2] == 4:
+        img_mode = 'RGBA'
+    else:
+        img_mode = 'RGB'
+    valid_size = (height * scale, width * scale)
+    out_size = tuple(dst.shape[0:2])
+
+    # emulate the pre pad and mod pad of _pre_process
+    sizes_h, sizes_w = [height], [width]
+    padded_h, padded_w = height + upsampler.pre_pad, width + upsampler.pre_pad
+    if upsampler.pre_pad != 0:
+        sizes_h.append(padded_h)
+        sizes_w.append(padded_w)
+    mod_scale = upsampler.get_mod_scale()
+    if mod_scale is not None:
+        padded_h += (mod_scale - padded_h % mod_scale) % mod_scale
+        padded_w += (mod_scale - padded_w % mod_scale) % mod_scale
+
+    tiles = upsampler.get_tiles(padded_h, padded_w, tile or upsampler.tile_size or 512)
+    for tile_idx, tile in enumerate(tiles, 1):
+        pad_y0, pad_y1, pad_x0, pad_x1 = tile.pad_box
+        out_y0, out_y1, out_x0, out_x1 = tile.out_box
+        # skip the tiles that only cover the padded area
+        out_y1, out_x1 = min(out_y1, height * scale), min(out_x1, width * scale)
+        if out_y0 >= out_y1 or out_x0 >= out_x1:
+            continue
+        region = _read_region(src, _reflect_index(pad_y0, pad_y1, sizes_h), _reflect_index(pad_x0, pad_x1, sizes_w))
+
+        img = upsampler.img2tensor(region, max_range)
+        alpha = None
+        if img_mode == 'RGBA':
+            if alpha_upsampler == 'realesrgan':
+                img = torch.cat((img, upsampler.img2tensor(region, max_range, channels=(3, 3, 3))))
+            else:  # a tensor, so that it is cropped and resized like the image
+                alpha = upsampler.img2tensor(region, max_range, channels=(3, ))
+        output = upsampler._process(img)
+
+        output_img, output_alpha = output[0:1], None
+        if img_mode == 'RGBA':
+            if alpha_upsampler == 'realesrgan':
+                output_alpha = output[1:2]
+            else:
+                output_alpha = upsampler.upsample_alpha(alpha, output_img, alpha_upsampler)
+
+        if out_size == valid_size:
+            crop_y0, _, crop_x0, _ = tile.crop_box
+            crop = (slice(None), slice(None), slice(crop_y0, crop_y0 + out_y1 - out_y0),
+                    slice(crop_x0, crop_x0 + out_x1 - out_x0))
+            output_img = output_img[crop]
+            output_alpha = None if output_alpha is None else output_alpha[crop]
+        else:
+            planes = output_img if output_alpha is None else torch.cat((output_img.float(), output_alpha.float()), 1)
+            planes, (out_y0, out_y1, out_x0, out_x1) = upsampler.resize_tile(planes, tile, valid_size, out_size)
+            if planes is None:
+                continue
+            output_img, output_alpha = planes[:, 0:3], (planes[:, 3:] if output_alpha is not None else None)
+        output_tile = upsampler.merge_output(output_img, output_alpha, img_mode, max_range, None)
+        dst[out_y0:out_y1, out_x0:out_x1] = output_tile
+        print(f'\tTile {tile_idx}/{len(tiles)}')
+
+    if hasattr(dst, 'flush'):
+        dst.flush()
+
+
+def enhance_large(upsampler,
+                  input_path,
+                  output_path,
+                  alpha_upsampler='realesrgan',
+                  tile=None,
+                  input_shape=None,
+                  input_dtype='uint8',
+                  outscale=None):
+    """Upsample a very large (e.g., gigapixel) image file without holding the full input/output in memory.
+
+    Args:
+        upsampler (RealESRGANer): The upsampler.
+        input_path (str): Input path, see open_source.
+        output_path (str): Output path (.npy, .raw, .tif or .tiff), see open_sink.
+        alpha_upsampler (str): The upsampler for the alpha channel. Default: 'realesrgan'.
+        tile (int): Tile size. Default: None, which uses upsampler.tile_size (512 if it is 0).
+        input_shape (tuple[int]): Shape of .raw inputs. Default: None.
+        input_dtype (str): Dtype of .raw inputs. Default: 'uint8'.
+        outscale (float): The final upsampling scale of the image. Default: None, which uses the network scale.
+
+    Returns:
+        str: img_mode of the input.
+    """
+    src = open_source(input_path, input_shape, input_dtype)
+    outscale = outscale or upsampler.scale
+    out_shape = (int(src.shape[0] * outscale), int(src.shape[1] * outscale)) + tuple(src.shape[2:])
+    dst = open_sink(output_path, out_shape, src.dtype)
+    enhance_mapped(upsampler, src, dst, alpha_upsampler, tile)
+    del dst  # close the memory map
+    if len(src.shape) == 2:
+        return 'L'
+    return 'RGBA' if src.shape[2] == 4 else 'RGB'
@@ -0,0 +1,98 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from realesrgan.cache import atomic_write
+
+__all__ = ['file_hash', 'params_key', 'Manifest']
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """Content hash of a file."""
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def params_key(params):
+    """Hash of the parameters that the outputs depend on (a json-serializable dict), e.g., the model and outscale."""
+    return hashlib.md5(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+class Manifest():
+    """Processing manifest of a batch run, so that a rerun skips the up-to-date outputs.
+
+    It is a JSONL file with one record per processed image: the input path, size, modification time and hash, the
+    parameter key, and the output path. The file is append-only (a crash loses at most the last line), and the last
+    record of an input wins. An input is up to date if its output exists, the parameter key matches, and it has the
+    recorded size and modification time, or the recorded hash (e.g., touched but unchanged files).
+
+    Args:
+        path (str): Path of the JSONL file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # {absolute input path: last record}
+        self.records = {}
+        self._lock = threading.Lock()
+
+        num_lines = 0
+        if os.path.isfile(path):
+            with open(path, 'r') as f:
+                for line in f:
+                    num_lines += 1
+                    try:
+                        record = json.loads(line)
+                    except ValueError:  # partially written by a crash
+                        continue
+                    self.records[record['input']] = record
+        # drop the superseded records of the reruns
+        if num_lines > 2 * len(self.records) + 100:
+            self.compact()
+
+    def is_done(self, path, key):
+        """Whether the output of an input is up to date for the parameter key. Inputs that cannot be read (e.g.,
+        removed) are not done."""
+        record = self.records.get(os.path.abspath(path))
+        if record is None or record['params'] != key or not os.path.isfile(record['output']):
+            return False
+        try:
+            stat = os.stat(path)
+            if stat.st_size != record['size']:
+                return False
+            return stat.st_mtime_ns == record['mtime_ns'] or file_hash(path) == record['hash']
+        except OSError:
+            return False
+
+    def record(self, path, output_path, key):
+        """Record a processed input, after its output is written. It is thread-safe, and errors are printed instead
+        of raised, as it runs on the writer threads: an unrecorded input is processed again by the next run."""
+        try:
+            stat = os.stat(path)
+            record = dict(
+                input=os.path.abspath(path),
+                size=stat.st_size,
+                mtime_ns=stat.st_mtime_ns,
+                hash=file_hash(path),
+                params=key,
+                output=os.path.abspath(output_path),
+                time=time.time())
+            line = json.dumps(record) + '\n'
+            with self._lock:
+                with open(self.path, 'a') as f:
+                    f.write(line)
+                self.records[record['input']] = record
+        except OSError as error:
+            print(f'Error: cannot record {path} in the manifest: {error}')
+
+    def compact(self):
+        """Rewrite the file with the last record of each input."""
+        with self._lock:
+            with atomic_write(self.path) as tmp_path, open(tmp_path, 'w') as f:
+                for record in self.records.values():
+                    f.write(json.dumps(record) + '\n')
@@ -2,6 +2,11 @@ import importlib
 from basicsr.utils import scandir
 from os import path as osp
 
+from realesrgan.archs import import_arch_modules
+
+# the models build the registered archs
+import_arch_modules()
+
 # automatically scan and import model modules for registry
 # scan all the files that end with '_model.py' under the model folder
 model_folder = osp.dirname(osp.abspath(__file__))
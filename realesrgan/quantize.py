@@ -0,0 +1,81 @@
+import copy
+import json
+import torch
+
+__all__ = ['INT8_SUFFIX', 'quantize_static', 'save_quantized', 'load_quantized']
+
+# quantized checkpoints are TorchScript archives with this suffix, e.g., weights/realesr-animevideov3.int8.pt
+INT8_SUFFIX = '.int8.pt'
+_META_FILE = 'realesrgan.json'
+
+
+def _default_engine():
+    engines = torch.backends.quantized.supported_engines
+    for engine in ('x86', 'fbgemm', 'qnnpack'):
+        if engine in engines:
+            return engine
+    raise RuntimeError('No quantized engine is supported on this platform.')
+
+
+@torch.no_grad()
+def quantize_static(model, calib_inputs, engine=None):
+    """Post-training static int8 quantization of a network for CPU inference (FX graph mode).
+
+    The convs (with their activations, e.g., PReLU and LeakyReLU) run in int8, with the activation ranges observed
+    on the calibration inputs. Dynamic quantization does not cover convs, so it does not help these networks.
+
+    Args:
+        model (nn.Module): The fp32 network, e.g., SRVGGNetCompact or RRDBNet. It is not modified. x2 and x1
+            RRDBNet are not supported: FX cannot trace their pixel unshuffle.
+        calib_inputs (iterable[Tensor]): Calibration inputs with shape (n, 3, h, w) in [0, 1] range, e.g., tiles
+            of typical images.
+        engine (str): Quantized engine: x86 | fbgemm | qnnpack. Default: None, which picks the best supported one.
+
+    Returns:
+        GraphModule: The quantized network.
+    """
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    assert getattr(model, 'scale', 4) == 4, f'Only x4 networks are supported, but got a x{model.scale} network.'
+    engine = engine or _default_engine()
+    torch.backends.quantized.engine = engine
+    model = copy.deepcopy(model).float().cpu().eval()
+    calib_inputs = iter(calib_inputs)
+    first = next(calib_inputs)
+    prepared = prepare_fx(model, get_default_qconfig_mapping(engine), example_inputs=(first, ))
+    prepared(first)
+    for img in calib_inputs:
+        prepared(img)
+    quantized = convert_fx(prepared)
+    quantized.engine = engine
+    return quantized
+
+
+@torch.no_grad()
+def save_quantized(model, save_path, example_input, meta=None):
+    """Save a quantized network as a TorchScript archive, which RealESRGANer loads from a *.int8.pt model_path.
+
+    Args:
+        model (GraphModule): The network returned by quantize_static.
+        save_path (str): Path ending with INT8_SUFFIX.
+        example_input (Tensor): An input for tracing. The traced network is not specialized to its size.
+        meta (dict): Extra information, e.g., the model name and the calibration set. Default: None.
+    """
+    meta = dict(meta or {}, engine=getattr(model, 'engine', torch.backends.quantized.engine))
+    traced = torch.jit.freeze(torch.jit.trace(model.eval(), example_input, check_trace=False))
+    torch.jit.save(traced, save_path, _extra_files={_META_FILE: json.dumps(meta)})
+
+
+def load_quantized(model_path):
+    """Load a quantized network saved by save_quantized, on the CPU.
+
+    Returns:
+        tuple: The network (ScriptModule) and its meta information (dict).
+    """
+    extra_files = {_META_FILE: ''}
+    model = torch.jit.load(model_path, map_location=torch.device('cpu'), _extra_files=extra_files)
+    meta = json.loads(extra_files[_META_FILE] or '{}')
+    if meta.get('engine') in torch.backends.quantized.supported_engines:
+        torch.backends.quantized.engine = meta['engine']
+    return model.eval(), meta
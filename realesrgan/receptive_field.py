@@ -0,0 +1,130 @@
+import json
+import math
+import os
+import torch
+from torch import nn as nn
+from torch.nn import functional as F
+
+from realesrgan.cache import atomic_write
+
+__all__ = ['receptive_field', 'probe_tile_pad', 'get_tile_pad']
+
+
+def receptive_field(model):
+    """Radius of the receptive field of a network, in input pixels.
+
+    It is exact for SRVGGNetCompact and RRDBNet. For other archs, it is the sum of the radii of all the conv layers,
+    which is an upper bound for plain conv stacks without resampling.
+
+    Args:
+        model (nn.Module): The network.
+
+    Returns:
+        int: Output pixels do not depend on input pixels farther than this.
+    """
+    name = type(model).__name__
+    if name == 'SRVGGNetCompact':
+        # the first conv, num_conv body convs and the last conv are all 3x3 convs on the input resolution
+        return model.num_conv + 2
+    elif name == 'RRDBNet':
+        # x2 and x1 models run on pixel-unshuffled features
+        unshuffle = {2: 2, 1: 4}.get(model.scale, 1)
+        # conv_first, 3 RDBs of 5 chained 3x3 convs in each RRDB, conv_body. The upsampling convs run on 2x and 4x
+        # resolutions and add less than 2 input pixels
+        return (2 + 15 * len(model.body)) * unshuffle + 2
+
+    radius = 0
+    for module in model.modules():
+        if isinstance(module, nn.Conv2d):
+            radius += (module.kernel_size[0] - 1) // 2 * module.dilation[0]
+    return radius
+
+
+def _probe_image(size, device, dtype):
+    """A smooth random image with some fine texture, closer to natural images than white noise."""
+    generator = torch.Generator().manual_seed(0)
+    img = torch.rand((1, 3, math.ceil(size / 4), math.ceil(size / 4)), generator=generator)
+    img = F.interpolate(img, scale_factor=4, mode='bicubic', align_corners=False)[:, :, :size, :size]
+    img = img + 0.05 * torch.rand((1, 3, size, size), generator=generator)
+    return img.clamp_(0, 1).to(device=device, dtype=dtype)
+
+
+@torch.no_grad()
+def probe_tile_pad(model, scale, max_pad=32, tol=0.5 / 255, core=8, multiple=1):
+    """Find the smallest tile pad without visible seams, by comparing tiled outputs with a reference.
+
+    A core area of core x core pixels is upsampled with p pixels of context on each side, and compared with the
+    output that has max_pad pixels of context. The smallest p whose max difference is within tol (half a level of
+    8-bit images by default) is found with a binary search.
+
+    Args:
+        model (nn.Module): The network, in eval mode.
+        scale (int): Upsampling scale of the network.
+        max_pad (int): The largest tile pad to probe. Default: 32.
+        tol (float): Tolerance of the max difference, in [0, 1] range. Default: 0.5 / 255.
+        core (int): Size of the probed area. Default: 8.
+        multiple (int): The tile pad is a multiple of it, e.g., 2 for x2 models, whose inputs should be divisible
+            by 2. Default: 1.
+
+    Returns:
+        int: The tile pad, max_pad if no smaller pad is within tol.
+    """
+    param = next(model.parameters(), None)  # frozen (e.g., quantized) networks have no parameters, they run on the CPU
+    size = core + 2 * max_pad
+    img = _probe_image(size, 'cpu', torch.float32) if param is None else _probe_image(size, param.device, param.dtype)
+    start, end = max_pad * scale, (max_pad + core) * scale
+    reference = model(img)[:, :, start:end, start:end].float()
+
+    def error(pad):
+        crop = img[:, :, max_pad - pad:max_pad + core + pad, max_pad - pad:max_pad + core + pad]
+        output = model(crop)[:, :, pad * scale:(pad + core) * scale, pad * scale:(pad + core) * scale]
+        return (output.float() - reference).abs().max().item()
+
+    low, high = 0, max_pad // multiple
+    while low < high:
+        mid = (low + high) // 2
+        if error(mid * multiple) <= tol:
+            high = mid
+        else:
+            low = mid + 1
+    return low * multiple
+
+
+def get_tile_pad(model, scale, key=None, cache_file=None, max_pad=32, tol=0.5 / 255, multiple=1, arch=None):
+    """Derive the tile pad of a network: the probed pad, bounded by the receptive field.
+
+    The probed pads are cached in a json file, keyed by the model key, so that a model is only probed once.
+
+    Args:
+        model (nn.Module): The network, in eval mode.
+        scale (int): Upsampling scale of the network.
+        key (str): Key of the model (arch and weights) in the cache. Default: None, which disables the cache.
+        cache_file (str): Path of the json cache. Default: None, which disables the cache.
+        max_pad (int): The largest tile pad to probe. Default: 32.
+        tol (float): Tolerance of the max difference, in [0, 1] range. Default: 0.5 / 255.
+        multiple (int): The tile pad is a multiple of it. Default: 1.
+        arch (nn.Module): The network that the receptive field is derived from, if model is converted (e.g.,
+            quantized or traced). Default: None, which uses model.
+
+    Returns:
+        int: The tile pad.
+    """
+    max_pad = min(math.ceil(receptive_field(arch or model) / multiple) * multiple, max_pad // multiple * multiple)
+    key = None if key is None else f'{key}|max_pad={max_pad}|tol={tol:.6f}'
+    cache = {}
+    if key is not None and cache_file is not None and os.path.isfile(cache_file):
+        try:
+            with open(cache_file, 'r') as f:
+                cache = json.load(f)
+        except (OSError, ValueError):  # removed or broken, probe again
+            cache = {}
+        if key in cache:
+            return cache[key]
+
+    tile_pad = probe_tile_pad(model, scale, max_pad=max_pad, tol=tol, multiple=multiple)
+    print(f'\tProbed tile_pad: {tile_pad} (receptive field bound: {max_pad})')
+    if key is not None and cache_file is not None:
+        cache[key] = tile_pad
+        with atomic_write(cache_file) as tmp_path, open(tmp_path, 'w') as f:
+            json.dump(cache, f, indent=2)
+    return tile_pad
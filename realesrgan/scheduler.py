@@ -0,0 +1,210 @@
+import queue
+import threading
+import time
+import torch
+from concurrent.futures import Future
+from torch.nn import functional as F
+
+__all__ = ['TileScheduler']
+
+_STOP = object()
+
+
+def _fixed_window(start, end, size, length):
+    """Move/extend the window [start, end) to a window of `size` inside [0, length).
+
+    The window keeps covering [start, end). If the image is smaller than `size`, the window is the whole image and
+    the caller pads the rest.
+    """
+    start = min(start, max(length - size, 0))
+    return start, min(start + size, length)
+
+
+class _Job():
+    """Book-keeping of one submitted image."""
+
+    def __init__(self, future, inputs, outputs, num_tiles, meta):
+        self.future = future
+        self.inputs = inputs
+        self.outputs = outputs
+        self.remaining = num_tiles
+        self.meta = meta
+
+
+class TileScheduler(threading.Thread):
+    """Upsample many images by scheduling their tiles through one global queue.
+
+    Tiles of all the submitted images are cut into the same fixed shape (tile + 2 * tile_pad), so that tiles of
+    different images can be stacked into full batches. Each image is re-assembled as soon as its last tile is
+    finished, and its result is returned through a future.
+
+    Usage:
+        with TileScheduler(upsampler, batch_size=8) as scheduler:
+            futures = [scheduler.submit(img, outscale=2) for img in imgs]
+            outputs = [future.result() for future in futures]  # (output, img_mode), like RealESRGANer.enhance
+
+    Args:
+        upsampler (RealESRGANer): The upsampler that holds the model.
+        batch_size (int): Number of tiles in one forward pass. Default: 8.
+        tile (int): Tile size. Default: None, which uses upsampler.tile_size (256 if it is 0).
+        max_delay (float): Max time (in seconds) to wait for a batch to be filled before running a partial batch.
+            Default: 0.01.
+    """
+
+    def __init__(self, upsampler, batch_size=8, tile=None, max_delay=0.01):
+        super().__init__(daemon=True)
+        self.upsampler = upsampler
+        self.batch_size = batch_size
+        self.tile_size = tile or upsampler.tile_size or 256
+        self.max_delay = max_delay
+        self.tile_shape = self.tile_size + 2 * upsampler.tile_pad
+
+        self._queue = queue.Queue()
+        self._closed = False
+        self.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def submit(self, img, outscale=None, alpha_upsampler='realesrgan'):
+        """Queue an image for upsampling.
+
+        Args:
+            img (ndarray): Input image, same as RealESRGANer.enhance.
+            outscale (float): The final upsampling scale of the image. Default: None.
+            alpha_upsampler (str): The upsampler for the alpha channel. Default: 'realesrgan'.
+
+        Returns:
+            Future: Its result is (output, img_mode), same as RealESRGANer.enhance.
+        """
+        if self._closed:
+            raise RuntimeError('Cannot submit images to a closed TileScheduler.')
+        upsampler = self.upsampler
+        future = Future()
+        h_input, w_input = img.shape[0:2]
+        img, alpha, img_mode, max_range = upsampler.split_input(img, alpha_upsampler)
+        planes = [img]
+        if img_mode == 'RGBA' and alpha_upsampler == 'realesrgan':
+            planes.append(alpha)
+
+        inputs = []
+        for plane in planes:
+            plane, mod_pad_h, mod_pad_w = upsampler._pre_process(plane, upsampler.get_mod_scale())
+            inputs.append(plane)
+        batch, channel, height, width = inputs[0].shape
+        outputs = [x.new_zeros((batch, channel, height * upsampler.scale, width * upsampler.scale)) for x in inputs]
+
+        tiles = upsampler.get_tiles(height, width, self.tile_size)
+        meta = dict(
+            alpha=alpha if len(planes) == 1 else None,
+            alpha_upsampler=alpha_upsampler,
+            img_mode=img_mode,
+            max_range=max_range,
+            size=(h_input, w_input),
+            outscale=outscale,
+            mod_pad=(mod_pad_h, mod_pad_w))
+        job = _Job(future, inputs, outputs, len(tiles) * len(planes), meta)
+        for plane_idx in range(len(planes)):
+            for tile in tiles:
+                self._queue.put((job, plane_idx, tile))
+        return future
+
+    def close(self):
+        """Finish all the queued images and stop the scheduler thread."""
+        if not self._closed:
+            self._closed = True
+            self._queue.put(_STOP)
+            self.join()
+
+    def run(self):
+        pending = []
+        deadline = None
+        while True:
+            timeout = None if not pending else max(deadline - time.monotonic(), 0)
+            try:
+                entry = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                entry = None
+
+            if entry is _STOP:
+                while pending:
+                    self._run_batch(pending[:self.batch_size])
+                    pending = pending[self.batch_size:]
+                break
+            if entry is not None:
+                if not pending:
+                    deadline = time.monotonic() + self.max_delay
+                pending.append(entry)
+            if len(pending) >= self.batch_size or time.monotonic() >= deadline:
+                self._run_batch(pending[:self.batch_size])
+                pending = pending[self.batch_size:]
+                deadline = time.monotonic() + self.max_delay
+
+    def _run_batch(self, entries):
+        """Upsample a batch of fixed-shape tiles and scatter them back to their images."""
+        scale = self.upsampler.scale
+        size = self.tile_shape
+        input_tiles = []
+        boxes = []
+        for job, plane_idx, tile in entries:
+            img = job.inputs[plane_idx]
+            _, _, height, width = img.shape
+            pad_y0, pad_y1, pad_x0, pad_x1 = tile.pad_box
+            y0, y1 = _fixed_window(pad_y0, pad_y1, size, height)
+            x0, x1 = _fixed_window(pad_x0, pad_x1, size, width)
+            input_tile = img[:, :, y0:y1, x0:x1]
+            # small images are padded to the fixed shape, the padded area is cropped away afterwards
+            pad_h, pad_w = size - (y1 - y0), size - (x1 - x0)
+            if pad_h > 0 or pad_w > 0:
+                mode = 'reflect' if pad_h < y1 - y0 and pad_w < x1 - x0 else 'replicate'
+                input_tile = F.pad(input_tile, (0, pad_w, 0, pad_h), mode)
+            input_tiles.append(input_tile)
+
+            out_y0, out_y1, out_x0, out_x1 = tile.out_box
+            crop_y0, crop_x0 = out_y0 - y0 * scale, out_x0 - x0 * scale
+            boxes.append((tile.out_box, (crop_y0, crop_y0 + out_y1 - out_y0, crop_x0, crop_x0 + out_x1 - out_x0)))
+
+        try:
+            with torch.no_grad():
+                output_tiles = self.upsampler.forward(torch.cat(input_tiles))
+        except RuntimeError as error:
+            for job, _, _ in entries:
+                if not job.future.done():
+                    job.future.set_exception(error)
+            return
+
+        for i, ((job, plane_idx, _), (out_box, crop_box)) in enumerate(zip(entries, boxes)):
+            if job.future.done():  # failed in a previous batch
+                continue
+            out_y0, out_y1, out_x0, out_x1 = out_box
+            crop_y0, crop_y1, crop_x0, crop_x1 = crop_box
+            job.outputs[plane_idx][:, :, out_y0:out_y1, out_x0:out_x1] = output_tiles[i:i + 1, :, crop_y0:crop_y1,
+                                                                                      crop_x0:crop_x1]
+            job.remaining -= 1
+            if job.remaining == 0:
+                self._finish(job)
+
+    def _finish(self, job):
+        """Remove the extra pads and convert the outputs of a finished image."""
+        upsampler = self.upsampler
+        meta = job.meta
+        mod_pad_h, mod_pad_w = meta['mod_pad']
+        outputs = [upsampler._post_process(output, mod_pad_h, mod_pad_w) for output in job.outputs]
+        try:
+            if len(outputs) > 1:
+                output_alpha = outputs[1]
+            elif meta['alpha'] is not None:
+                output_alpha = upsampler.upsample_alpha(meta['alpha'], outputs[0], meta['alpha_upsampler'])
+            else:
+                output_alpha = None
+            output = upsampler.merge_output(outputs[0], output_alpha, meta['img_mode'], meta['max_range'], meta['size'],
+                                            meta['outscale'])
+        except Exception as error:
+            job.future.set_exception(error)
+        else:
+            job.future.set_result((output, meta['img_mode']))
+        # release the memory of the finished image
+        job.inputs = job.outputs = None
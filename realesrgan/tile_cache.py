@@ -0,0 +1,143 @@
+import hashlib
+import numpy as np
+import os
+import threading
+import torch
+from collections import Counter, OrderedDict
+
+from realesrgan.cache import atomic_write
+
+__all__ = ['TileCache']
+
+
+class TileCache():
+    """Content-addressed cache of upsampled tiles.
+
+    Tiles are keyed by a hash of the padded input tile and the model (arch, weights and DNI weights), precision and
+    scale. So identical tiles, e.g., in screenshots, sprite sheets and tiled textures, or the unchanged tiles of a
+    re-run after a small edit, are upsampled only once.
+
+    There are two tiers: an in-memory LRU, and an optional on-disk tier (one .npy file per tile) whose least recently
+    used files are removed when it grows larger than max_disk.
+
+    Usage:
+        upsampler = RealESRGANer(..., tile=256, tile_cache=TileCache(cache_dir=get_cache_dir('tiles')))
+
+    Args:
+        max_memory (int): Size (in bytes) of the in-memory tier. Default: 512 MB.
+        cache_dir (str): Folder of the on-disk tier. Default: None, which disables it.
+        max_disk (int): Size (in bytes) of the on-disk tier. Default: 4 GB.
+    """
+
+    def __init__(self, max_memory=512 * 1024**2, cache_dir=None, max_disk=4 * 1024**3):
+        self.max_memory = max_memory
+        self.cache_dir = cache_dir
+        self.max_disk = max_disk
+        # hits in memory, hits on disk, misses
+        self.stats = Counter()
+
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._disk_size = None  # scanned lazily
+        self._lock = threading.Lock()
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, input_tile, model_key, scale):
+        """Hash a padded input tile (n, c, h, w) for a model."""
+        h = hashlib.blake2b(digest_size=16)
+        h.update(f'{model_key}|scale={scale}|{input_tile.dtype}|{tuple(input_tile.shape)}'.encode())
+        input_tile = input_tile.detach().cpu().contiguous()
+        if input_tile.dtype == torch.bfloat16:  # numpy has no bf16, hash the raw bits
+            input_tile = input_tile.view(torch.int16)
+        h.update(input_tile.numpy().tobytes())
+        return h.hexdigest()
+
+    def get(self, key):
+        """Get an upsampled tile (on the CPU), or None."""
+        with self._lock:
+            output = self._memory.get(key)
+            if output is not None:
+                self._memory.move_to_end(key)
+                self.stats['memory_hits'] += 1
+                return output
+
+        path = self._path(key)
+        if path is not None and os.path.isfile(path):
+            try:
+                output = torch.from_numpy(np.load(path))
+                os.utime(path)  # mark as recently used
+            except (OSError, ValueError):  # removed or partially written by another process
+                output = None
+            if output is not None:
+                with self._lock:
+                    self.stats['disk_hits'] += 1
+                self._put_memory(key, output)
+                return output
+
+        with self._lock:
+            self.stats['misses'] += 1
+        return None
+
+    def put(self, key, output):
+        """Put an upsampled tile into the cache."""
+        output = output.detach().to('cpu', copy=True)  # do not keep the batch that the tile is sliced from
+        self._put_memory(key, output)
+        path = self._path(key)
+        if path is not None and not os.path.isfile(path):
+            with atomic_write(path) as tmp_path, open(tmp_path, 'wb') as f:
+                # numpy has no bf16, it is stored in fp32 (exactly) and converted back by the readers
+                np.save(f, (output.float() if output.dtype == torch.bfloat16 else output).numpy())
+            self._add_disk(os.path.getsize(path))
+
+    def add_hits(self, count):
+        """Count tiles that reuse an identical tile of the same image, which is not in the cache yet, as memory
+        hits."""
+        with self._lock:
+            self.stats['memory_hits'] += count
+
+    def hit_rate(self):
+        lookups = sum(self.stats.values())
+        return (self.stats['memory_hits'] + self.stats['disk_hits']) / lookups if lookups else 0.
+
+    def report(self):
+        return (f'Tile cache: {self.hit_rate():.1%} hit rate ({self.stats["memory_hits"]} memory hits, '
+                f'{self.stats["disk_hits"]} disk hits, {self.stats["misses"]} misses)')
+
+    def _path(self, key):
+        return None if self.cache_dir is None else os.path.join(self.cache_dir, f'{key}.npy')
+
+    def _put_memory(self, key, output):
+        size = output.numel() * output.element_size()
+        if size > self.max_memory:
+            return
+        with self._lock:
+            if key in self._memory:
+                return
+            self._memory[key] = output
+            self._memory_size += size
+            while self._memory_size > self.max_memory:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_size -= evicted.numel() * evicted.element_size()
+
+    def _add_disk(self, size):
+        """Account a new file, and remove the least recently used files when the disk tier is too large."""
+        with self._lock:
+            if self._disk_size is None:
+                self._disk_size = sum(entry.stat().st_size for entry in os.scandir(self.cache_dir)
+                                      if entry.name.endswith('.npy'))
+            else:
+                self._disk_size += size
+            if self._disk_size <= self.max_disk:
+                return
+            entries = sorted((entry for entry in os.scandir(self.cache_dir) if entry.name.endswith('.npy')),
+                             key=lambda entry: entry.stat().st_mtime)
+            for entry in entries:
+                if self._disk_size <= self.max_disk * 0.9:
+                    break
+                try:
+                    size = entry.stat().st_size
+                    os.remove(entry.path)
+                except OSError:  # removed by another process
+                    continue
+                self._disk_size -= size
@@ -2,9 +2,11 @@
 import os.path as osp
 from basicsr.train import train_pipeline
 
-import realesrgan.archs
 import realesrgan.data
 import realesrgan.models
+from realesrgan.archs import import_arch_modules
+
+import_arch_modules()
 
 if __name__ == '__main__':
     root_path = osp.abspath(osp.join(__file__, osp.pardir, osp.pardir))
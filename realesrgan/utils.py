@@ -1,14 +1,268 @@
 import cv2
+import functools
 import math
 import numpy as np
 import os
 import queue
 import threading
+import time
 import torch
-from basicsr.utils.download_util import load_file_from_url
+import warnings
+from collections import Counter, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from torch.nn import functional as F
 
+from realesrgan.backends import build_backend
+from realesrgan.cache import atomic_write, get_cache_dir
+from realesrgan.dni import blend_weights
+from realesrgan.quantize import INT8_SUFFIX, load_quantized
+from realesrgan.receptive_field import get_tile_pad
+
+__all__ = [
+    'Tile', 'lanczos_taps', 'resize_with_taps', 'lanczos_resize', 'is_oom_error', 'PRECISIONS', 'cpu_supports_bf16',
+    'resolve_precision', 'mmap_path', 'has_mmap_copy', 'save_mmap_checkpoint', 'load_checkpoint', 'checkpoint_id',
+    'guided_filter', 'set_intra_op_threads', 'RealESRGANer', 'PrefetchReader', 'IOConsumer'
+]
+
 ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# max memory (in bytes) of a batch of tiles on the CPU, when it is derived from the free memory
+CPU_MEMORY_CAP = 2 * 1024**3
+
+# Geometry of one tile. All boxes are (start_y, end_y, start_x, end_x).
+#   pad_box: input area with tile padding, i.e., the area fed into the network.
+#   out_box: output area on the total (upsampled) image.
+#   crop_box: area inside the upsampled padded tile that is put into out_box.
+Tile = namedtuple('Tile', ['pad_box', 'out_box', 'crop_box'])
+
+# inputs are not subdivided below this size when the memory runs out
+MIN_TILE_SIZE = 16
+
+
+def lanczos_taps(dst_start, dst_end, src_size, dst_size, src_offset=0, src_len=None, device=None):
+    """Source indices and weights of a Lanczos4 resize (the kernel of cv2.INTER_LANCZOS4) from src_size to dst_size.
+
+    Args:
+        dst_start (int): The first output pixel.
+        dst_end (int): The end (exclusive) of the output pixels.
+        src_size (int): Size of the full source. Indices are clamped to it (border replicate).
+        dst_size (int): Size of the full output.
+        src_offset (int): The available source is a crop starting from src_offset, indices are local to the crop.
+            Default: 0.
+        src_len (int): Length of the available source crop. Default: None, which means src_size.
+        device (torch.device): Device of the taps. Default: None.
+
+    Returns:
+        tuple[Tensor]: Indices (long) and weights (float32), both with shape (dst_end - dst_start, 8).
+    """
+    taps = torch.arange(8, dtype=torch.float64)
+    fx = (torch.arange(dst_start, dst_end, dtype=torch.float64) + 0.5) * (src_size / dst_size) - 0.5
+    sx = torch.floor(fx)
+    distance = (fx - sx).unsqueeze(1) + 3 - taps
+    weights = torch.sinc(distance) * torch.sinc(distance / 4)
+    weights /= weights.sum(dim=1, keepdim=True)
+    idx = (sx.unsqueeze(1) - 3 + taps).long().clamp_(0, src_size - 1) - src_offset
+    idx.clamp_(0, (src_size if src_len is None else src_len) - 1)
+    return idx.to(device), weights.float().to(device)
+
+
+def resize_with_taps(img, taps_y, taps_x):
+    """Separable resize of a (n, c, h, w) tensor with the taps of lanczos_taps."""
+    for dim, (idx, weights) in ((3, taps_x), (2, taps_y)):
+        shape = [1, 1, 1, 1]
+        shape[dim] = -1
+        output = None
+        for k in range(idx.size(1)):
+            term = img.index_select(dim, idx[:, k]) * weights[:, k].view(shape)
+            output = term if output is None else output.add_(term)
+        img = output
+    return img
+
+
+def lanczos_resize(img, size):
+    """Resize a (n, c, h, w) tensor to size (h, w) on its device, like cv2.resize with cv2.INTER_LANCZOS4."""
+    h, w = img.shape[2:]
+    taps_y = lanczos_taps(0, size[0], h, size[0], device=img.device)
+    taps_x = lanczos_taps(0, size[1], w, size[1], device=img.device)
+    return resize_with_taps(img.float(), taps_y, taps_x)
+
+
+def _dst_range(start, end, src_size, dst_size):
+    """Output pixels of a resize from src_size to dst_size whose centers fall into the source range [start, end)."""
+    dst_start = 0 if start == 0 else -((src_size - 2 * start * dst_size) // (2 * src_size))
+    dst_end = dst_size if end >= src_size else -((src_size - 2 * end * dst_size) // (2 * src_size))
+    return min(dst_start, dst_size), min(dst_end, dst_size)
+
+
+def is_oom_error(error):
+    """Whether a RuntimeError is an allocation failure (CUDA or CPU), which can be retried with smaller inputs."""
+    if hasattr(torch.cuda, 'OutOfMemoryError') and isinstance(error, torch.cuda.OutOfMemoryError):
+        return True
+    message = str(error)
+    return 'out of memory' in message or "can't allocate memory" in message
+
+
+# end of the PrefetchReader queue
+_END = object()
+
+# {precision: dtype of the weights and the network inputs}
+PRECISIONS = {'fp32': torch.float32, 'fp16': torch.float16, 'bf16': torch.bfloat16}
+
+
+@functools.lru_cache()
+def cpu_supports_bf16():
+    """Whether the CPU has native bf16 instructions (AVX512-BF16 or AMX), where bf16 convs are faster than fp32."""
+    try:
+        with open('/proc/cpuinfo', 'r') as f:
+            flags = f.read()
+    except OSError:
+        return False
+    return 'avx512_bf16' in flags or 'amx_bf16' in flags
+
+
+def resolve_precision(precision, device):
+    """Resolve a precision policy for a device.
+
+    auto is fp16 on CUDA, bf16 on CPUs with native bf16 support, and fp32 elsewhere. fp16 on the CPU and bf16 on
+    CUDA devices without bf16 support fall back to fp32 (with a warning), as their convs are unsupported or slow.
+
+    Args:
+        precision (str): auto | fp32 | fp16 | bf16.
+        device (torch.device): The device of the network.
+
+    Returns:
+        str: fp32 | fp16 | bf16.
+    """
+    assert precision in ('auto', *PRECISIONS), f'Unsupported precision: {precision}. Options: auto | fp32 | fp16 | bf16'
+    device = torch.device(device)
+    if precision == 'auto':
+        if device.type == 'cuda':
+            return 'fp16'
+        return 'bf16' if device.type == 'cpu' and cpu_supports_bf16() else 'fp32'
+    if precision == 'fp16' and device.type == 'cpu':
+        warnings.warn('fp16 is not supported on the CPU, use fp32 instead.')
+        return 'fp32'
+    if precision == 'bf16' and device.type == 'cuda' and not torch.cuda.is_bf16_supported():
+        warnings.warn(f'bf16 is not supported on {device}, use fp32 instead.')
+        return 'fp32'
+    return precision
+
+
+def mmap_path(model_path, precision='fp32'):
+    """Path of the memory-mappable copy of a checkpoint in a precision, see scripts/convert_mmap.py: *.mmap.pth in
+    fp32, *.<precision>.mmap.pth (e.g., *.bf16.mmap.pth) in the others."""
+    suffix = '.mmap.pth' if precision == 'fp32' else f'.{precision}.mmap.pth'
+    return os.path.splitext(model_path)[0] + suffix
+
+
+def has_mmap_copy(model_path, precision='fp32'):
+    """Whether the memory-mappable copy of a checkpoint in a precision exists and is up to date, i.e., not older than
+    the checkpoint (e.g., updated weights)."""
+    path = mmap_path(model_path, precision)
+    if not os.path.isfile(path):
+        return False
+    return not os.path.isfile(model_path) or os.stat(path).st_mtime_ns >= os.stat(model_path).st_mtime_ns
+
+
+def save_mmap_checkpoint(model_path, precision='fp32'):
+    """Write a memory-mappable copy (see mmap_path) of a checkpoint: a plain state dict of contiguous tensors, saved in
+    the zip format, which torch.load(mmap=True, weights_only=True) maps without deserializing it.
+
+    The floating point tensors are stored in the precision that the model runs in, so that moving the model to its
+    dtype does not copy the mapped weights.
+
+    Returns:
+        str: Path of the copy.
+    """
+    loadnet = torch.load(model_path, map_location=torch.device('cpu'))
+    keyname = 'params_ema' if 'params_ema' in loadnet else 'params'
+    dtype = PRECISIONS[precision]
+    params = {k: (v.to(dtype) if v.is_floating_point() else v).contiguous() for k, v in loadnet[keyname].items()}
+    save_path = mmap_path(model_path, precision)
+    with atomic_write(save_path) as tmp_path:
+        torch.save({'params': params}, tmp_path)
+    return save_path
+
+
+def load_checkpoint(model_path, precision='fp32'):
+    """Load a checkpoint on the CPU.
+
+    A memory-mappable copy in the precision (see mmap_path, written by scripts/convert_mmap.py, or model_path itself)
+    is mapped zero-copy with torch.load(mmap=True): worker processes on one host share the page cache of the weights,
+    instead of deserializing them into their own memory. The returned dict has mmap=True in this case. A copy that is
+    older than model_path is ignored.
+    """
+    if model_path.endswith('.mmap.pth'):
+        path = model_path
+    elif has_mmap_copy(model_path, precision):
+        path = mmap_path(model_path, precision)
+    else:
+        path = None
+        if os.path.isfile(mmap_path(model_path, precision)):
+            warnings.warn(f'{mmap_path(model_path, precision)} is older than {model_path}, it is ignored. Run '
+                          'scripts/convert_mmap.py to update it.')
+    if path is not None:
+        try:
+            loadnet = torch.load(path, map_location=torch.device('cpu'), mmap=True, weights_only=True)
+        except TypeError:  # torch < 2.1 does not support mmap
+            pass
+        else:
+            loadnet['mmap'] = True
+            return loadnet
+    return torch.load(model_path, map_location=torch.device('cpu'))
+
+
+def checkpoint_id(path):
+    """Identity of a checkpoint in the caches: its absolute path, size and modification time, so that weights that
+    are replaced (e.g., retrained under the same name) never hit the entries of the old ones. Other paths (e.g., URLs)
+    are returned as they are."""
+    if not os.path.isfile(path):
+        return path
+    stat = os.stat(path)
+    return f'{os.path.abspath(path)}@{stat.st_size}@{stat.st_mtime_ns}'
+
+
+def guided_filter(guide, src, radius, eps):
+    """Guided image filter.
+
+    ``Paper: Guided Image Filtering``
+
+    Args:
+        guide (Tensor): Guidance image with shape (n, 1, h, w).
+        src (Tensor): Image to be filtered with shape (n, 1, h, w).
+        radius (int): Radius of the box filters.
+        eps (float): Regularization, larger values give smoother results.
+    """
+
+    def box(x):
+        return F.avg_pool2d(x, 2 * radius + 1, stride=1, padding=radius, count_include_pad=False)
+
+    mean_guide = box(guide)
+    mean_src = box(src)
+    cov = box(guide * src) - mean_guide * mean_src
+    var = box(guide * guide) - mean_guide * mean_guide
+    a = cov / (var + eps)
+    b = mean_src - a * mean_guide
+    return box(a) * guide + box(b)
+
+
+def set_intra_op_threads(num_workers, num_cores=None):
+    """Divide the CPU cores between worker threads that share one model.
+
+    The torch intra-op thread number is process-wide, and every worker thread that runs a forward pass uses that
+    many threads. So with the default setting, N workers oversubscribe the cores N times.
+
+    Args:
+        num_workers (int): Number of worker threads (or processes) that run inference at the same time.
+        num_cores (int): Number of CPU cores to divide. Default: None, which uses all the available cores.
+
+    Returns:
+        int: The number of intra-op threads of each worker.
+    """
+    if num_cores is None:
+        num_cores = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+    num_threads = max(num_cores // max(num_workers, 1), 1)
+    torch.set_num_threads(num_threads)
+    return num_threads
 
 
 class RealESRGANer():
@@ -17,13 +271,48 @@ class RealESRGANer():
     Args:
         scale (int): Upsampling scale factor used in the networks. It is usually 2 or 4.
         model_path (str): The path to the pretrained model. It can be urls (will first download it automatically).
+            An int8 quantized checkpoint (*.int8.pt, see scripts/quantize_int8.py) runs on the CPU.
         model (nn.Module): The defined network. Default: None.
         tile (int): As too large images result in the out of GPU memory issue, so this tile option will first crop
             input images into tiles, and then process each of them. Finally, they will be merged into one image.
             0 denotes for do not use tile. Default: 0.
-        tile_pad (int): The pad size for each tile, to remove border artifacts. Default: 10.
+        tile_pad (int | str): The pad size for each tile, to remove border artifacts. 'auto' derives it from the
+            model: a seam probe bounded by the receptive field, cached per model (see get_tile_pad). The probe only
+            runs with tile > 0, otherwise 'auto' is 10 (the pad of the tiles of the out-of-memory fallback).
+            Default: 10.
         pre_pad (int): Pad the input images to avoid border artifacts. Default: 10.
-        half (float): Whether to use half precision during inference. Default: False.
+        half (float): Whether to use half precision during inference, the same as precision='fp16'. Default: False.
+        tile_batch (int): Number of tiles stacked into one forward pass in tile mode. Tiles with the same padded
+            shape are batched together. 0 denotes for deriving it from the memory budget. Default: 1.
+        memory_budget (int): Memory (in bytes) that a batch of tiles may use when tile_batch is 0. None denotes for
+            querying the free memory of the device (at most CPU_MEMORY_CAP on the CPU). Default: None.
+        flat_threshold (float): In tile mode, padded tiles whose (max - min) is not larger than it (in [0, 1] range,
+            e.g., 2 / 255) are upsampled by bicubic interpolation plus the model response to their flat color,
+            instead of the network. None denotes for no skipping. Default: None.
+        tile_cache (TileCache): In tile mode, cache of the upsampled tiles, keyed by the padded input tile and
+            model_key. Default: None.
+        registry (ModelRegistry): Share the loaded models in a process: a repeat request of the same model skips the
+            weight loading. Default: None.
+        dni_cache (bool): Cache the DNI-blended weights in the cache folder, so that later constructions with the
+            same dni_weight load one pre-blended file. Default: True.
+        backend (str | callable): Execution backend of the network: None or 'torch' (eager), 'trace' or 'compile'
+            (graphs specialized per input shape in channels_last, see TorchScriptBackend), 'onnx' or the path of an
+            ONNX file (ONNX Runtime on the CPU, see OnnxBackend), or a callable. Default: None.
+        precision (str): Precision policy of the weights, the network inputs and the outputs: auto | fp32 | fp16 |
+            bf16, resolved for the device (see resolve_precision). The resolved one is in self.precision. Default:
+            None, which is fp16 if half else fp32.
+
+    Concurrency:
+        enhance does not modify the instance: the intermediate results are passed explicitly between the reentrant
+        _pre_process, _process/_tile_process and _post_process. So one RealESRGANer (and one copy of the weights)
+        can serve several threads at the same time. Use set_intra_op_threads to divide the CPU cores between the
+        worker threads. The legacy pre_process, process, tile_process and post_process keep their results on the
+        instance (self.img, self.output, self.mod_pad_h, self.mod_pad_w) and are NOT thread-safe.
+
+    Memory:
+        When a forward pass runs out of memory, the batch is split or the tile is subdivided until it fits (see
+        _run_model). The working sizes are kept in max_tile_batch and max_tile_size, so aggressive tile sizes can be
+        used for throughput without failing on the odd oversized input. With tile=0, it falls back to tiling.
     """
 
     def __init__(self,
@@ -36,13 +325,35 @@ class RealESRGANer():
                  pre_pad=10,
                  half=False,
                  device=None,
-                 gpu_id=None):
+                 gpu_id=None,
+                 tile_batch=1,
+                 memory_budget=None,
+                 flat_threshold=None,
+                 tile_cache=None,
+                 registry=None,
+                 dni_cache=True,
+                 backend=None,
+                 precision=None):
         self.scale = scale
         self.tile_size = tile
         self.tile_pad = tile_pad
+        self.tile_batch = tile_batch
+        self.memory_budget = memory_budget
+        self.flat_threshold = flat_threshold
+        self.tile_cache = tile_cache
+        self.dni_cache = dni_cache
+        # the sizes that fit in memory after allocation failures, shared by all the later tiles and images
+        self.max_tile_size = None
+        self.max_tile_batch = None
+        # peak number of feature values per input pixel, measured on the first get_max_batch
+        self._pixel_cost = None
+        # counters of the tile mode, e.g., tile_stats['flat'] is the number of skipped flat tiles
+        self.tile_stats = Counter()
+        self._flat_offsets = {}
+        # guards the state shared by the threads: the memory limits, tile_stats and the flat offsets
+        self._lock = threading.Lock()
         self.pre_pad = pre_pad
         self.mod_scale = None
-        self.half = half
 
         # initialize model
         if gpu_id:
@@ -51,6 +362,45 @@ class RealESRGANer():
         else:
             self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu') if device is None else device
 
+        # int8 quantized checkpoints (see realesrgan.quantize) run on the CPU in fp32 (int8 inside)
+        self.int8 = isinstance(model_path, str) and model_path.endswith(INT8_SUFFIX)
+        if self.int8:
+            self.device = torch.device('cpu')
+            precision = 'fp32'
+        elif precision is None:
+            precision = 'fp16' if half else 'fp32'
+        self.precision = resolve_precision(precision, self.device)
+        self.dtype = PRECISIONS[self.precision]
+        self.half = self.precision == 'fp16'
+
+        # identify the arch and the weights, e.g., for the caches
+        paths = model_path if isinstance(model_path, list) else [model_path]
+        self.model_key = f'{type(model).__name__}:{"+".join(map(checkpoint_id, paths))}:dni={dni_weight}'
+
+        if registry is None:
+            self.model = self.load_model(model, model_path, dni_weight)
+        else:
+            key = self.registry_key(model, model_path, dni_weight)
+            self.model = registry.get(key, lambda: self.load_model(model, model_path, dni_weight))
+
+        if self.tile_pad == 'auto' and not self.tile_size:
+            self.tile_pad = 10
+        elif self.tile_pad == 'auto':
+            self.tile_pad = get_tile_pad(
+                self.model,
+                self.scale,
+                key=f'{self.model_key}:{self.precision}',
+                cache_file=get_cache_dir('tile_pad.json'),
+                multiple=self.get_mod_scale() or 1,
+                arch=model)
+
+        self.backend = build_backend(self.model, backend, key=self.model_key)
+
+    def load_model(self, model, model_path, dni_weight=None):
+        """Load the weights into the model, and move it to the device (in self.dtype).
+
+        An int8 quantized checkpoint (*.int8.pt) is a complete network, which replaces the model.
+        """
         if isinstance(model_path, list):
             # dni
             assert len(model_path) == len(dni_weight), 'model_path and dni_weight should have the save length.'
@@ -58,89 +408,189 @@ class RealESRGANer():
         else:
             # if the model_path starts with https, it will first download models to the folder: weights
             if model_path.startswith('https://'):
+                from basicsr.utils.download_util import load_file_from_url
                 model_path = load_file_from_url(
                     url=model_path, model_dir=os.path.join(ROOT_DIR, 'weights'), progress=True, file_name=None)
-            loadnet = torch.load(model_path, map_location=torch.device('cpu'))
+            if model_path.endswith(INT8_SUFFIX):
+                return load_quantized(model_path)[0]
+            loadnet = load_checkpoint(model_path, self.precision)
 
         # prefer to use params_ema
         if 'params_ema' in loadnet:
             keyname = 'params_ema'
         else:
             keyname = 'params'
-        model.load_state_dict(loadnet[keyname], strict=True)
+        if loadnet.get('mmap', False):
+            dtypes = {v.dtype for v in loadnet[keyname].values() if v.is_floating_point()}
+            if self.device.type == 'cpu' and dtypes - {self.dtype}:
+                warnings.warn(f'The memory-mapped weights of {model_path} are not in {self.precision}, they are '
+                              f'copied. Run scripts/convert_mmap.py --precision {self.precision} to share them.')
+            # use the mapped tensors as the parameters, without copying them into fresh memory
+            model.load_state_dict(loadnet[keyname], strict=True, assign=True)
+        else:
+            model.load_state_dict(loadnet[keyname], strict=True)
 
         model.eval()
-        self.model = model.to(self.device)
-        if self.half:
-            self.model = self.model.half()
+        return model.to(self.device, self.dtype)
+
+    def registry_key(self, model, model_path, dni_weight=None):
+        """Key of a model in a ModelRegistry: (arch config, weights, dni_weight, precision, device)."""
+        weights = tuple(map(checkpoint_id, model_path if isinstance(model_path, list) else [model_path]))
+        dni_weight = None if dni_weight is None else tuple(dni_weight)
+        return (type(model).__name__, repr(model), weights, dni_weight, self.precision, str(self.device))
+
+    @torch.no_grad()
+    def warmup(self, input_size=64):
+        """Run the model once ahead of time, to initialize the kernels (e.g., cuDNN) of the device."""
+        multiple = self.get_mod_scale() or 1
+        input_size = math.ceil(input_size / multiple) * multiple
+        self.model(torch.zeros((1, 3, input_size, input_size), dtype=self.dtype, device=self.device))
 
     def dni(self, net_a, net_b, dni_weight, key='params', loc='cpu'):
         """Deep network interpolation.
 
         ``Paper: Deep Network Interpolation for Continuous Imagery Effect Transition``
-        """
-        net_a = torch.load(net_a, map_location=torch.device(loc))
-        net_b = torch.load(net_b, map_location=torch.device(loc))
-        for k, v_a in net_a[key].items():
-            net_a[key][k] = dni_weight[0] * v_a + dni_weight[1] * net_b[key][k]
-        return net_a
 
-    def pre_process(self, img):
-        """Pre-process, such as pre-pad and mod pad, so that the images can be divisible
+        The blended weights are cached on the disk for the (quantized) dni_weight, see blend_weights.
         """
-        img = torch.from_numpy(np.transpose(img, (2, 0, 1))).float()
-        self.img = img.unsqueeze(0).to(self.device)
-        if self.half:
-            self.img = self.img.half()
+        return blend_weights(net_a, net_b, dni_weight, key, loc, cache_dir=None if self.dni_cache else False)
 
+    def get_mod_scale(self):
+        """The inputs of x2 and x1 models are padded to be divisible by 2 and 4 (they use pixel unshuffle)."""
+        if self.scale == 2:
+            return 2
+        elif self.scale == 1:
+            return 4
+        return None
+
+    def _pre_process(self, img, mod_scale=None):
+        """Pre-process, such as pre-pad and mod pad, so that the images can be divisible.
+
+        It is reentrant: the results are returned instead of being kept on the instance.
+
+        Args:
+            img (Tensor): Input tensor with shape (n, c, h, w), see split_input.
+            mod_scale (int): The padded size is divisible by mod_scale. Default: None.
+
+        Returns:
+            tuple: The padded tensor, mod_pad_h and mod_pad_w.
+        """
         # pre_pad
         if self.pre_pad != 0:
-            self.img = F.pad(self.img, (0, self.pre_pad, 0, self.pre_pad), 'reflect')
+            img = F.pad(img, (0, self.pre_pad, 0, self.pre_pad), 'reflect')
         # mod pad for divisible borders
-        if self.scale == 2:
-            self.mod_scale = 2
-        elif self.scale == 1:
-            self.mod_scale = 4
-        if self.mod_scale is not None:
-            self.mod_pad_h, self.mod_pad_w = 0, 0
-            _, _, h, w = self.img.size()
-            if (h % self.mod_scale != 0):
-                self.mod_pad_h = (self.mod_scale - h % self.mod_scale)
-            if (w % self.mod_scale != 0):
-                self.mod_pad_w = (self.mod_scale - w % self.mod_scale)
-            self.img = F.pad(self.img, (0, self.mod_pad_w, 0, self.mod_pad_h), 'reflect')
+        mod_pad_h, mod_pad_w = 0, 0
+        if mod_scale is not None:
+            _, _, h, w = img.size()
+            if (h % mod_scale != 0):
+                mod_pad_h = (mod_scale - h % mod_scale)
+            if (w % mod_scale != 0):
+                mod_pad_w = (mod_scale - w % mod_scale)
+            img = F.pad(img, (0, mod_pad_w, 0, mod_pad_h), 'reflect')
+        return img, mod_pad_h, mod_pad_w
 
-    def process(self):
+    def pre_process(self, img):
+        """Pre-process, such as pre-pad and mod pad, so that the images can be divisible
+
+        The results are kept in self.img (and self.mod_pad_h, self.mod_pad_w), so it is not thread-safe.
+        """
+        img = torch.from_numpy(np.transpose(img, (2, 0, 1))).float()
+        img = img.unsqueeze(0).to(self.device, self.dtype)
+        mod_scale = self.get_mod_scale()
+        if mod_scale is not None:
+            self.mod_scale = mod_scale
+        self.img, self.mod_pad_h, self.mod_pad_w = self._pre_process(img, self.mod_scale)
+
+    def _process(self, img):
         # model inference
-        self.output = self.model(self.img)
+        return self._run_model(img)
 
-    def tile_process(self):
-        """It will first crop input images to tiles, and then process each tile.
-        Finally, all the processed tiles are merged into one images.
+    def forward(self, img):
+        """Run the network, or its execution backend, on a batch."""
+        return self.model(img) if self.backend is None else self.backend(img)
 
-        Modified from: https://github.com/ata4/esrgan-launcher
+    def _run_model(self, img):
+        """Run the model on a batch, falling back to smaller inputs when the memory runs out.
+
+        On allocation failures, a batch is split in halves, and a single input is subdivided into tiles of half its
+        size minus the tile pad (recursively, until it fits), so that each padded tile is smaller than the input. The
+        allocation failure is raised when the padded tiles cannot be smaller. The working sizes are recorded in
+        max_tile_batch and max_tile_size, so that later inputs are split up front instead of failing again. Other
+        errors are raised.
         """
-        batch, channel, height, width = self.img.shape
-        output_height = height * self.scale
-        output_width = width * self.scale
-        output_shape = (batch, channel, output_height, output_width)
+        batch, _, height, width = img.shape
+        if self.max_tile_batch is not None and batch > self.max_tile_batch:
+            return torch.cat([self._run_model(part) for part in img.split(self.max_tile_batch)])
+        if self.max_tile_size is not None and max(height, width) > self.max_tile_size + 2 * self.tile_pad:
+            return self._run_in_tiles(img, self.max_tile_size)
 
-        # start with black image
-        self.output = self.img.new_zeros(output_shape)
-        tiles_x = math.ceil(width / self.tile_size)
-        tiles_y = math.ceil(height / self.tile_size)
+        try:
+            with torch.no_grad():
+                return self.forward(img)
+        except RuntimeError as error:
+            if not is_oom_error(error):
+                raise
+            if self.device.type == 'cuda':
+                torch.cuda.empty_cache()
+            multiple = self.get_mod_scale() or 1
+            size = max(height, width)
+            if batch > 1:
+                limit = math.ceil(batch / 2)
+            else:
+                limit = math.ceil((size - 2 * self.tile_pad) / 2 / multiple) * multiple
+                if size <= MIN_TILE_SIZE or limit < 1 or limit + 2 * self.tile_pad >= size:
+                    raise
+            print(f'\tOut of memory with input {tuple(img.shape)}, retry with a {"batch" if batch > 1 else "tile"} '
+                  f'size of {limit}')
+
+        with self._lock:
+            if batch > 1:
+                self.max_tile_batch = limit if self.max_tile_batch is None else min(self.max_tile_batch, limit)
+            else:
+                self.max_tile_size = limit if self.max_tile_size is None else min(self.max_tile_size, limit)
+        if batch > 1:
+            return self._run_model(img)
+        # split right away: the padded tiles are smaller than this input, so the recursion ends
+        return self._run_in_tiles(img, self.max_tile_size)
+
+    def _run_in_tiles(self, img, tile_size):
+        """Upsample an input by tiles of tile_size. Each tile goes through _run_model."""
+        batch, channel, height, width = img.shape
+        output = img.new_zeros((batch, channel, height * self.scale, width * self.scale))
+        for tile in self.get_tiles(height, width, tile_size):
+            y0, y1, x0, x1 = tile.pad_box
+            out_y0, out_y1, out_x0, out_x1 = tile.out_box
+            crop_y0, crop_y1, crop_x0, crop_x1 = tile.crop_box
+            output_tile = self._run_model(img[:, :, y0:y1, x0:x1])
+            output[:, :, out_y0:out_y1, out_x0:out_x1] = output_tile[:, :, crop_y0:crop_y1, crop_x0:crop_x1]
+        return output
+
+    def process(self):
+        self.output = self._process(self.img)
+
+    def get_tiles(self, height, width, tile_size=None):
+        """Compute the tile geometry for an input of size (height, width).
 
-        # loop over all tiles
+        Args:
+            height (int): Height of the (pre-processed) input.
+            width (int): Width of the (pre-processed) input.
+            tile_size (int): Tile size. Default: None, which uses get_tile_size().
+
+        Returns:
+            list[Tile]: Tiles in raster order.
+        """
+        tile_size = self.get_tile_size() if tile_size is None else tile_size
+        tiles_x = math.ceil(width / tile_size)
+        tiles_y = math.ceil(height / tile_size)
+
+        tiles = []
         for y in range(tiles_y):
             for x in range(tiles_x):
-                # extract tile from input image
-                ofs_x = x * self.tile_size
-                ofs_y = y * self.tile_size
                 # input tile area on total image
-                input_start_x = ofs_x
-                input_end_x = min(ofs_x + self.tile_size, width)
-                input_start_y = ofs_y
-                input_end_y = min(ofs_y + self.tile_size, height)
+                input_start_x = x * tile_size
+                input_end_x = min(input_start_x + tile_size, width)
+                input_start_y = y * tile_size
+                input_end_y = min(input_start_y + tile_size, height)
 
                 # input tile area on total image with padding
                 input_start_x_pad = max(input_start_x - self.tile_pad, 0)
@@ -148,144 +598,611 @@ class RealESRGANer():
                 input_start_y_pad = max(input_start_y - self.tile_pad, 0)
                 input_end_y_pad = min(input_end_y + self.tile_pad, height)
 
-                # input tile dimensions
-                input_tile_width = input_end_x - input_start_x
-                input_tile_height = input_end_y - input_start_y
-                tile_idx = y * tiles_x + x + 1
-                input_tile = self.img[:, :, input_start_y_pad:input_end_y_pad, input_start_x_pad:input_end_x_pad]
-
-                # upscale tile
-                try:
-                    with torch.no_grad():
-                        output_tile = self.model(input_tile)
-                except RuntimeError as error:
-                    print('Error', error)
-                print(f'\tTile {tile_idx}/{tiles_x * tiles_y}')
-
-                # output tile area on total image
-                output_start_x = input_start_x * self.scale
-                output_end_x = input_end_x * self.scale
-                output_start_y = input_start_y * self.scale
-                output_end_y = input_end_y * self.scale
-
                 # output tile area without padding
                 output_start_x_tile = (input_start_x - input_start_x_pad) * self.scale
-                output_end_x_tile = output_start_x_tile + input_tile_width * self.scale
+                output_end_x_tile = output_start_x_tile + (input_end_x - input_start_x) * self.scale
                 output_start_y_tile = (input_start_y - input_start_y_pad) * self.scale
-                output_end_y_tile = output_start_y_tile + input_tile_height * self.scale
+                output_end_y_tile = output_start_y_tile + (input_end_y - input_start_y) * self.scale
 
-                # put tile into output image
-                self.output[:, :, output_start_y:output_end_y,
-                            output_start_x:output_end_x] = output_tile[:, :, output_start_y_tile:output_end_y_tile,
-                                                                       output_start_x_tile:output_end_x_tile]
+                tiles.append(
+                    Tile(
+                        pad_box=(input_start_y_pad, input_end_y_pad, input_start_x_pad, input_end_x_pad),
+                        out_box=(input_start_y * self.scale, input_end_y * self.scale, input_start_x * self.scale,
+                                 input_end_x * self.scale),
+                        crop_box=(output_start_y_tile, output_end_y_tile, output_start_x_tile, output_end_x_tile)))
+        return tiles
 
-    def post_process(self):
+    def get_tile_size(self):
+        """Get the tile size: self.tile_size, reduced to max_tile_size after allocation failures. 0 for no tile."""
+        if self.max_tile_size is None:
+            return self.tile_size
+        return min(self.tile_size or self.max_tile_size, self.max_tile_size)
+
+    @torch.no_grad()
+    def get_pixel_cost(self):
+        """Get the peak number of feature values per input pixel of a forward pass.
+
+        It is measured once with a small probe: the largest output of a layer, twice (the input and the output of a
+        layer are alive together), e.g., the 64 channels at 4x resolution of the last convs of x4 RRDBNet. Networks
+        that do not support hooks (e.g., TorchScript) assume 64 channels at the output resolution.
+        """
+        if self._pixel_cost is not None:
+            return self._pixel_cost
+        size = 4 * (self.get_mod_scale() or 1)
+        largest = 0
+
+        def hook(module, inputs, output):
+            nonlocal largest
+            if isinstance(output, torch.Tensor):
+                largest = max(largest, output.numel())
+
+        handles = []
+        try:
+            for module in self.model.modules():
+                handles.append(module.register_forward_hook(hook))
+            self.model(torch.zeros((1, 3, size, size), dtype=self.dtype, device=self.device))
+            self._pixel_cost = 2 * largest // (size * size)
+        except (AttributeError, RuntimeError):  # e.g., ScriptModule
+            self._pixel_cost = 2 * 64 * self.scale**2
+        finally:
+            for handle in handles:
+                handle.remove()
+        return self._pixel_cost
+
+    def get_max_batch(self, height, width, channel=3):
+        """Get the number of inputs of size (height, width) that fit into the memory budget in one forward pass.
+
+        The peak memory of one input is estimated with get_pixel_cost. On the CPU, the budget is capped (see
+        CPU_MEMORY_CAP), as the host running out of memory cannot be caught and recovered from.
+        """
+        budget = self.memory_budget
+        if budget is None:
+            if self.device.type == 'cuda':
+                budget = torch.cuda.mem_get_info(self.device)[0] // 2
+            else:
+                try:
+                    budget = os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') // 4
+                except (AttributeError, ValueError, OSError):
+                    budget = CPU_MEMORY_CAP
+                budget = min(budget, CPU_MEMORY_CAP)
+        element_size = torch.finfo(self.dtype).bits // 8
+        input_bytes = height * width * (self.get_pixel_cost() + channel * self.scale**2) * element_size
+        return int(min(max(budget // input_bytes, 1), 64))
+
+    def get_tile_batch(self, tile_height, tile_width, channel=3):
+        """Get the number of tiles that are upsampled in one forward pass.
+
+        When self.tile_batch is 0, it is derived from the memory budget. It is capped by max_tile_batch after
+        allocation failures.
+        """
+        if self.tile_batch > 0:
+            tile_batch = self.tile_batch
+        else:
+            tile_batch = self.get_max_batch(tile_height, tile_width, channel)
+        return tile_batch if self.max_tile_batch is None else min(tile_batch, self.max_tile_batch)
+
+    def resize_tile(self, output_tile, tile, valid_size, out_size):
+        """Resize an upsampled tile to the final output size on its device.
+
+        Args:
+            output_tile (Tensor): The upsampled padded tile.
+            tile (Tile): Geometry of the tile.
+            valid_size (tuple[int]): (h, w) of the upsampled image without the pre pad and mod pad.
+            out_size (tuple[int]): (h, w) of the final output.
+
+        Returns:
+            tuple: The resized tile and its (start_y, end_y, start_x, end_x) box on the final output. The tile is
+                None if it only covers the padded area.
+        """
+        pad_y0, _, pad_x0, _ = tile.pad_box
+        out_y0, out_y1, out_x0, out_x1 = tile.out_box
+        y0, y1 = _dst_range(out_y0, out_y1, valid_size[0], out_size[0])
+        x0, x1 = _dst_range(out_x0, out_x1, valid_size[1], out_size[1])
+        if y0 >= y1 or x0 >= x1:
+            return None, (y0, y1, x0, x1)
+        taps_y = lanczos_taps(y0, y1, valid_size[0], out_size[0], pad_y0 * self.scale, output_tile.size(2),
+                              output_tile.device)
+        taps_x = lanczos_taps(x0, x1, valid_size[1], out_size[1], pad_x0 * self.scale, output_tile.size(3),
+                              output_tile.device)
+        # like cv2, resize the clamped values
+        return resize_with_taps(output_tile.float().clamp(0, 1), taps_y, taps_x), (y0, y1, x0, x1)
+
+    def _tile_process(self, img, out_size=None, valid_size=None):
+        """It will first crop input images to tiles, and then process each tile.
+        Finally, all the processed tiles are merged into one images.
+
+        Tiles with the same padded shape are stacked along the batch dimension, so that several tiles are upsampled
+        in one forward pass (see tile_batch). With a tile cache, identical tiles of the image are upsampled once.
+
+        Modified from: https://github.com/ata4/esrgan-launcher
+
+        Args:
+            img (Tensor): The pre-processed input.
+            out_size (tuple[int]): If given, each tile is resized to the final output size (h, w) on the device
+                before it is stitched, so the image is never stitched at the network scale. Default: None.
+            valid_size (tuple[int]): (h, w) of the upsampled image without the pre pad and mod pad, required by
+                out_size. Default: None.
+        """
+        batch, channel, height, width = img.shape
+        if out_size is None:
+            output_shape = (batch, channel, height * self.scale, width * self.scale)
+        else:
+            output_shape = (batch, channel) + tuple(out_size)
+
+        # start with black image
+        output = img.new_zeros(output_shape)
+        tiles = self.get_tiles(height, width)
+
+        # near-constant tiles skip the network
+        flat_tiles = set(self.find_flat_tiles(img, tiles)) if self.flat_threshold is not None else set()
+        for tile in flat_tiles:
+            y0, y1, x0, x1 = tile.pad_box
+            self._put_tile(output, self._flat_process(img[:, :, y0:y1, x0:x1]), tile, out_size, valid_size)
+
+        # tiles in the tile cache skip the network, the others are put into the cache. Identical tiles of the image
+        # share one key, and only the first of them is upsampled.
+        # {key: [tiles]}
+        pending = {}
+        num_cached = 0
+        if self.tile_cache is not None:
+            for tile in tiles:
+                if tile in flat_tiles:
+                    continue
+                y0, y1, x0, x1 = tile.pad_box
+                key = self.tile_cache.key(img[:, :, y0:y1, x0:x1], self.model_key, self.scale)
+                if key in pending:
+                    pending[key].append(tile)
+                    continue
+                cached = self.tile_cache.get(key)
+                if cached is None:
+                    pending[key] = [tile]
+                else:
+                    self._put_tile(output, cached.to(output.device, output.dtype), tile, out_size, valid_size)
+                    num_cached += 1
+            num_duplicates = sum(len(same_tiles) - 1 for same_tiles in pending.values())
+            self.tile_cache.add_hits(num_duplicates)
+            num_cached += num_duplicates
+            # {first tile: [tiles]}
+            same_tiles = {same[0]: same for same in pending.values()}
+        else:
+            same_tiles = {tile: [tile] for tile in tiles if tile not in flat_tiles}
+
+        # group tiles by their padded shape. Inner tiles share the same shape, only border tiles differ.
+        groups = {}
+        for tile in same_tiles:
+            start_y, end_y, start_x, end_x = tile.pad_box
+            groups.setdefault((end_y - start_y, end_x - start_x), []).append(tile)
+
+        num_done = len(flat_tiles) + num_cached
+        keys = {same[0]: key for key, same in pending.items()}
+        for (tile_height, tile_width), group in groups.items():
+            tile_batch = self.get_tile_batch(tile_height, tile_width, channel)
+            for idx in range(0, len(group), tile_batch):
+                chunk = group[idx:idx + tile_batch]
+                # extract tiles from input image
+                input_tile = torch.cat([img[:, :, y0:y1, x0:x1] for (y0, y1, x0, x1), _, _ in chunk])
+
+                # upscale tiles, with smaller tiles if the memory runs out
+                output_tile = self._run_model(input_tile)
+                num_done += len(chunk)
+                print(f'\tTile {num_done}/{len(tiles)}')
+
+                # put tiles (and the identical ones) into output image
+                for i, tile in enumerate(chunk):
+                    for same_tile in same_tiles[tile]:
+                        self._put_tile(output, output_tile[i * batch:(i + 1) * batch], same_tile, out_size, valid_size)
+                    if tile in keys:
+                        self.tile_cache.put(keys[tile], output_tile[i * batch:(i + 1) * batch])
+
+        with self._lock:
+            self.tile_stats['tiles'] += len(tiles)
+            self.tile_stats['flat'] += len(flat_tiles)
+            self.tile_stats['cached'] += num_cached
+        if flat_tiles:
+            print(f'\tSkipped {len(flat_tiles)}/{len(tiles)} flat tiles')
+        if num_cached:
+            print(f'\tReused {num_cached}/{len(tiles)} cached tiles')
+        return output
+
+    def _put_tile(self, output, output_tile, tile, out_size=None, valid_size=None):
+        """Put an upsampled padded tile into the output image, resized to out_size if it is given."""
+        if out_size is not None:
+            resized, (y0, y1, x0, x1) = self.resize_tile(output_tile, tile, valid_size, out_size)
+            if resized is not None:
+                output[:, :, y0:y1, x0:x1] = resized
+            return
+        out_y0, out_y1, out_x0, out_x1 = tile.out_box
+        crop_y0, crop_y1, crop_x0, crop_x1 = tile.crop_box
+        output[:, :, out_y0:out_y1, out_x0:out_x1] = output_tile[:, :, crop_y0:crop_y1, crop_x0:crop_x1]
+
+    def find_flat_tiles(self, img, tiles):
+        """Find the tiles whose padded input is near-constant: (max - min) <= flat_threshold in all channels."""
+        ranges = []
+        for y0, y1, x0, x1 in (tile.pad_box for tile in tiles):
+            input_tile = img[:, :, y0:y1, x0:x1]
+            ranges.append((input_tile.amax(dim=(2, 3)) - input_tile.amin(dim=(2, 3))).max())
+        # one device synchronization for all the tiles
+        ranges = torch.stack(ranges).float().tolist()
+        return [tile for tile, value in zip(tiles, ranges) if value <= self.flat_threshold]
+
+    def _flat_process(self, input_tile):
+        """Upsample a near-constant tile without the network.
+
+        The output is the bicubic upsampling plus the offset that the network adds to a constant input of the mean
+        color, so the flat tiles match the network outputs of their neighbours and no seams appear. The offset is a
+        scale x scale pattern (e.g., of pixel shuffle), repeated for each input pixel.
+        """
+        _, _, height, width = input_tile.shape
+        mean = input_tile.float().mean(dim=(2, 3))
+        offsets = torch.stack([self.get_flat_offset(color, input_tile.dtype) for color in mean])
+        output = F.interpolate(input_tile.float(), scale_factor=self.scale, mode='bicubic', align_corners=False)
+        return output.add_(offsets.repeat(1, 1, height, width)).to(input_tile.dtype)
+
+    def get_flat_offset(self, color, dtype=torch.float32):
+        """Get the response of the network to a constant input, minus the color. Cached by the 8-bit color.
+
+        The response is not constant for networks that upsample with pixel shuffle (e.g., SRVGGNetCompact): it
+        repeats a scale x scale pattern, whose origin is at the output of an input pixel.
+
+        Args:
+            color (Tensor): Color with shape (c, ), in [0, 1] range.
+            dtype (torch.dtype): Dtype of the network input. Default: torch.float32.
+
+        Returns:
+            Tensor: The offset pattern with shape (c, scale, scale).
+        """
+        key = tuple(color.mul(255).round().long().tolist()) + (dtype, )
+        offset = self._flat_offsets.get(key)
+        if offset is None:
+            # the center of the patch does not see the borders
+            multiple = self.get_mod_scale() or 1
+            size = math.ceil((2 * self.tile_pad + 2) / multiple) * multiple
+            patch = torch.tensor(key[:-1], dtype=torch.float32, device=color.device).div_(255)
+            patch = patch.view(1, -1, 1, 1).expand(1, -1, size, size).to(dtype)
+            with torch.no_grad():
+                response = self.model(patch.contiguous())
+            center = size // 2 * self.scale
+            pattern = response[0, :, center:center + self.scale, center:center + self.scale].float()
+            offset = pattern - patch[0, :, :1, :1].float()
+            with self._lock:
+                self._flat_offsets[key] = offset
+        return offset
+
+    def tile_process(self):
+        self.output = self._tile_process(self.img)
+
+    def _post_process(self, output, mod_pad_h=0, mod_pad_w=0):
         # remove extra pad
-        if self.mod_scale is not None:
-            _, _, h, w = self.output.size()
-            self.output = self.output[:, :, 0:h - self.mod_pad_h * self.scale, 0:w - self.mod_pad_w * self.scale]
+        _, _, h, w = output.size()
+        output = output[:, :, 0:h - mod_pad_h * self.scale, 0:w - mod_pad_w * self.scale]
         # remove prepad
         if self.pre_pad != 0:
-            _, _, h, w = self.output.size()
-            self.output = self.output[:, :, 0:h - self.pre_pad * self.scale, 0:w - self.pre_pad * self.scale]
+            _, _, h, w = output.size()
+            output = output[:, :, 0:h - self.pre_pad * self.scale, 0:w - self.pre_pad * self.scale]
+        return output
+
+    def post_process(self):
+        if self.mod_scale is not None:
+            self.output = self._post_process(self.output, self.mod_pad_h, self.mod_pad_w)
+        else:
+            self.output = self._post_process(self.output)
         return self.output
 
-    @torch.no_grad()
-    def enhance(self, img, outscale=None, alpha_upsampler='realesrgan'):
-        h_input, w_input = img.shape[0:2]
+    def _upsample(self, img, outscale=None):
+        """Upsample a (n, 3, h, w) tensor with the reentrant pre-process, process and post-process.
+
+        If outscale differs from the network scale, the output is resized on the device: tile by tile in tile mode.
+        """
+        h_input, w_input = img.shape[2:]
+        out_size = None
+        if outscale is not None and outscale != float(self.scale):
+            out_size = (int(h_input * outscale), int(w_input * outscale))
+
+        img, mod_pad_h, mod_pad_w = self._pre_process(img, self.get_mod_scale())
+        tile_size = self.get_tile_size()
+        if tile_size > 0 and out_size is not None:
+            return self._tile_process(img, out_size, (h_input * self.scale, w_input * self.scale))
+        elif tile_size > 0:
+            output = self._tile_process(img)
+        else:
+            output = self._process(img)
+        output = self._post_process(output, mod_pad_h, mod_pad_w)
+        if out_size is not None:
+            output = lanczos_resize(output.float().clamp_(0, 1), out_size)
+        return output
+
+    def img2tensor(self, img, max_range, channels=(2, 1, 0)):
+        """Convert a numpy image to a normalized NCHW tensor with at most one host copy.
+
+        The channel selection (e.g., BGR to RGB), the type conversion and the normalization are fused into one
+        strided copy into the output tensor. On GPU, the raw image is uploaded and converted on the device.
+
+        Args:
+            img (ndarray): Image with shape (h, w, c) or (h, w). Any dtype.
+            max_range (int): The input is divided by max_range.
+            channels (tuple[int]): Channels of img that make up the channels of the tensor. For (h, w) images, the
+                single channel is repeated len(channels) times. Default: (2, 1, 0), that is, BGR to RGB.
+
+        Returns:
+            Tensor: With shape (1, len(channels), h, w).
+        """
+        if any(stride < 0 for stride in img.strides):
+            img = np.ascontiguousarray(img)
+        if img.dtype == np.uint16:  # torch has no uint16, wrap around after the conversion
+            src = torch.from_numpy(img.view(np.int16))
+        else:
+            src = torch.from_numpy(img)
+        src = src.to(self.device)
+
+        dtype = self.dtype
+        # fp16 and bf16 cannot hold 16-bit values exactly, so they are converted in fp32
+        buffer_dtype = torch.float32 if img.dtype == np.uint16 else dtype
+        tensor = torch.empty((1, len(channels)) + img.shape[0:2], dtype=buffer_dtype, device=self.device)
+        for i, c in enumerate(channels):
+            tensor[0, i].copy_(src if src.dim() == 2 else src[:, :, c])
+        if img.dtype == np.uint16:
+            tensor.remainder_(65536)
+        tensor.mul_(1. / max_range)
+        return tensor.to(dtype)
+
+    def split_input(self, img, alpha_upsampler='realesrgan'):
+        """Split a numpy image into the normalized RGB tensor and the alpha channel.
+
+        The bit depth comes from the dtype (uint8: 255, uint16: 65535). For other dtypes (e.g., float), it is
+        16-bit if the max value is larger than 256.
+
+        Returns:
+            tuple: RGB tensor with shape (1, 3, h, w) in [0, 1]; the alpha channel, None if there is no alpha channel,
+                a tensor with shape (1, 3, h, w) for the 'realesrgan' alpha upsampler, a tensor with shape
+                (1, 1, h, w) for 'guided', otherwise the (h, w) numpy array with the input dtype and range; the image
+                mode and the max range of the input.
+        """
         # img: numpy
-        img = img.astype(np.float32)
-        if np.max(img) > 256:  # 16-bit image
+        if img.dtype == np.uint16 or (img.dtype != np.uint8 and np.max(img) > 256):  # 16-bit image
             max_range = 65535
             print('\tInput is a 16-bit image')
         else:
             max_range = 255
-        img = img / max_range
+        alpha = None
         if len(img.shape) == 2:  # gray image
             img_mode = 'L'
-            img = cv2.cvtColor(img, cv2.COLOR_GRAY2RGB)
         elif img.shape[2] == 4:  # RGBA image with alpha channel
             img_mode = 'RGBA'
-            alpha = img[:, :, 3]
-            img = img[:, :, 0:3]
-            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
             if alpha_upsampler == 'realesrgan':
-                alpha = cv2.cvtColor(alpha, cv2.COLOR_GRAY2RGB)
+                alpha = self.img2tensor(img, max_range, channels=(3, 3, 3))
+            elif alpha_upsampler == 'guided':
+                alpha = self.img2tensor(img, max_range, channels=(3, ))
+            else:
+                alpha = img[:, :, 3]
         else:
             img_mode = 'RGB'
-            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        img = self.img2tensor(img, max_range)
+        return img, alpha, img_mode, max_range
 
-        # ------------------- process image (without the alpha channel) ------------------- #
-        self.pre_process(img)
-        if self.tile_size > 0:
-            self.tile_process()
-        else:
-            self.process()
-        output_img = self.post_process()
-        output_img = output_img.data.squeeze().float().cpu().clamp_(0, 1).numpy()
-        output_img = np.transpose(output_img[[2, 1, 0], :, :], (1, 2, 0))
+    def merge_output(self, output_img, output_alpha, img_mode, max_range, size, outscale=None):
+        """Convert the upsampled tensors back to a numpy image, the inverse of split_input.
+
+        Resizing to outscale, clamping, scaling and rounding happen on the device, and the channels are written
+        into the output array with one host copy.
+
+        Args:
+            output_img (Tensor): Upsampled RGB image with shape (1, 3, h, w).
+            output_alpha (Tensor | ndarray | None): Upsampled alpha channel. A tensor with shape (1, 3, h, w) or
+                (1, 1, h, w), or a numpy array in the input range.
+            img_mode (str): Image mode returned by split_input.
+            max_range (int): Max range returned by split_input.
+            size (tuple[int]): (h, w) of the input image.
+            outscale (float): The final upsampling scale of the image. Default: None, which keeps the size of
+                output_img.
+        """
+        if outscale is not None and outscale != float(self.scale):
+            out_size = (int(size[0] * outscale), int(size[1] * outscale))
+            output_img = lanczos_resize(output_img.float().clamp_(0, 1), out_size)
+            if isinstance(output_alpha, torch.Tensor):
+                output_alpha = lanczos_resize(output_alpha.float().clamp_(0, 1), out_size)
+            elif output_alpha is not None:
+                output_alpha = cv2.resize(output_alpha, out_size[::-1], interpolation=cv2.INTER_LANCZOS4)
+
+        output_img = output_img[0].float().clamp_(0, 1)
         if img_mode == 'L':
-            output_img = cv2.cvtColor(output_img, cv2.COLOR_BGR2GRAY)
+            planes = [output_img[0] * 0.299 + output_img[1] * 0.587 + output_img[2] * 0.114]
+        else:  # RGB to BGR
+            planes = [output_img[2], output_img[1], output_img[0]]
+        if isinstance(output_alpha, torch.Tensor):
+            output_alpha = output_alpha[0].float().clamp_(0, 1)
+            if output_alpha.size(0) == 3:
+                planes.append(output_alpha[0] * 0.299 + output_alpha[1] * 0.587 + output_alpha[2] * 0.114)
+            else:
+                planes.append(output_alpha[0])
+            output_alpha = None
+        planes = [plane.mul_(max_range).round_() for plane in planes]
 
-        # ------------------- process the alpha channel if necessary ------------------- #
-        if img_mode == 'RGBA':
-            if alpha_upsampler == 'realesrgan':
-                self.pre_process(alpha)
-                if self.tile_size > 0:
-                    self.tile_process()
-                else:
-                    self.process()
-                output_alpha = self.post_process()
-                output_alpha = output_alpha.data.squeeze().float().cpu().clamp_(0, 1).numpy()
-                output_alpha = np.transpose(output_alpha[[2, 1, 0], :, :], (1, 2, 0))
-                output_alpha = cv2.cvtColor(output_alpha, cv2.COLOR_BGR2GRAY)
-            else:  # use the cv2 resize for alpha channel
-                h, w = alpha.shape[0:2]
-                output_alpha = cv2.resize(alpha, (w * self.scale, h * self.scale), interpolation=cv2.INTER_LINEAR)
-
-            # merge the alpha channel
-            output_img = cv2.cvtColor(output_img, cv2.COLOR_BGR2BGRA)
-            output_img[:, :, 3] = output_alpha
+        dtype = np.uint16 if max_range == 65535 else np.uint8
+        h, w = planes[0].shape
+        num_channels = 4 if img_mode == 'RGBA' else len(planes)
+        if planes[0].device.type == 'cpu':
+            output = np.empty((h, w, num_channels), dtype=dtype)
+            for c, plane in enumerate(planes):
+                output[:, :, c] = plane.numpy()
+        else:  # convert on the device, then download once
+            output = torch.stack(planes, dim=2)
+            if dtype == np.uint8:
+                output = output.to(torch.uint8).cpu().numpy()
+            else:
+                output = output.to(torch.int32).cpu().numpy().astype(np.uint16)
+            if output_alpha is not None:
+                output = np.concatenate((output, np.zeros((h, w, 1), dtype=dtype)), axis=2)
+        if output_alpha is not None:  # the alpha channel resized by cv2
+            if output_alpha.dtype.kind == 'f':
+                output_alpha = np.clip(output_alpha, 0, max_range).round()
+            output[:, :, 3] = output_alpha
+        if img_mode == 'L':
+            output = output[:, :, 0]
+        return output
 
-        # ------------------------------ return ------------------------------ #
-        if max_range == 65535:  # 16-bit image
-            output = (output_img * 65535.0).round().astype(np.uint16)
+    def upsample_alpha(self, alpha, output_img, alpha_upsampler):
+        """Upsample the alpha channel without the network, to the size of output_img.
+
+        Args:
+            alpha (Tensor | ndarray): The alpha channel returned by split_input.
+            output_img (Tensor): The upsampled RGB image with shape (1, 3, h, w), used as the guidance of 'guided'.
+            alpha_upsampler (str): 'guided': bicubic upsampling refined by a guided filter, so that the alpha edges
+                follow the edges of the upsampled image. Others: linear resize (cv2 for numpy arrays).
+        """
+        h, w = output_img.shape[2:]
+        if alpha_upsampler == 'guided':
+            alpha = F.interpolate(alpha.float(), size=(h, w), mode='bicubic', align_corners=False)
+            output_img = output_img.float()
+            guide = output_img[:, 0:1] * 0.299 + output_img[:, 1:2] * 0.587 + output_img[:, 2:3] * 0.114
+            return guided_filter(guide, alpha.clamp_(0, 1), radius=self.scale, eps=1e-3)
+        elif isinstance(alpha, torch.Tensor):
+            return F.interpolate(alpha.float(), size=(h, w), mode='bilinear', align_corners=False)
+        # use the cv2 resize for alpha channel
+        return cv2.resize(alpha, (w, h), interpolation=cv2.INTER_LINEAR)
+
+    @torch.no_grad()
+    def enhance(self, img, outscale=None, alpha_upsampler='realesrgan'):
+        """Upsample a numpy image.
+
+        Args:
+            img (ndarray): Image with shape (h, w, c) in BGR(A) order, or (h, w) for gray images.
+            outscale (float): The final upsampling scale of the image. Default: None.
+            alpha_upsampler (str): The upsampler for the alpha channel. 'realesrgan': the network, the alpha channel
+                is stacked with the image into one batch. 'guided': bicubic upsampling refined by a guided filter with
+                the upsampled image, much cheaper than the network. Others: cv2 linear resize.
+                Default: 'realesrgan'.
+
+        Returns:
+            tuple: The output image and the image mode ('L', 'RGB' or 'RGBA').
+        """
+        h_input, w_input = img.shape[0:2]
+        img, alpha, img_mode, max_range = self.split_input(img, alpha_upsampler)
+
+        # ------------------- process image (and the alpha channel) ------------------- #
+        output_alpha = None
+        if img_mode == 'RGBA' and alpha_upsampler == 'realesrgan':
+            output = self._upsample(torch.cat((img, alpha)), outscale)
+            output_img, output_alpha = output[0:1], output[1:2]
         else:
-            output = (output_img * 255.0).round().astype(np.uint8)
+            output_img = self._upsample(img, outscale)
 
-        if outscale is not None and outscale != float(self.scale):
-            output = cv2.resize(
-                output, (
-                    int(w_input * outscale),
-                    int(h_input * outscale),
-                ), interpolation=cv2.INTER_LANCZOS4)
+        # ------------------- process the alpha channel if necessary ------------------- #
+        if img_mode == 'RGBA' and output_alpha is None:
+            output_alpha = self.upsample_alpha(alpha, output_img, alpha_upsampler)
 
+        # ------------------------------ return ------------------------------ #
+        # the output is already resized to outscale
+        output = self.merge_output(output_img, output_alpha, img_mode, max_range, (h_input, w_input))
         return output, img_mode
 
+    @torch.no_grad()
+    def enhance_batch(self, imgs, outscale=None, alpha_upsampler='realesrgan', batch_size=None):
+        """Upsample a list of images.
+
+        Images are bucketed by (h, w, mode), and each bucket is upsampled as NCHW batches.
+
+        Args:
+            imgs (list[ndarray]): Input images, same as enhance.
+            outscale (float): The final upsampling scale of the images. Default: None.
+            alpha_upsampler (str): The upsampler for the alpha channels. Default: 'realesrgan'.
+            batch_size (int): Max number of images (alpha channels included) in one batch. Default: None, which
+                derives it from the memory budget (see get_max_batch).
+
+        Returns:
+            list[tuple]: (output, img_mode) of each image, in the input order.
+        """
+        buckets = {}
+        for idx, img in enumerate(imgs):
+            if len(img.shape) == 2:
+                img_mode = 'L'
+            elif img.shape[2] == 4:
+                img_mode = 'RGBA'
+            else:
+                img_mode = 'RGB'
+            buckets.setdefault((img.shape[0], img.shape[1], img_mode), []).append(idx)
+
+        results = [None] * len(imgs)
+        for (h_input, w_input, img_mode), indices in buckets.items():
+            # the alpha channels are upsampled in the same batch
+            num_planes = 2 if img_mode == 'RGBA' and alpha_upsampler == 'realesrgan' else 1
+            max_batch = batch_size or self.get_max_batch(h_input + self.pre_pad, w_input + self.pre_pad)
+            chunk_size = max(max_batch // num_planes, 1)
+            for start in range(0, len(indices), chunk_size):
+                chunk = indices[start:start + chunk_size]
+                splits = [self.split_input(imgs[idx], alpha_upsampler) for idx in chunk]
+                planes = [img for img, _, _, _ in splits]
+                if num_planes == 2:
+                    planes += [alpha for _, alpha, _, _ in splits]
+
+                output = self._upsample(torch.cat(planes), outscale)
+
+                for i, (idx, (_, alpha, _, max_range)) in enumerate(zip(chunk, splits)):
+                    output_alpha = None
+                    if img_mode == 'RGBA':
+                        if num_planes == 2:
+                            output_alpha = output[len(chunk) + i:len(chunk) + i + 1]
+                        else:
+                            output_alpha = self.upsample_alpha(alpha, output[i:i + 1], alpha_upsampler)
+                    output_img = self.merge_output(output[i:i + 1], output_alpha, img_mode, max_range,
+                                                   (h_input, w_input))
+                    results[idx] = (output_img, img_mode)
+        return results
+
 
 class PrefetchReader(threading.Thread):
     """Prefetch images.
 
+    The images are decoded by a pool of num_workers threads, and yielded in the order of img_list. At most
+    num_prefetch_queue decoded images wait in the queue, so the reader blocks (back-pressure) when the consumer is
+    slower. Images that cannot be read are yielded as None. An error of img_list (e.g., of a folder scan) ends the
+    iteration, and it is raised in the consumer.
+
     Args:
-        img_list (list[str]): A image list of image paths to be read.
+        img_list (list[str]): A image list of image paths to be read. It can be an iterator, e.g., of a folder scan
+            that is still running.
         num_prefetch_queue (int): Number of prefetch queue.
+        num_workers (int): Number of decode threads. Default: 1.
+        with_path (bool): Yield (path, image) pairs instead of images. Default: False.
     """
 
-    def __init__(self, img_list, num_prefetch_queue):
-        super().__init__()
+    def __init__(self, img_list, num_prefetch_queue, num_workers=1, with_path=False):
+        super().__init__(daemon=True)  # do not block the exit when the consumer stops early
         self.que = queue.Queue(num_prefetch_queue)
         self.img_list = img_list
+        self.num_workers = max(num_workers, 1)
+        self.with_path = with_path
+        # total decode time (seconds) of the workers, for the utilization
+        self.busy = 0.
+        self.error = None
+        self._lock = threading.Lock()
 
-    def run(self):
-        for img_path in self.img_list:
-            img = cv2.imread(img_path, cv2.IMREAD_UNCHANGED)
-            self.que.put(img)
+    def _read(self, img_path):
+        start = time.perf_counter()
+        img = cv2.imread(img_path, cv2.IMREAD_UNCHANGED)
+        with self._lock:
+            self.busy += time.perf_counter() - start
+        return (img_path, img) if self.with_path else img
 
-        self.que.put(None)
+    def run(self):
+        try:
+            with ThreadPoolExecutor(self.num_workers) as pool:
+                pending = deque()
+                for img_path in self.img_list:
+                    pending.append(pool.submit(self._read, img_path))
+                    if len(pending) >= self.num_workers:
+                        self.que.put(pending.popleft().result())
+                while pending:
+                    self.que.put(pending.popleft().result())
+        except Exception as error:  # raised in the consumer, which would otherwise wait for _END forever
+            self.error = error
+        finally:
+            self.que.put(_END)
 
     def __next__(self):
         next_item = self.que.get()
-        if next_item is None:
+        if next_item is _END:
+            if self.error is not None:
+                raise self.error
             raise StopIteration
         return next_item
 
@@ -294,12 +1211,22 @@ class PrefetchReader(threading.Thread):
 
 
 class IOConsumer(threading.Thread):
+    """Write the upsampled images of a queue, until it gets 'quit'.
+
+    The messages are dicts with output (the image) and save_path. Several consumers can share one bounded queue,
+    e.g., to encode the large 4x PNG outputs in parallel. callback(msg, written) is called after each write, e.g.,
+    to report the progress.
+    """
 
-    def __init__(self, opt, que, qid):
+    def __init__(self, opt, que, qid, callback=None):
         super().__init__()
         self._queue = que
         self.qid = qid
         self.opt = opt
+        self.callback = callback
+        # encode time (seconds) and number of written images, for the utilization
+        self.busy = 0.
+        self.count = 0
 
     def run(self):
         while True:
@@ -309,5 +1236,15 @@ class IOConsumer(threading.Thread):
 
             output = msg['output']
             save_path = msg['save_path']
-            cv2.imwrite(save_path, output)
+            start = time.perf_counter()
+            try:
+                written = cv2.imwrite(save_path, output)
+            except cv2.error:  # e.g., unsupported extension, the other images are still written
+                written = False
+            if not written:
+                print(f'Error: cannot write {save_path}')
+            self.busy += time.perf_counter() - start
+            self.count += 1
+            if self.callback is not None:
+                self.callback(msg, written)
         print(f'IO worker {self.qid} is done.')
@@ -0,0 +1,126 @@
+import importlib
+import threading
+from collections import Counter, OrderedDict
+
+__all__ = ['MODELS', 'build_model', 'ModelRegistry']
+
+_RRDBNET = 'basicsr.archs.rrdbnet_arch.RRDBNet'
+_SRVGG = 'realesrgan.archs.srvgg_arch.SRVGGNetCompact'
+_RELEASES = 'https://github.com/xinntao/Real-ESRGAN/releases/download'
+
+# the model zoo: {model name: dict(arch, opt, netscale, urls)}
+MODELS = {
+    'RealESRGAN_x4plus':
+    dict(
+        arch=_RRDBNET,
+        opt=dict(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=4),
+        netscale=4,
+        urls=[f'{_RELEASES}/v0.1.0/RealESRGAN_x4plus.pth']),
+    'RealESRNet_x4plus':
+    dict(
+        arch=_RRDBNET,
+        opt=dict(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=4),
+        netscale=4,
+        urls=[f'{_RELEASES}/v0.1.1/RealESRNet_x4plus.pth']),
+    'RealESRGAN_x4plus_anime_6B':
+    dict(
+        arch=_RRDBNET,
+        opt=dict(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=6, num_grow_ch=32, scale=4),
+        netscale=4,
+        urls=[f'{_RELEASES}/v0.2.2.4/RealESRGAN_x4plus_anime_6B.pth']),
+    'RealESRGAN_x2plus':
+    dict(
+        arch=_RRDBNET,
+        opt=dict(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=2),
+        netscale=2,
+        urls=[f'{_RELEASES}/v0.2.1/RealESRGAN_x2plus.pth']),
+    'realesr-animevideov3':
+    dict(
+        arch=_SRVGG,
+        opt=dict(num_in_ch=3, num_out_ch=3, num_feat=64, num_conv=16, upscale=4, act_type='prelu'),
+        netscale=4,
+        urls=[f'{_RELEASES}/v0.2.5.0/realesr-animevideov3.pth']),
+    'realesr-general-x4v3':
+    dict(
+        arch=_SRVGG,
+        opt=dict(num_in_ch=3, num_out_ch=3, num_feat=64, num_conv=32, upscale=4, act_type='prelu'),
+        netscale=4,
+        urls=[f'{_RELEASES}/v0.2.5.0/realesr-general-wdn-x4v3.pth', f'{_RELEASES}/v0.2.5.0/realesr-general-x4v3.pth'])
+}
+
+
+def build_model(model_name):
+    """Build the (randomly initialized) network of a zoo model. The arch module is imported on demand."""
+    if model_name not in MODELS:
+        raise ValueError(f'Unsupported model: {model_name}. Options: {" | ".join(MODELS)}')
+    module_name, class_name = MODELS[model_name]['arch'].rsplit('.', 1)
+    arch = getattr(importlib.import_module(module_name), class_name)
+    return arch(**MODELS[model_name]['opt'])
+
+
+def _model_size(model):
+    return sum(t.numel() * t.element_size() for t in list(model.parameters()) + list(model.buffers()))
+
+
+class ModelRegistry():
+    """Process-wide cache of loaded models.
+
+    Models are keyed by (arch config, weights, dni_weight, precision, device), see RealESRGANer.registry_key. A repeat
+    request returns the already loaded eval() model, so it skips torch.load, dni and load_state_dict. The least
+    recently used models are evicted when the loaded models take more than memory_budget.
+
+    Usage:
+        registry = ModelRegistry(memory_budget=2 * 1024**3)
+        upsampler = RealESRGANer(..., registry=registry)  # loads the weights
+        upsampler = RealESRGANer(..., registry=registry)  # shares the loaded model
+        upsampler.warmup()  # load and run the models ahead of the requests
+
+    Args:
+        memory_budget (int): Max size (in bytes) of the parameters and buffers of the loaded models. Default: None,
+            which means no limit.
+    """
+
+    def __init__(self, memory_budget=None):
+        self.memory_budget = memory_budget
+        self.stats = Counter()
+        self._models = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __contains__(self, key):
+        return key in self._models
+
+    def __len__(self):
+        return len(self._models)
+
+    def get(self, key, build):
+        """Get a loaded model.
+
+        Args:
+            key (tuple): Key of the model.
+            build (callable): Called without arguments to load the model on a miss.
+
+        Returns:
+            nn.Module: The model in eval mode.
+        """
+        with self._lock:
+            model = self._models.get(key)
+            if model is not None:
+                self._models.move_to_end(key)
+                self.stats['hits'] += 1
+                return model
+
+            # loading under the lock: concurrent requests of the same model load it only once
+            self.stats['misses'] += 1
+            model = build().eval()
+            self._models[key] = model
+            if self.memory_budget is not None:
+                size = sum(_model_size(m) for m in self._models.values())
+                while size > self.memory_budget and len(self._models) > 1:
+                    _, evicted = self._models.popitem(last=False)
+                    size -= _model_size(evicted)
+                    self.stats['evictions'] += 1
+            return model
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
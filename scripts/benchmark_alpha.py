@@ -0,0 +1,70 @@
+import argparse
+import cv2
+import glob
+import numpy as np
+import os
+import time
+import torch
+
+from realesrgan import RealESRGANer
+from realesrgan.zoo import MODELS, build_model
+
+
+def two_pass(upsampler, img):
+    """The former behavior: the alpha channel is upsampled by a second full run of the network."""
+    output, _ = upsampler.enhance(img[:, :, 0:3])
+    output_alpha, _ = upsampler.enhance(cv2.cvtColor(img[:, :, 3], cv2.COLOR_GRAY2BGR))
+    output = cv2.cvtColor(output, cv2.COLOR_BGR2BGRA)
+    output[:, :, 3] = cv2.cvtColor(output_alpha, cv2.COLOR_BGR2GRAY)
+    return output
+
+
+def psnr(img1, img2, max_value=255.):
+    mse = np.mean((img1.astype(np.float64) - img2.astype(np.float64))**2)
+    return float('inf') if mse == 0 else 10. * np.log10(max_value**2 / mse)
+
+
+def main(args):
+    """Compare the alpha upsamplers with the former two-pass behavior (time and alpha PSNR)."""
+    device = torch.device(args.device) if args.device else None
+    upsampler = RealESRGANer(
+        scale=MODELS[args.model_name]['netscale'],
+        model_path=args.model_path,
+        model=build_model(args.model_name),
+        tile=args.tile,
+        pre_pad=0,
+        half=args.half,
+        device=device)
+
+    imgs = []
+    for path in sorted(glob.glob(os.path.join(args.input, '*'))):
+        img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+        if img is not None and img.ndim == 3 and img.shape[2] == 4 and img.dtype == np.uint8:
+            imgs.append(img)
+    assert imgs, f'No 8-bit RGBA images in {args.input}'
+
+    methods = {'two_pass': lambda img: two_pass(upsampler, img)}
+    for alpha_upsampler in ['realesrgan', 'guided', 'bilinear']:
+        methods[alpha_upsampler] = lambda img, a=alpha_upsampler: upsampler.enhance(img, alpha_upsampler=a)[0]
+
+    references = [methods['two_pass'](img) for img in imgs]  # also warms up
+    print(f'{len(imgs)} images, model: {args.model_name}, device: {upsampler.device}')
+    print(f'{"alpha_upsampler":<16}{"time (s/img)":>14}{"alpha PSNR (dB)":>18}')
+    for name, method in methods.items():
+        start = time.perf_counter()
+        outputs = [method(img) for img in imgs]
+        elapsed = (time.perf_counter() - start) / len(imgs)
+        alpha_psnr = np.mean([psnr(out[:, :, 3], ref[:, :, 3]) for out, ref in zip(outputs, references)])
+        print(f'{name:<16}{elapsed:>14.4f}{alpha_psnr:>18.2f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--input', type=str, required=True, help='Folder with RGBA png images')
+    parser.add_argument('--model_name', type=str, default='realesr-animevideov3')
+    parser.add_argument('--model_path', type=str, required=True, help='Path of the model weights')
+    parser.add_argument('--tile', type=int, default=0, help='Tile size, 0 for no tile')
+    parser.add_argument('--half', action='store_true', help='Use fp16')
+    parser.add_argument('--device', type=str, default=None, help='Device, e.g., cpu or cuda')
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,66 @@
+import argparse
+import os
+import time
+import torch
+
+from realesrgan.backends import build_backend
+from realesrgan.utils import load_checkpoint
+from realesrgan.zoo import MODELS, build_model
+
+
+def run(backend, img, repeat):
+    """Best time (seconds) of one forward pass, and the output."""
+    with torch.no_grad():
+        output = backend(img)  # the first call specializes the backend to the shape
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            backend(img)
+            times.append(time.perf_counter() - start)
+    return min(times), output.float()
+
+
+def main(args):
+    """Compare the execution backends with the eager network on the same tile-shaped inputs (parity and throughput).
+
+    The backends are the options of RealESRGANer(backend=...), e.g., trace, compile, onnx (ONNX Runtime on the CPU)
+    or the path of an exported ONNX file (scripts/pytorch2onnx.py).
+    """
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+    model = build_model(args.model_name)
+    if args.model_path is not None:
+        loadnet = load_checkpoint(args.model_path)
+        model.load_state_dict(loadnet['params_ema' if 'params_ema' in loadnet else 'params'], strict=True)
+    model.eval()
+
+    size = args.tile + 2 * args.tile_pad
+    img = torch.rand((args.batch, 3, size, size), generator=torch.Generator().manual_seed(0))
+    eager_time, reference = run(model, img, args.repeat)
+    print(f'{args.model_name}, input {tuple(img.shape)}, {torch.get_num_threads()} threads')
+    print(f'{"backend":<10}{"time (s)":>12}{"tiles/s":>10}{"speedup":>10}{"max diff":>12}')
+    print(f'{"torch":<10}{eager_time:>12.4f}{args.batch / eager_time:>10.2f}{1:>10.2f}{0:>12.2e}')
+    for name in args.backends:
+        elapsed, output = run(build_backend(model, name), img, args.repeat)
+        error = (output - reference).abs().max().item()
+        label = os.path.basename(name)
+        print(f'{label:<10}{elapsed:>12.4f}{args.batch / elapsed:>10.2f}{eager_time / elapsed:>10.2f}{error:>12.2e}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model_name', type=str, default='realesr-animevideov3', choices=list(MODELS))
+    parser.add_argument('--model_path', type=str, default=None, help='Weights. Default: random weights')
+    parser.add_argument(
+        '--backends',
+        type=str,
+        nargs='+',
+        default=['trace'],
+        help='Backends to compare with torch. Options: trace | compile | onnx | <path>.onnx')
+    parser.add_argument('--tile', type=int, default=128, help='Tile size')
+    parser.add_argument('--tile_pad', type=int, default=10, help='Tile padding')
+    parser.add_argument('--batch', type=int, default=1, help='Number of tiles in one forward pass')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of timed runs, the best is reported')
+    parser.add_argument('--threads', type=int, default=0, help='Number of CPU threads, 0 for the torch default')
+    args = parser.parse_args()
+    main(args)
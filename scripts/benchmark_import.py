@@ -0,0 +1,38 @@
+import argparse
+import subprocess
+import sys
+
+STATEMENTS = {
+    'inference': 'from realesrgan import RealESRGANer',
+    'compact model': "from realesrgan import build_model; build_model('realesr-animevideov3')",
+    'training': 'import realesrgan.models',
+}
+
+
+def import_time(statement):
+    """Import time (seconds) and the number of imported modules of a statement, in a fresh interpreter."""
+    code = ('import sys, time; start = time.perf_counter(); ' + statement +
+            '; print(time.perf_counter() - start, len(sys.modules))')
+    output = subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, text=True).stdout
+    elapsed, num_modules = output.split()
+    return float(elapsed), int(num_modules)
+
+
+def main(args):
+    """Report the import time of the inference and training entry points of realesrgan.
+
+    Run with -X importtime (e.g., python -X importtime -c "from realesrgan import RealESRGANer") to find the modules
+    that slow it down.
+    """
+    print(f'{"entry point":<16}{"import time (s)":>18}{"modules":>10}')
+    for name, statement in STATEMENTS.items():
+        results = [import_time(statement) for _ in range(args.repeat)]
+        elapsed = min(elapsed for elapsed, _ in results)
+        print(f'{name:<16}{elapsed:>18.3f}{results[0][1]:>10}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=3, help='Number of runs, the best is reported')
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,72 @@
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+
+def private_memory():
+    """Private (not shareable) memory of this process in bytes, the peak RSS if smaps_rollup is not available."""
+    try:
+        with open('/proc/self/smaps_rollup', 'r') as f:
+            fields = dict(line.split(':', 1) for line in f if ':' in line)
+        return sum(int(fields[k].split()[0]) for k in ('Private_Clean', 'Private_Dirty')) * 1024
+    except (OSError, KeyError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def child(args):
+    """Load the weights once, in a fresh process."""
+    import torch
+
+    from realesrgan.utils import load_checkpoint, mmap_path
+    from realesrgan.zoo import build_model
+
+    model = build_model(args.model_name)
+    base = private_memory()
+    start = time.perf_counter()
+    if args.mode == 'mmap':
+        loadnet = load_checkpoint(mmap_path(args.model_path))
+        model.load_state_dict(loadnet['params'], strict=True, assign=loadnet.get('mmap', False))
+    else:
+        loadnet = torch.load(args.model_path, map_location=torch.device('cpu'))
+        model.load_state_dict(loadnet['params_ema' if 'params_ema' in loadnet else 'params'], strict=True)
+    elapsed = time.perf_counter() - start
+    print(json.dumps(dict(time=elapsed, memory=private_memory() - base)))
+
+
+def main(args):
+    """Compare the weight loading of .pth pickles and memory-mapped .mmap.pth copies (scripts/convert_mmap.py).
+
+    Each run is a fresh process, like the startup of inference_realesrgan.py or of a video worker. The page cache is
+    warm after the first run, which is the case of several workers on one host.
+    """
+    print(f'{"mode":<8}{"load time (s)":>16}{"private memory (MB)":>22}')
+    for mode in ['pth', 'mmap']:
+        results = []
+        for _ in range(args.repeat):
+            cmd = [
+                sys.executable, __file__, '--child', mode, '--model_name', args.model_name, '--model_path',
+                args.model_path
+            ]
+            output = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+        load_time = min(r['time'] for r in results)
+        memory = min(r['memory'] for r in results) / 1024**2
+        print(f'{mode:<8}{load_time:>16.4f}{memory:>22.1f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model_name', type=str, default='RealESRGAN_x4plus')
+    parser.add_argument('--model_path', type=str, default=os.path.join('weights', 'RealESRGAN_x4plus.pth'))
+    parser.add_argument('--repeat', type=int, default=3, help='Number of runs of each mode, the best is reported')
+    parser.add_argument('--child', type=str, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child is not None:
+        args.mode = args.child
+        child(args)
+    else:
+        main(args)
@@ -0,0 +1,35 @@
+import argparse
+import glob
+import os
+
+from realesrgan.utils import save_mmap_checkpoint
+
+
+def main(args):
+    """Convert the weights of the model zoo (or the given checkpoints) for memory-mapped loading.
+
+    RealESRGANer loads weights/<model>.mmap.pth (weights/<model>.<precision>.mmap.pth in fp16 and bf16) instead of
+    weights/<model>.pth when it is not older than it.
+    """
+    paths = args.input or sorted(glob.glob(os.path.join(args.weights, '*.pth')))
+    for path in paths:
+        if path.endswith('.mmap.pth'):
+            continue
+        for precision in args.precision:
+            print(f'{path} -> {save_mmap_checkpoint(path, precision)}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--input', type=str, nargs='*', help='Checkpoints to convert. Default: all in --weights')
+    parser.add_argument('--weights', type=str, default='weights', help='Folder of the downloaded weights')
+    parser.add_argument(
+        '--precision',
+        type=str,
+        nargs='+',
+        default=['fp32'],
+        choices=['fp32', 'fp16', 'bf16'],
+        help=('Precisions of the copies, those that the model runs in, e.g., bf16 for --precision auto on CPUs with '
+              'native bf16 support'))
+    args = parser.parse_args()
+    main(args)
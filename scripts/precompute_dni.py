@@ -0,0 +1,42 @@
+import argparse
+import os
+import time
+
+from realesrgan.dni import blend_weights, dni_cache_path, quantize_dni_weight
+
+
+def main(args):
+    """Blend the weights of realesr-general-x4v3 for common denoise strengths ahead of time.
+
+    The blended weights are written to the cache folder, where RealESRGANer (and inference_realesrgan.py -dn) loads
+    them instead of blending the two checkpoints.
+    """
+    wdn_model_path = args.model_path.replace('realesr-general-x4v3', 'realesr-general-wdn-x4v3')
+    for path in (args.model_path, wdn_model_path):
+        assert os.path.isfile(path), f'{path} does not exist, run inference_realesrgan.py once to download it'
+
+    for strength in args.strengths:
+        dni_weight = quantize_dni_weight([strength, 1 - strength])
+        start = time.perf_counter()
+        blend_weights(args.model_path, wdn_model_path, dni_weight, cache_dir=args.cache_dir, max_files=args.max_files)
+        cache_path = dni_cache_path(args.model_path, wdn_model_path, dni_weight, cache_dir=args.cache_dir)
+        print(f'Denoise strength {dni_weight[0]:.2f}: {cache_path} ({time.perf_counter() - start:.2f} s)')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--model_path',
+        type=str,
+        default='weights/realesr-general-x4v3.pth',
+        help='Path of realesr-general-x4v3. realesr-general-wdn-x4v3 should be in the same folder')
+    parser.add_argument(
+        '--strengths',
+        type=float,
+        nargs='+',
+        default=[0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9],
+        help='Denoise strengths to blend')
+    parser.add_argument('--cache_dir', type=str, default=None, help='Cache folder. Default: $REALESRGAN_CACHE_DIR/dni')
+    parser.add_argument('--max_files', type=int, default=32, help='Max number of blended files in the cache folder')
+    args = parser.parse_args()
+    main(args)
@@ -1,36 +1,59 @@
 import argparse
+import numpy as np
+import os
 import torch
-import torch.onnx
-from basicsr.archs.rrdbnet_arch import RRDBNet
+
+from realesrgan.backends import OnnxBackend, export_onnx
+from realesrgan.utils import RealESRGANer
+from realesrgan.zoo import MODELS, build_model
 
 
 def main(args):
-    # An instance of the model
-    model = RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=4)
-    if args.params:
-        keyname = 'params'
-    else:
-        keyname = 'params_ema'
-    model.load_state_dict(torch.load(args.input)[keyname])
-    # set the train mode to false since we will only run the forward pass.
-    model.train(False)
-    model.cpu().eval()
-
-    # An example input
-    x = torch.rand(1, 3, 64, 64)
-    # Export the model
-    with torch.no_grad():
-        torch_out = torch.onnx._export(model, x, args.output, opset_version=11, export_params=True)
-    print(torch_out.shape)
+    """Convert a model of the zoo (optionally with DNI-blended weights) to ONNX, with dynamic spatial axes.
+
+    The exported network is checked against PyTorch with ONNX Runtime on an input of another size.
+    """
+    model_path = args.input or os.path.join('weights', args.model_name + '.pth')
+    dni_weight = None
+    if args.model_name == 'realesr-general-x4v3' and args.denoise_strength != 1:
+        wdn_model_path = model_path.replace('realesr-general-x4v3', 'realesr-general-wdn-x4v3')
+        model_path = [model_path, wdn_model_path]
+        dni_weight = [args.denoise_strength, 1 - args.denoise_strength]
+    upsampler = RealESRGANer(
+        scale=MODELS[args.model_name]['netscale'],
+        model_path=model_path,
+        dni_weight=dni_weight,
+        model=build_model(args.model_name),
+        half=False,
+        device=torch.device('cpu'))
+
+    output = args.output or os.path.join('weights', args.model_name + '.onnx')
+    export_onnx(upsampler.model, output, opset_version=args.opset)
+    print(f'Exported to {output}')
+
+    if args.check:
+        img = torch.rand(1, 3, 48, 80)
+        with torch.no_grad():
+            ref = upsampler.model(img)
+        onnx_out = OnnxBackend(output)(img)
+        assert onnx_out.shape == ref.shape, f'Shape mismatch: {tuple(onnx_out.shape)} vs {tuple(ref.shape)}'
+        print(f'Parity on {tuple(img.shape)}: max diff {np.abs((onnx_out - ref).numpy()).max():.2e}')
 
 
 if __name__ == '__main__':
     """Convert pytorch model to onnx models"""
     parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--model_name', type=str, default='RealESRGAN_x4plus', choices=list(MODELS))
+    parser.add_argument('--input', type=str, default=None, help='Input model path. Default: weights/<model_name>.pth')
+    parser.add_argument('--output', type=str, default=None, help='Output onnx path. Default: weights/<model_name>.onnx')
     parser.add_argument(
-        '--input', type=str, default='experiments/pretrained_models/RealESRGAN_x4plus.pth', help='Input model path')
-    parser.add_argument('--output', type=str, default='realesrgan-x4.onnx', help='Output onnx path')
-    parser.add_argument('--params', action='store_false', help='Use params instead of params_ema')
+        '-dn',
+        '--denoise_strength',
+        type=float,
+        default=1,
+        help='Denoise strength of realesr-general-x4v3 (DNI-blended with realesr-general-wdn-x4v3)')
+    parser.add_argument('--opset', type=int, default=11, help='ONNX opset version')
+    parser.add_argument('--check', action='store_true', help='Check the exported model with ONNX Runtime')
     args = parser.parse_args()
 
     main(args)
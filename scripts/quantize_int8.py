@@ -0,0 +1,115 @@
+import argparse
+import cv2
+import glob
+import numpy as np
+import os
+import time
+import torch
+
+from realesrgan.quantize import INT8_SUFFIX, load_quantized, quantize_static, save_quantized
+from realesrgan.utils import load_checkpoint
+from realesrgan.zoo import MODELS, build_model
+
+
+def read_images(folder):
+    paths = sorted(glob.glob(os.path.join(folder, '*')))
+    imgs = [cv2.imread(path, cv2.IMREAD_COLOR) for path in paths]
+    return [img for img in imgs if img is not None]
+
+
+def to_tensor(img):
+    return torch.from_numpy(np.transpose(img[:, :, [2, 1, 0]], (2, 0, 1)).astype(np.float32) / 255.).unsqueeze(0)
+
+
+def to_image(output):
+    output = output.squeeze(0).float().clamp_(0, 1).numpy()
+    return (np.transpose(output[[2, 1, 0], :, :], (1, 2, 0)) * 255.0).round().astype(np.uint8)
+
+
+def calib_crops(imgs, crop_size, num_crops, multiple=1, seed=0):
+    """Random crops of the calibration images, as (1, 3, size, size) inputs. The size is divisible by multiple."""
+    rng = np.random.default_rng(seed)
+    for i in range(num_crops):
+        img = imgs[i % len(imgs)]
+        h, w = img.shape[:2]
+        size = min(crop_size, h, w) // multiple * multiple
+        top, left = rng.integers(0, h - size + 1), rng.integers(0, w - size + 1)
+        yield to_tensor(img[top:top + size, left:left + size])
+
+
+@torch.no_grad()
+def evaluate(model, imgs, crop_size, multiple=1):
+    """Upsample the center crop (divisible by multiple) of each image. Returns the outputs and the total time
+    (seconds)."""
+    outputs, elapsed = [], 0
+    for img in imgs:
+        h, w = img.shape[:2]
+        size = min(crop_size, h, w) // multiple * multiple
+        top, left = (h - size) // 2, (w - size) // 2
+        inp = to_tensor(img[top:top + size, left:left + size])
+        model(inp)  # warm up
+        start = time.perf_counter()
+        output = model(inp)
+        elapsed += time.perf_counter() - start
+        outputs.append(to_image(output))
+    return outputs, elapsed
+
+
+def main(args):
+    """Calibrate and quantize a model to int8 for CPU inference, and compare it with fp32 on a held-out folder.
+
+    The quantized model is saved as weights/<model_name>.int8.pt, which inference_realesrgan.py loads with --int8.
+    """
+    from basicsr.metrics import calculate_psnr, calculate_ssim
+
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+    model = build_model(args.model_name)
+    loadnet = load_checkpoint(args.model_path or os.path.join('weights', args.model_name + '.pth'))
+    model.load_state_dict(loadnet['params_ema' if 'params_ema' in loadnet else 'params'], strict=True)
+    model.eval()
+
+    netscale = MODELS[args.model_name]['netscale']
+    # the inputs of x2 and x1 models are divisible by 2 and 4, see RealESRGANer.get_mod_scale
+    multiple = {2: 2, 1: 4}.get(netscale, 1)
+    calib_imgs = read_images(args.calib)
+    assert calib_imgs, f'No images in {args.calib}'
+    start = time.perf_counter()
+    quantized = quantize_static(model, calib_crops(calib_imgs, args.crop_size, args.num_crops, multiple))
+    print(f'Calibrated on {args.num_crops} crops of {len(calib_imgs)} images ({time.perf_counter() - start:.1f} s)')
+
+    output_path = args.output or os.path.join('weights', args.model_name + INT8_SUFFIX)
+    example = torch.rand(1, 3, args.crop_size // multiple * multiple, args.crop_size // multiple * multiple)
+    save_quantized(quantized, output_path, example, meta=dict(model_name=args.model_name, calib=args.calib))
+    print(f'Saved to {output_path}')
+
+    val_imgs = read_images(args.val)
+    if not val_imgs:
+        return
+    quantized = load_quantized(output_path)[0]
+    fp32_outputs, fp32_time = evaluate(model, val_imgs, args.crop_size, multiple)
+    int8_outputs, int8_time = evaluate(quantized, val_imgs, args.crop_size, multiple)
+    psnr = np.mean([calculate_psnr(a, b, crop_border=netscale) for a, b in zip(int8_outputs, fp32_outputs)])
+    ssim = np.mean([calculate_ssim(a, b, crop_border=netscale) for a, b in zip(int8_outputs, fp32_outputs)])
+    print(f'{len(val_imgs)} images, {args.crop_size} center crops, {torch.get_num_threads()} threads')
+    print(f'int8 vs fp32: PSNR {psnr:.2f} dB, SSIM {ssim:.4f}')
+    print(f'fp32 {fp32_time:.3f} s, int8 {int8_time:.3f} s, speedup {fp32_time / int8_time:.2f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    # x2 and x1 RRDBNet are not supported, see quantize_static
+    parser.add_argument(
+        '--model_name',
+        type=str,
+        default='realesr-animevideov3',
+        choices=[name for name, config in MODELS.items() if config['netscale'] == 4])
+    parser.add_argument('--model_path', type=str, default=None, help='fp32 weights. Default: weights/<model_name>.pth')
+    parser.add_argument('--calib', type=str, required=True, help='Folder of calibration images')
+    parser.add_argument('--val', type=str, required=True, help='Held-out folder to compare int8 with fp32')
+    parser.add_argument('--output', type=str, default=None, help='Default: weights/<model_name>.int8.pt')
+    parser.add_argument('--crop_size', type=int, default=128, help='Size of the calibration and validation crops')
+    parser.add_argument('--num_crops', type=int, default=64, help='Number of calibration crops')
+    parser.add_argument('--threads', type=int, default=0, help='Number of CPU threads, 0 for the torch default')
+    args = parser.parse_args()
+    main(args)
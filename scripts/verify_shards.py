@@ -0,0 +1,86 @@
+import argparse
+import glob
+import os
+import sys
+from collections import defaultdict
+
+from realesrgan.discovery import iter_inputs
+from realesrgan.manifest import Manifest, file_hash
+
+
+def main(args):
+    """Verify that every input of a sharded batch job produced exactly one output, and merge the shard manifests.
+
+    The manifests of the shards (<output>/manifest.shard<i>of<n>.jsonl, written by inference_realesrgan.py
+    --shard-index/--shard-count) are checked against the inputs. An input fails if it:
+    - has no record, or its output does not exist (missing);
+    - is recorded by several shards (duplicated);
+    - has changed since it was processed (stale);
+    - shares its output with another input (collision).
+    If all the inputs pass, the merged manifest is written to <output>/manifest.jsonl, which a later run without
+    shards uses to skip the finished images. The shard videos of inference_realesrgan_video.py are checked and merged
+    by its --merge-shards.
+    """
+    manifest_paths = sorted(glob.glob(os.path.join(args.output, 'manifest.shard*.jsonl')))
+    assert manifest_paths, f'No shard manifests in {args.output}'
+    # {absolute input path: [(manifest name, record)]}
+    records = defaultdict(list)
+    for path in manifest_paths:
+        for input_path, record in Manifest(path).records.items():
+            records[input_path].append((os.path.basename(path), record))
+
+    missing, duplicated, stale = [], [], []
+    outputs = defaultdict(list)
+    merged = {}
+    num_inputs = 0
+    for path in iter_inputs(args.input, args.input_list, recursive=args.recursive, exclude=args.output):
+        num_inputs += 1
+        entries = records.pop(os.path.abspath(path), [])
+        if not entries or not os.path.isfile(entries[-1][1]['output']):
+            missing.append(path)
+            continue
+        if len(entries) > 1:
+            duplicated.append(f'{path} ({", ".join(name for name, _ in entries)})')
+        record = entries[-1][1]
+        try:
+            stat = os.stat(path)
+            if stat.st_size != record['size'] or (stat.st_mtime_ns != record['mtime_ns']
+                                                  and file_hash(path) != record['hash']):
+                stale.append(path)
+        except OSError:  # a listed input that was removed
+            missing.append(path)
+            continue
+        outputs[record['output']].append(path)
+        merged[record['input']] = record
+    collisions = [f'{output} <- {", ".join(paths)}' for output, paths in outputs.items() if len(paths) > 1]
+    params = {record['params'] for record in merged.values()}
+
+    print(f'{num_inputs} inputs, {len(merged)} outputs, {len(manifest_paths)} shard manifests')
+    for name, problems in [('Missing', missing), ('Duplicated', duplicated), ('Stale', stale),
+                           ('Output collisions', collisions)]:
+        if problems:
+            print(f'{name}: {len(problems)}')
+            for problem in problems[:args.max_print]:
+                print(f'\t{problem}')
+    if len(params) > 1:
+        print(f'Warning: the shards ran with {len(params)} different parameter sets')
+    if records:
+        print(f'Note: {len(records)} recorded inputs are not in the input set any more')
+
+    if missing or duplicated or stale or collisions:
+        sys.exit(1)
+    manifest = Manifest(os.path.join(args.output, 'manifest.jsonl'))
+    manifest.records = merged
+    manifest.compact()
+    print(f'OK. Merged manifest: {manifest.path}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--input', type=str, default='inputs', help='Input folder of the job, or - for stdin')
+    parser.add_argument('--input_list', type=str, default=None, help='A file with one input path per line')
+    parser.add_argument('-r', '--recursive', action='store_true', help='The job processed the sub-folders')
+    parser.add_argument('-o', '--output', type=str, default='results', help='Output folder of the job')
+    parser.add_argument('--max_print', type=int, default=20, help='Max number of listed problems of each kind')
+    args = parser.parse_args()
+    main(args)
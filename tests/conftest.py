@@ -0,0 +1,26 @@
+import pytest
+import torch
+
+from realesrgan.archs.srvgg_arch import SRVGGNetCompact
+from realesrgan.utils import RealESRGANer
+
+
+@pytest.fixture
+def build_restorer(tmp_path):
+    """Build RealESRGANers with a small, randomly initialized SRVGGNetCompact.
+
+    The weights are saved once to tmp_path/compact.pth. The keyword arguments are passed to RealESRGANer, and they
+    override the defaults (model_path, fp32 on the CPU).
+    """
+
+    def build(**kwargs):
+        torch.manual_seed(0)
+        model = SRVGGNetCompact(num_in_ch=3, num_out_ch=3, num_feat=8, num_conv=2, upscale=4, act_type='prelu')
+        model_path = str(tmp_path / 'compact.pth')
+        if not (tmp_path / 'compact.pth').exists():
+            torch.save({'params': model.state_dict()}, model_path)
+        model = SRVGGNetCompact(num_in_ch=3, num_out_ch=3, num_feat=8, num_conv=2, upscale=4, act_type='prelu')
+        kwargs = {'model_path': model_path, 'half': False, 'device': torch.device('cpu'), **kwargs}
+        return RealESRGANer(scale=4, model=model, **kwargs)
+
+    return build
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from realesrgan.backends import OnnxBackend, TorchScriptBackend, export_onnx
+
+
+def test_trace_backend(build_restorer):
+    img = (np.random.random((37, 29, 3)) * 255).astype(np.uint8)
+    ref, _ = build_restorer(tile=8, tile_pad=4, pre_pad=0).enhance(img)
+
+    restorer = build_restorer(tile=8, tile_pad=4, pre_pad=0, backend='trace')
+    assert isinstance(restorer.backend, TorchScriptBackend)
+    output, _ = restorer.enhance(img)
+    np.testing.assert_allclose(output, ref, atol=1)
+    # one graph per tile shape
+    shapes = {(y1 - y0, x1 - x0) for (y0, y1, x0, x1), _, _ in restorer.get_tiles(37, 29)}
+    assert len(restorer.backend._graphs) == len(shapes)
+    # the network (e.g., shared by a ModelRegistry) is not converted to channels_last
+    assert all(param.is_contiguous() for param in restorer.model.parameters())
+
+
+def test_onnx_backend(tmp_path, monkeypatch, build_restorer):
+    pytest.importorskip('onnxruntime')
+    monkeypatch.setenv('REALESRGAN_CACHE_DIR', str(tmp_path / 'cache'))
+    img = (np.random.random((37, 29, 3)) * 255).astype(np.uint8)
+    ref, _ = build_restorer(tile=8, tile_pad=4, pre_pad=0).enhance(img)
+
+    restorer = build_restorer(tile=8, tile_pad=4, pre_pad=0, backend='onnx')
+    assert isinstance(restorer.backend, OnnxBackend)
+    assert restorer.backend.model_path.startswith(str(tmp_path / 'cache'))
+    output, _ = restorer.enhance(img)
+    np.testing.assert_allclose(output, ref, atol=1)
+
+    # dynamic spatial axes: the whole image in one pass
+    model_path = str(tmp_path / 'compact.onnx')
+    export_onnx(restorer.model, model_path)
+    output, _ = build_restorer(pre_pad=0, backend=model_path).enhance(img)
+    assert output.shape == (37 * 4, 29 * 4, 3)
@@ -0,0 +1,18 @@
+import os
+import pytest
+
+from realesrgan.cache import atomic_write
+
+
+def test_atomic_write(tmp_path):
+    path = str(tmp_path / 'sub' / 'file.txt')
+    with atomic_write(path) as tmp, open(tmp, 'w') as f:
+        f.write('a')
+    # a failed write keeps the old file, and removes the temporary one
+    with pytest.raises(ValueError):
+        with atomic_write(path) as tmp, open(tmp, 'w') as f:
+            f.write('b')
+            raise ValueError
+    with open(path) as f:
+        assert f.read() == 'a'
+    assert os.listdir(tmp_path / 'sub') == ['file.txt']
@@ -0,0 +1,33 @@
+import os
+
+from realesrgan.discovery import filter_shard, iter_inputs, scan_images, shard_of, shard_range
+
+
+def test_discovery(tmp_path):
+    for name in ['a.png', 'b.JPG', 'notes.txt', 'sub/c.webp', 'sub/deeper/d.png', 'results/a_out.png']:
+        os.makedirs(os.path.dirname(tmp_path / name), exist_ok=True)
+        (tmp_path / name).write_bytes(b'')
+
+    def relative(paths):
+        return sorted(os.path.relpath(path, tmp_path) for path in paths)
+
+    assert relative(scan_images(str(tmp_path))) == ['a.png', 'b.JPG']
+    # links to folders are not followed, e.g., a loop to the parent folder
+    os.symlink(tmp_path, tmp_path / 'sub' / 'loop')
+    expected = ['a.png', 'b.JPG', os.path.join('sub', 'c.webp'), os.path.join('sub', 'deeper', 'd.png')]
+    assert relative(scan_images(str(tmp_path), recursive=True, exclude=str(tmp_path / 'results'))) == expected
+    (tmp_path / 'list.txt').write_text('# inputs\nx.png\n\n  y.png\n')
+    assert list(iter_inputs('ignored', str(tmp_path / 'list.txt'))) == ['x.png', 'y.png']
+
+
+def test_sharding(tmp_path):
+    paths = [str(tmp_path / 'sub' / f'{i}.png') for i in range(200)]
+    shards = [list(filter_shard(paths, i, 3, root=str(tmp_path))) for i in range(3)]
+    # a partition of the inputs, which does not depend on the order, the other inputs or the input root
+    assert sorted(sum(shards, [])) == sorted(paths)
+    assert all(shards)
+    assert list(filter_shard(paths[::-1], 1, 3, root=str(tmp_path))) == shards[1][::-1]
+    assigned = [shard_of(path, 3, str(tmp_path)) for path in paths[:10]]
+    assert assigned == [shard_of(os.path.join('/elsewhere', 'sub', f'{i}.png'), 3, '/elsewhere') for i in range(10)]
+    # the frames of a video are split into contiguous ranges
+    assert [shard_range(10, i, 3) for i in range(3)] == [(0, 3), (3, 6), (6, 10)]
@@ -0,0 +1,38 @@
+import os
+import torch
+
+from realesrgan.archs.srvgg_arch import SRVGGNetCompact
+from realesrgan.dni import blend_weights, quantize_dni_weight
+from realesrgan.utils import RealESRGANer
+
+
+def test_dni_cache(tmp_path, monkeypatch):
+    monkeypatch.setenv('REALESRGAN_CACHE_DIR', str(tmp_path / 'cache'))
+    torch.manual_seed(0)
+    model = SRVGGNetCompact(num_in_ch=3, num_out_ch=3, num_feat=8, num_conv=2, upscale=4, act_type='prelu')
+    paths = [str(tmp_path / 'a.pth'), str(tmp_path / 'b.pth')]
+    for path in paths:
+        torch.save({'params': model.state_dict()}, path)
+        model = SRVGGNetCompact(num_in_ch=3, num_out_ch=3, num_feat=8, num_conv=2, upscale=4, act_type='prelu')
+
+    net_a, net_b = (torch.load(path)['params'] for path in paths)
+    blended = blend_weights(paths[0], paths[1], [0.3, 0.7])
+    for k, v in blended['params'].items():
+        torch.testing.assert_close(v, 0.3 * net_a[k] + 0.7 * net_b[k])
+    assert len(os.listdir(tmp_path / 'cache' / 'dni')) == 1
+
+    # nearby strengths share one file, which is loaded instead of blended
+    loaded = []
+    torch_load = torch.load
+    monkeypatch.setattr(torch, 'load', lambda path, **kwargs: loaded.append(path) or torch_load(path, **kwargs))
+    restorer = RealESRGANer(
+        scale=4, model_path=paths, dni_weight=[0.301, 0.699], model=model, tile_pad=4, device=torch.device('cpu'))
+    assert len(loaded) == 1 and os.path.dirname(loaded[0]) == str(tmp_path / 'cache' / 'dni')
+    for k, v in restorer.model.state_dict().items():
+        torch.testing.assert_close(v, blended['params'][k])
+
+    # the quantized weights sum to 1, and they are not quantized without the cache
+    assert quantize_dni_weight([0.235, 0.765]) == [0.23, 0.77]
+    blended = blend_weights(paths[0], paths[1], [0.235, 0.765], cache_dir=False)
+    for k, v in blended['params'].items():
+        torch.testing.assert_close(v, 0.235 * net_a[k] + 0.765 * net_b[k])
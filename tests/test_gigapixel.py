@@ -0,0 +1,16 @@
+import numpy as np
+
+from realesrgan.gigapixel import enhance_large
+
+
+def test_enhance_large(tmp_path, build_restorer):
+    restorer = build_restorer(tile=8, tile_pad=4, pre_pad=2)
+    img = (np.random.random((37, 29, 4)) * 255).astype(np.uint8)
+    np.save(tmp_path / 'input.npy', img)
+
+    img_mode = enhance_large(restorer, str(tmp_path / 'input.npy'), str(tmp_path / 'output.npy'))
+    assert img_mode == 'RGBA'
+    output = np.load(tmp_path / 'output.npy')
+    ref, _ = restorer.enhance(img)
+    assert output.shape == ref.shape
+    np.testing.assert_allclose(output, ref, atol=1)
@@ -0,0 +1,33 @@
+import os
+
+from realesrgan.manifest import Manifest, params_key
+
+
+def test_manifest(tmp_path):
+    inputs = [tmp_path / f'{i}.png' for i in range(3)]
+    for i, path in enumerate(inputs):
+        path.write_bytes(bytes([i]) * 16)
+        (tmp_path / f'{i}_out.png').write_bytes(b'out')
+    key = params_key({'model_name': 'realesr-animevideov3', 'outscale': 4})
+    manifest = Manifest(str(tmp_path / 'manifest.jsonl'))
+    for i, path in enumerate(inputs[:2]):
+        manifest.record(str(path), str(tmp_path / f'{i}_out.png'), key)
+
+    # reloaded, e.g., after a crash
+    manifest = Manifest(str(tmp_path / 'manifest.jsonl'))
+    assert [manifest.is_done(str(path), key) for path in inputs] == [True, True, False]
+    assert not manifest.is_done(str(inputs[0]), params_key({'model_name': 'realesr-animevideov3', 'outscale': 2}))
+    # touched but unchanged inputs are up to date, changed inputs or removed outputs are not
+    os.utime(inputs[0], ns=(0, 0))
+    assert manifest.is_done(str(inputs[0]), key)
+    inputs[1].write_bytes(b'x' * 16)
+    os.utime(inputs[1], ns=(0, 0))
+    assert not manifest.is_done(str(inputs[1]), key)
+    os.remove(tmp_path / '0_out.png')
+    assert not manifest.is_done(str(inputs[0]), key)
+
+    # removed inputs are not done, and cannot be recorded (without raising on the writer threads)
+    manifest.record(str(inputs[2]), str(tmp_path / '2_out.png'), key)
+    os.remove(inputs[2])
+    assert not manifest.is_done(str(inputs[2]), key)
+    manifest.record(str(inputs[2]), str(tmp_path / '2_out.png'), key)
@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+import torch
+from basicsr.archs.rrdbnet_arch import RRDBNet
+
+from realesrgan.quantize import quantize_static, save_quantized
+from realesrgan.utils import RealESRGANer
+
+
+def test_int8_quantize(tmp_path, build_restorer):
+    img = (np.random.random((37, 29, 3)) * 255).astype(np.uint8)
+    restorer = build_restorer(tile=16, tile_pad=4, pre_pad=0)
+    ref, _ = restorer.enhance(img)
+
+    calib = [torch.rand(1, 3, 24, 24) for _ in range(8)]
+    quantized = quantize_static(restorer.model, calib)
+    model_path = str(tmp_path / 'compact.int8.pt')
+    save_quantized(quantized, model_path, calib[0])
+    int8_restorer = RealESRGANer(scale=4, model_path=model_path, model=None, tile=16, tile_pad=4, pre_pad=0)
+    assert int8_restorer.device.type == 'cpu' and not int8_restorer.half
+    output, _ = int8_restorer.enhance(img)
+    assert output.shape == ref.shape
+    assert np.abs(output.astype(np.float32) - ref).mean() < 8
+
+    # FX cannot trace the pixel unshuffle of x2 and x1 RRDBNet
+    model = RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=8, num_block=1, num_grow_ch=4, scale=2)
+    with pytest.raises(AssertionError, match='x4'):
+        quantize_static(model, calib)
@@ -0,0 +1,17 @@
+from realesrgan.receptive_field import get_tile_pad, receptive_field
+
+
+def test_tile_pad_auto(tmp_path, monkeypatch, build_restorer):
+    monkeypatch.setenv('REALESRGAN_CACHE_DIR', str(tmp_path / 'cache'))
+    restorer = build_restorer(tile=8, tile_pad='auto', pre_pad=0)
+    # num_conv=2: 4 chained 3x3 convs
+    assert receptive_field(restorer.model) == 4
+    assert 0 <= restorer.tile_pad <= 4
+    assert (tmp_path / 'cache' / 'tile_pad.json').is_file()
+    # no probe without tiles
+    (tmp_path / 'cache' / 'tile_pad.json').unlink()
+    assert build_restorer(tile_pad='auto').tile_pad == 10
+    assert not (tmp_path / 'cache' / 'tile_pad.json').exists()
+
+    # without the tolerance, the pad covers the whole receptive field
+    assert get_tile_pad(restorer.model, 4, tol=0) == 4
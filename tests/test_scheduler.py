@@ -0,0 +1,19 @@
+import numpy as np
+
+from realesrgan.scheduler import TileScheduler
+
+
+def test_tile_scheduler(build_restorer):
+    restorer = build_restorer(tile=8, tile_pad=4, pre_pad=0)
+    imgs = [(np.random.random((37, 29, 3)) * 255).astype(np.uint8) for _ in range(3)]
+    imgs.append((np.random.random((20, 24, 4)) * 255).astype(np.uint8))
+
+    with TileScheduler(restorer, batch_size=5) as scheduler:
+        futures = [scheduler.submit(img, outscale=2) for img in imgs]
+        results = [future.result() for future in futures]
+
+    for img, (output, img_mode) in zip(imgs, results):
+        ref, ref_mode = restorer.enhance(img, outscale=2)
+        assert img_mode == ref_mode
+        assert output.shape == ref.shape
+        np.testing.assert_allclose(output, ref, atol=1)
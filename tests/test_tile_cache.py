@@ -0,0 +1,37 @@
+import numpy as np
+import os
+import torch
+
+from realesrgan.archs.srvgg_arch import SRVGGNetCompact
+from realesrgan.tile_cache import TileCache
+
+
+def test_tile_cache(tmp_path, build_restorer):
+    # a periodic image, whose inner tiles are identical
+    img = np.tile((np.random.random((8, 8, 3)) * 255).astype(np.uint8), (5, 5, 1))
+    ref, _ = build_restorer(tile=8, tile_pad=4, pre_pad=0).enhance(img)
+
+    tile_cache = TileCache(cache_dir=str(tmp_path / 'tiles'))
+    restorer = build_restorer(tile=8, tile_pad=4, pre_pad=0, tile_cache=tile_cache)
+    output, _ = restorer.enhance(img)
+    np.testing.assert_allclose(output, ref, atol=1)
+    assert tile_cache.stats['memory_hits'] > 0
+    output, _ = restorer.enhance(img, outscale=2)
+    assert tile_cache.stats['misses'] == restorer.tile_stats['tiles'] - restorer.tile_stats['cached']
+
+    # the on-disk tier is shared between runs
+    tile_cache = TileCache(cache_dir=str(tmp_path / 'tiles'))
+    restorer = build_restorer(tile=8, tile_pad=4, pre_pad=0, tile_cache=tile_cache)
+    output, _ = restorer.enhance(img)
+    np.testing.assert_allclose(output, ref, atol=1)
+    assert tile_cache.stats['disk_hits'] > 0 and tile_cache.stats['misses'] == 0
+
+    # replaced weights of the same name and size do not hit the tiles of the old ones
+    torch.manual_seed(1)
+    model = SRVGGNetCompact(num_in_ch=3, num_out_ch=3, num_feat=8, num_conv=2, upscale=4, act_type='prelu')
+    torch.save({'params': model.state_dict()}, str(tmp_path / 'compact.pth'))
+    stat = os.stat(tmp_path / 'compact.pth')
+    os.utime(tmp_path / 'compact.pth', ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    tile_cache = TileCache(cache_dir=str(tmp_path / 'tiles'))
+    build_restorer(tile=8, tile_pad=4, pre_pad=0, tile_cache=tile_cache).enhance(img)
+    assert tile_cache.stats['disk_hits'] == 0
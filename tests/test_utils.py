@@ -1,7 +1,19 @@
+import cv2
+import importlib
 import numpy as np
+import os
+import pytest
+import queue
+import subprocess
+import sys
+import torch
+import warnings
 from basicsr.archs.rrdbnet_arch import RRDBNet
+from concurrent.futures import ThreadPoolExecutor
 
-from realesrgan.utils import RealESRGANer
+from realesrgan.tile_cache import TileCache
+from realesrgan.utils import (IOConsumer, PrefetchReader, RealESRGANer, has_mmap_copy, mmap_path, resolve_precision,
+                              save_mmap_checkpoint, set_intra_op_threads)
 
 
 def test_realesrganer():
@@ -85,3 +97,255 @@ def test_realesrganer():
     result = restorer.enhance(img, outscale=2, alpha_upsampler=None)
     assert result[0].shape == (8, 8, 4)
     assert result[1] == 'RGBA'
+
+
+def test_tile_batch(build_restorer):
+    img = (np.random.random((37, 29, 3)) * 255).astype(np.uint8)
+    restorer = build_restorer(tile=8, tile_pad=4, pre_pad=0)
+    ref, _ = restorer.enhance(img)
+
+    for tile_batch in [4, 0]:
+        restorer = build_restorer(tile=8, tile_pad=4, pre_pad=0, tile_batch=tile_batch)
+        output, _ = restorer.enhance(img)
+        assert output.shape == (148, 116, 3)
+        np.testing.assert_allclose(output, ref, atol=1)
+
+    # the peak is measured: the last conv outputs 3 * 4**2 channels, it is alive with its input and the output
+    restorer = build_restorer(memory_budget=(2 * 3 * 4**2 + 3 * 4**2) * 4 * 10 * 10 * 5)
+    assert restorer.get_pixel_cost() == 2 * 3 * 4**2
+    assert restorer.get_max_batch(10, 10) == 5
+
+
+class LimitedMemoryModel():
+    """Raise an allocation failure for inputs larger than max_pixels, like a device that runs out of memory."""
+
+    def __init__(self, model, max_pixels):
+        self.model = model
+        self.max_pixels = max_pixels
+
+    def __call__(self, img):
+        if img.numel() // img.size(1) > self.max_pixels:
+            raise RuntimeError('CUDA out of memory. Tried to allocate 2.00 GiB')
+        return self.model(img)
+
+
+def test_oom_fallback(build_restorer):
+    img = (np.random.random((37, 29, 3)) * 255).astype(np.uint8)
+    restorer = build_restorer(tile=0, tile_pad=4, pre_pad=0)
+    ref, _ = restorer.enhance(img)
+
+    # no tile: falls back to tiling
+    restorer.model = LimitedMemoryModel(restorer.model, 24 * 24)
+    output, _ = restorer.enhance(img)
+    np.testing.assert_allclose(output, ref, atol=1)
+    assert restorer.max_tile_size is not None and restorer.get_tile_size() == restorer.max_tile_size
+
+    # batched tiles: the batch of the four 36x36 tiles is split, then the tiles are subdivided
+    img = (np.random.random((64, 64, 3)) * 255).astype(np.uint8)
+    ref, _ = build_restorer(tile=0, pre_pad=0).enhance(img)
+    restorer = build_restorer(tile=32, tile_pad=4, pre_pad=0, tile_batch=4)
+    restorer.model = LimitedMemoryModel(restorer.model, 24 * 24)
+    output, _ = restorer.enhance(img)
+    np.testing.assert_allclose(output, ref, atol=1)
+    assert restorer.max_tile_batch == 1
+    assert restorer.max_tile_size is not None and restorer.max_tile_size < 32
+
+    # with a tile pad, the padded tiles are smaller than the input, or the allocation failure is raised
+    img = (np.random.random((37, 29, 3)) * 255).astype(np.uint8)
+    ref, _ = build_restorer(tile=0, pre_pad=0).enhance(img)
+    restorer = build_restorer(tile=0, tile_pad=4, pre_pad=0)
+    restorer.model = LimitedMemoryModel(restorer.model, 16 * 16)
+    output, _ = restorer.enhance(img)
+    np.testing.assert_allclose(output, ref, atol=1)
+    restorer = build_restorer(tile=0, tile_pad=10, pre_pad=0)
+    restorer.model = LimitedMemoryModel(restorer.model, 20 * 20)
+    with pytest.raises(RuntimeError, match='out of memory'):
+        restorer.enhance(img)
+
+    # other errors are raised
+    def broken_model(img):
+        raise RuntimeError('Given groups=1, weight of size [8, 3, 3, 3], expected input to have 3 channels')
+
+    restorer.model = broken_model
+    with pytest.raises(RuntimeError, match='expected input'):
+        restorer.enhance(img)
+
+
+def test_flat_tiles(build_restorer):
+    img = np.full((48, 48, 3), (30, 128, 200), dtype=np.uint8)
+    img[18:30, 18:30] = (np.random.random((12, 12, 3)) * 255).astype(np.uint8)
+    ref, _ = build_restorer(tile=8, tile_pad=4, pre_pad=0).enhance(img)
+
+    restorer = build_restorer(tile=8, tile_pad=4, pre_pad=0, flat_threshold=1 / 255)
+    output, _ = restorer.enhance(img)
+    assert output.shape == ref.shape
+    assert 0 < restorer.tile_stats['flat'] < restorer.tile_stats['tiles'] == 36
+    # the same as the network, apart from the zero padding of the network at the image borders
+    np.testing.assert_allclose(output[16:-16, 16:-16], ref[16:-16, 16:-16], atol=1)
+
+
+def test_mmap_checkpoint(tmp_path, build_restorer):
+    restorer = build_restorer(tile_pad=4)
+    params = {k: v * 2 for k, v in restorer.model.state_dict().items()}
+    # the memory-mappable copy is preferred, here it has different weights to tell which one is loaded
+    torch.save({'params': params}, mmap_path(str(tmp_path / 'compact.pth')))
+    restorer = build_restorer(tile_pad=4)
+    for k, v in restorer.model.state_dict().items():
+        torch.testing.assert_close(v, params[k])
+
+    # the copy written for the worker processes is mapped with the same weights
+    torch.save({'params': params}, str(tmp_path / 'compact.pth'))
+    assert save_mmap_checkpoint(str(tmp_path / 'compact.pth')) == mmap_path(str(tmp_path / 'compact.pth'))
+    restorer = build_restorer(tile_pad=4)
+    for k, v in restorer.model.state_dict().items():
+        torch.testing.assert_close(v, params[k])
+
+    # a copy that is older than the updated checkpoint is ignored
+    torch.save({'params': {k: v * 3 for k, v in params.items()}}, str(tmp_path / 'compact.pth'))
+    stat = os.stat(tmp_path / 'compact.pth')
+    os.utime(tmp_path / 'compact.pth', ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert not has_mmap_copy(str(tmp_path / 'compact.pth'))
+    with pytest.warns(UserWarning, match='older than'):
+        restorer = build_restorer(tile_pad=4)
+    for k, v in restorer.model.state_dict().items():
+        torch.testing.assert_close(v, params[k] * 3)
+
+    # the copy of another precision is stored in its dtype, so that it is mapped without a cast
+    save_path = save_mmap_checkpoint(str(tmp_path / 'compact.pth'), 'bf16')
+    assert save_path == mmap_path(str(tmp_path / 'compact.pth'), 'bf16') and save_path.endswith('.bf16.mmap.pth')
+    os.utime(save_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))  # as new as the updated checkpoint
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        restorer = build_restorer(tile_pad=4, precision='bf16')
+    for k, v in restorer.model.state_dict().items():
+        torch.testing.assert_close(v, (params[k] * 3).bfloat16())
+    with pytest.warns(UserWarning, match='not in bf16'):
+        build_restorer(model_path=mmap_path(str(tmp_path / 'compact.pth')), precision='bf16')
+
+
+def test_lazy_import():
+    import realesrgan
+    for module, names in realesrgan._EXPORTS.items():
+        if module != 'version':
+            assert names == importlib.import_module(f'realesrgan.{module}').__all__
+
+    # inference does not import the training stack (basicsr) on import
+    code = ('import sys; from realesrgan import RealESRGANer, build_model; build_model("realesr-animevideov3"); '
+            'assert not any(name.split(".")[0] == "basicsr" for name in sys.modules), "basicsr is imported"')
+    subprocess.run([sys.executable, '-c', code], check=True)
+
+
+def test_precision(tmp_path, build_restorer):
+    with pytest.warns(UserWarning):
+        assert resolve_precision('fp16', 'cpu') == 'fp32'
+    assert resolve_precision('auto', 'cpu') in ('bf16', 'fp32')
+    assert build_restorer(precision='auto').dtype != torch.float16
+
+    img = (np.random.random((37, 29, 3)) * 255).astype(np.uint8)
+    ref, _ = build_restorer(tile=8, tile_pad=4, pre_pad=0).enhance(img)
+    restorer = build_restorer(
+        tile=8, tile_pad=4, pre_pad=0, precision='bf16', tile_cache=TileCache(cache_dir=str(tmp_path / 't')))
+    assert restorer.precision == 'bf16' and next(restorer.model.parameters()).dtype == torch.bfloat16
+    for _ in range(2):  # the second run reads the cached bf16 tiles
+        output, _ = restorer.enhance(img)
+        assert np.abs(output.astype(np.float32) - ref).mean() < 2
+
+
+def test_read_write_pipeline(tmp_path):
+    paths = []
+    for i in range(6):
+        paths.append(str(tmp_path / f'{i}.png'))
+        cv2.imwrite(paths[-1], np.full((4 + i, 5, 3), i, dtype=np.uint8))
+    paths.insert(3, str(tmp_path / 'missing.png'))
+
+    # decoded by a pool, yielded in order
+    reader = PrefetchReader(paths, 2, num_workers=3)
+    reader.start()
+    imgs = list(reader)
+    assert len(imgs) == len(paths) and imgs[3] is None
+    assert [img.shape[0] for img in imgs if img is not None] == [4, 5, 6, 7, 8, 9]
+
+    # an error of the path iterator is raised in the consumer, instead of blocking it
+    def failing_paths():
+        yield paths[0]
+        raise OSError('Too many levels of symbolic links')
+
+    reader = PrefetchReader(failing_paths(), 2)
+    reader.start()
+    assert next(reader).shape[0] == 4
+    with pytest.raises(OSError, match='symbolic links'):
+        next(reader)
+
+    que = queue.Queue(2)
+    writers = [IOConsumer(None, que, qid) for qid in range(2)]
+    for writer in writers:
+        writer.start()
+    for i, img in enumerate(img for img in imgs if img is not None):
+        que.put({'output': img, 'save_path': str(tmp_path / f'out_{i}.png')})
+    for writer in writers:
+        que.put('quit')
+    for writer in writers:
+        writer.join()
+    assert sum(writer.count for writer in writers) == 6
+    assert cv2.imread(str(tmp_path / 'out_5.png')).shape == (9, 5, 3)
+
+
+def test_outscale_resize(build_restorer):
+    img = (np.random.random((37, 29, 3)) * 255).astype(np.uint8)
+    restorer = build_restorer(pre_pad=0)
+    full, _ = restorer.enhance(img)
+    tiled_restorer = build_restorer(tile=8, tile_pad=4, pre_pad=0)
+
+    for outscale in [2, 3.5, 5]:
+        size = (int(29 * outscale), int(37 * outscale))
+        ref = cv2.resize(full, size, interpolation=cv2.INTER_LANCZOS4)
+        output, _ = restorer.enhance(img, outscale=outscale)
+        assert output.shape == ref.shape
+        np.testing.assert_allclose(output, ref, atol=2)
+        # tiles are resized on the device before stitching
+        output, _ = tiled_restorer.enhance(img, outscale=outscale)
+        assert output.shape == ref.shape
+        np.testing.assert_allclose(output, ref, atol=2)
+
+
+def test_enhance_thread_safe(build_restorer):
+    restorer = build_restorer(tile=8, tile_pad=4, pre_pad=2)
+    imgs = [(np.random.random((17 + i, 23, 3)) * 255).astype(np.uint8) for i in range(8)]
+    refs = [restorer.enhance(img)[0] for img in imgs]
+
+    num_threads = torch.get_num_threads()
+    assert set_intra_op_threads(4, num_cores=8) == 2
+    with ThreadPoolExecutor(4) as executor:
+        results = list(executor.map(lambda img: restorer.enhance(img)[0], imgs))
+    torch.set_num_threads(num_threads)
+    for output, ref in zip(results, refs):
+        np.testing.assert_array_equal(output, ref)
+
+
+def test_enhance_batch(build_restorer):
+    restorer = build_restorer(pre_pad=2)
+    imgs = [(np.random.random((12, 10, 3)) * 255).astype(np.uint8) for _ in range(3)]
+    imgs.insert(1, (np.random.random((8, 8)) * 255).astype(np.uint8))
+    imgs.append((np.random.random((12, 10, 4)) * 255).astype(np.uint8))
+
+    results = restorer.enhance_batch(imgs, outscale=2, batch_size=2)
+    assert len(results) == len(imgs)
+    for img, (output, img_mode) in zip(imgs, results):
+        ref, ref_mode = restorer.enhance(img, outscale=2)
+        assert img_mode == ref_mode
+        np.testing.assert_allclose(output, ref, atol=1)
+
+
+def test_enhance_alpha(build_restorer):
+    restorer = build_restorer(pre_pad=0)
+    img = (np.random.random((12, 10, 4)) * 255).astype(np.uint8)
+
+    # the alpha channel stacked into the same batch gives the same result as a separate run
+    output, img_mode = restorer.enhance(img, alpha_upsampler='realesrgan')
+    assert img_mode == 'RGBA'
+    ref_alpha, _ = restorer.enhance(np.repeat(img[:, :, 3:4], 3, axis=2))
+    np.testing.assert_allclose(output[:, :, 3], cv2.cvtColor(ref_alpha, cv2.COLOR_BGR2GRAY), atol=1)
+
+    output, _ = restorer.enhance(img, alpha_upsampler='guided')
+    assert output.shape == (48, 40, 4)
+    assert output.dtype == np.uint8
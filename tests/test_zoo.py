@@ -0,0 +1,21 @@
+from realesrgan.archs.srvgg_arch import SRVGGNetCompact
+from realesrgan.zoo import ModelRegistry, build_model
+
+
+def test_model_registry(build_restorer):
+    registry = ModelRegistry()
+    restorer = build_restorer(tile_pad=4, registry=registry, precision='fp32')
+    restorer2 = build_restorer(tile_pad=4, registry=registry, precision='fp32')
+    assert restorer2.model is restorer.model
+    assert registry.stats['hits'] == 1 and registry.stats['misses'] == 1
+    # another precision is another model
+    restorer3 = build_restorer(tile_pad=4, registry=registry, precision='bf16')
+    assert restorer3.model is not restorer.model and len(registry) == 2
+
+    # the least recently used models are evicted
+    registry = ModelRegistry(memory_budget=1)
+    build_restorer(tile_pad=4, registry=registry, precision='fp32')
+    build_restorer(tile_pad=4, registry=registry, precision='bf16')
+    assert len(registry) == 1 and registry.stats['evictions'] == 1
+
+    assert isinstance(build_model('realesr-animevideov3'), SRVGGNetCompact)